@@ -0,0 +1,49 @@
+"""
+Micro-benchmark: compiling the party configuration of every combination of a suite.
+
+Compares the per-combination path (`compile_party_config`, which reads and parses the party conf YAML each time)
+with a `PartyTemplate` parsed once per suite and rendered per combination.
+
+Usage (from the repository root, with llm_eval installed, e.g. `pip install -e .`):
+    python benchmarks/bench_party_template.py [--party-conf PATH] [--combinations N]
+"""
+import argparse
+import time
+from llm_eval.party_template import PartyTemplate
+from llm_eval.service import compile_party_config
+
+
+def bench_compile_party_config(party_conf, instr_lists):
+    start = time.perf_counter()
+    for init_instr_list in instr_lists:
+        compile_party_config(party_conf, init_instr_list)
+    return time.perf_counter() - start
+
+
+def bench_party_template(party_conf, instr_lists):
+    start = time.perf_counter()
+    template = PartyTemplate.from_file(party_conf)
+    for init_instr_list in instr_lists:
+        template.render(init_instr_list)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark party configuration compilation.')
+    parser.add_argument('--party-conf', '-p', type=str, default='tests/data/test_party_conf.yaml', help='Party configuration file')
+    parser.add_argument('--combinations', '-n', type=int, default=500, help='Number of combinations to compile')
+    args = parser.parse_args()
+
+    num_attendees = PartyTemplate.from_file(args.party_conf).num_attendees
+    instr_lists = [tuple(f'Instruction {i} for attendee {a}' for a in range(num_attendees)) for i in range(args.combinations)]
+
+    baseline = bench_compile_party_config(args.party_conf, instr_lists)
+    template = bench_party_template(args.party_conf, instr_lists)
+    print(f'combinations:          {args.combinations}')
+    print(f'compile_party_config:  {baseline:.4f} s ({baseline / args.combinations * 1e6:.1f} us/combination)')
+    print(f'PartyTemplate.render:  {template:.4f} s ({template / args.combinations * 1e6:.1f} us/combination)')
+    print(f'speedup:               {baseline / template:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
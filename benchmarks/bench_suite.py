@@ -0,0 +1,217 @@
+"""
+End-to-end benchmark: `run_exp_suite` against the local fake provider.
+
+Builds a throwaway workspace with generated instruction files, a party conf whose attendees use `llm_api: fake` and
+an exp conf, then conducts the suite with the asyncio engine. The fake provider's latency distribution, error rate
+and response size are configurable, so the overhead of the runner itself (config compilation, scheduling,
+serialization) can be measured without network access.
+
+Reports sessions/sec, turns/sec, peak RSS and the time spent in each stage of the runner.
+
+Usage (from the repository root, with llm_eval installed, e.g. `pip install -e .`):
+    python benchmarks/bench_suite.py [--combinations N] [--rounds R] [--turns T] [--max-concurrency J]
+                                     [--latency S] [--latency-distribution D] [--error-rate P]
+                                     [--response-chars C] [--result-format files|jsonl] [--fork-prefix-turns K]
+                                     [--server-slots S] [--batch-size B] [--max-wait-ms W]
+                                     [--latency-sigma G] [--hedge-after H] [--attempt-timeout T] [--judge]
+                                     [--json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import contextlib
+import yaml
+from llm_eval.controller import run_exp_suite
+from llm_eval.metrics import MetricsRecorder
+from llm_eval.providers import FakeProvider, register_provider
+from llm_eval.sink import RESULT_FORMATS, make_sink
+
+NUM_ATTENDEES = 2
+
+
+def make_workspace(root, args):
+    """Write the instruction files, party conf and exp conf of the benchmark suite to `root`."""
+    # Spread the combinations over the two attendees: a x b == args.combinations
+    per_dir = [args.combinations, 1]
+    for size in range(int(args.combinations ** 0.5), 0, -1):
+        if args.combinations % size == 0:
+            per_dir = [args.combinations // size, size]
+            break
+    init_instr_dirs = []
+    for attendee, count in enumerate(per_dir):
+        dir_path = os.path.join(root, f'instructions_{attendee}')
+        os.makedirs(dir_path)
+        for i in range(count):
+            with open(os.path.join(dir_path, f'instr_{i:05d}.txt'), 'w') as file:
+                file.write(f'Instruction {i} for attendee {attendee}. ' * 20)
+        init_instr_dirs.append(dir_path)
+
+    llm_api_params = {
+        'model': 'bench',
+        'temperature': 0.5,
+        'top_p': 0.5,
+        'frequency_penalty': 0,
+        'presence_penalty': 0,
+        'retries': args.retries,
+        'sleep_period': 0,
+        'latency': args.latency,
+        'latency_distribution': args.latency_distribution,
+        'error_rate': args.error_rate,
+        'response_chars': args.response_chars,
+        'latency_sigma': args.latency_sigma,
+    }
+    tail_latency = {}
+    if args.hedge_after:
+        tail_latency['hedge_after'] = float(args.hedge_after) if args.hedge_after[0].isdigit() else args.hedge_after
+    if args.attempt_timeout:
+        tail_latency['attempt_timeout'] = args.attempt_timeout
+    if args.server_slots:
+        llm_api_params['max_concurrent_calls'] = args.server_slots
+    party_conf_dict = {
+        'title': 'Benchmark',
+        'purpose': 'Benchmark',
+        'status': 'initialized',
+        'attendees': [
+            {
+                'type': 'LLMAgent',
+                'name': f'Agent {attendee}',
+                'role': f'role {attendee}',
+                'instruction': {'target': 'Benchmark', 'version': '1.0.0', 'hash': '0x0', 'text': ''},
+                'attendee_params': {'tail_latency': tail_latency} if tail_latency else {},
+                'llm_api': 'fake',
+                'llm_api_params': llm_api_params,
+            }
+            for attendee in range(NUM_ATTENDEES)
+        ],
+        'settings': {'max_sent_message': args.turns},
+        'chat_history': [],
+        'finish_reason': None,
+        'start_at': None,
+        'updated_at': None,
+        'end_at': None,
+    }
+    party_conf = os.path.join(root, 'party_conf.yaml')
+    with open(party_conf, 'w') as file:
+        yaml.dump(party_conf_dict, file)
+    exp_conf = os.path.join(root, 'exp_conf.yaml')
+    with open(exp_conf, 'w') as file:
+        exp_conf_dict = {'num_rounds': args.rounds}
+        if args.fork_prefix_turns:
+            exp_conf_dict['fork'] = {'prefix_turns': args.fork_prefix_turns}
+        if args.judge:
+            judge_params = {key: llm_api_params[key] for key in ('latency', 'latency_distribution', 'latency_sigma')}
+            exp_conf_dict['scoring'] = {
+                'rules': ['turn_count', 'mean_message_chars'],
+                'judge': {'llm_api': 'fake', 'llm_api_params': dict(judge_params, model='judge'),
+                          'instruction': 'Rate the conversation from 1 to 10.'},
+                'concurrency': args.max_concurrency,
+            }
+        if args.batch_size:
+            exp_conf_dict['batching'] = {'max_batch_size': args.batch_size, 'max_wait_ms': args.max_wait_ms}
+        yaml.dump(exp_conf_dict, file)
+    return {
+        'exp suite': 'bench',
+        'init instr dirs': init_instr_dirs,
+        'party conf': party_conf,
+        'exp conf': exp_conf,
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB (ru_maxrss is in KiB on Linux and in bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_benchmark(args):
+    register_provider('fake', FakeProvider(args.seed))
+    # llm_eval imports llm_party on first use; keep the import out of the measurement
+    import llm_party  # noqa: F401
+    metrics = MetricsRecorder()
+    with tempfile.TemporaryDirectory(prefix='llm_eval_bench_') as root:
+        exp_suite = make_workspace(root, args)
+        output_dir = os.path.join(root, 'output')
+        os.makedirs(output_dir)
+        sink = make_sink(output_dir, args.result_format)
+        # Session progress lines would dominate the output and the measurement
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            try:
+                results = run_exp_suite(exp_suite, False, output_dir, max_concurrency=args.max_concurrency,
+                                        engine='asyncio', sink=sink, metrics=metrics)
+            finally:
+                sink.close()
+            elapsed = time.perf_counter() - start
+
+    summary = metrics.summary()
+    turns = sum(model['turns'] for model in summary['models'].values())
+    sessions = sum(1 for result in results if result.ok)
+    return {
+        'sessions': sessions,
+        'failed_sessions': len(results) - sessions,
+        'turns': turns,
+        'wall_seconds': elapsed,
+        'sessions_per_second': sessions / elapsed,
+        'turns_per_second': turns / elapsed,
+        'peak_rss_mb': peak_rss_mb(),
+        'stage_seconds': summary['stage_seconds'],
+        'turn_seconds': summary['models'].get('fake/bench', {}).get('turn_seconds'),
+        'batch_size': summary['models'].get('fake/bench', {}).get('batch_size'),
+        'hedges': summary['models'].get('fake/bench', {}).get('hedges', 0),
+        'timeouts': summary['models'].get('fake/bench', {}).get('timeouts', 0),
+        'round_seconds': summary['suites'].get('bench', {}).get('round_seconds'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark run_exp_suite end-to-end against the fake provider.')
+    parser.add_argument('--combinations', '-n', type=int, default=50, help='Number of instruction combinations')
+    parser.add_argument('--rounds', '-r', type=int, default=2, help='Rounds per combination')
+    parser.add_argument('--turns', '-t', type=int, default=6, help='Messages per session (max_sent_message)')
+    parser.add_argument('--max-concurrency', '-j', type=int, default=16, help='Sessions conducted at the same time')
+    parser.add_argument('--latency', type=float, default=0.01, help='Mean provider latency in seconds')
+    parser.add_argument('--latency-distribution', type=str, default='exponential',
+                        choices=['constant', 'uniform', 'exponential', 'lognormal'], help='Provider latency distribution')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Probability that a provider call fails')
+    parser.add_argument('--retries', type=int, default=3, help='Retries per turn after a provider error')
+    parser.add_argument('--response-chars', type=int, default=500, help='Length of each response')
+    parser.add_argument('--result-format', type=str, default='jsonl', choices=RESULT_FORMATS, help='Result format')
+    parser.add_argument('--fork-prefix-turns', type=int, default=0, help='Share this many opening turns between sessions (0: no forking)')
+    parser.add_argument('--server-slots', type=int, default=0, help='Calls the fake provider serves at a time (0: no limit)')
+    parser.add_argument('--batch-size', type=int, default=0, help='Batch the turns of concurrent sessions up to this size (0: no batching)')
+    parser.add_argument('--max-wait-ms', type=float, default=5, help='Longest wait of a turn for its batch to fill')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='Shape of the lognormal latency distribution')
+    parser.add_argument('--hedge-after', type=str, help="Hedge provider calls after this many seconds or a percentile such as p95")
+    parser.add_argument('--attempt-timeout', type=float, help='Abandon and retry provider calls after this many seconds')
+    parser.add_argument('--judge', action='store_true', help='Score every session with rules and a fake LLM judge')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the fake provider')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"sessions:        {report['sessions']} ({report['failed_sessions']} failed)")
+    print(f"turns:           {report['turns']}")
+    print(f"wall time:       {report['wall_seconds']:.3f} s")
+    print(f"sessions/sec:    {report['sessions_per_second']:.1f}")
+    print(f"turns/sec:       {report['turns_per_second']:.1f}")
+    if report['batch_size'] and report['batch_size']['count']:
+        print(f"batch size:      {report['batch_size']['mean']:.1f} mean, {report['batch_size']['count']} batches")
+    if report['round_seconds'] and report['round_seconds']['count']:
+        print(f"round seconds:   p50 {report['round_seconds']['p50']:.3f}, p99 {report['round_seconds']['p99']:.3f}, "
+              f"max {report['round_seconds']['max']:.3f}")
+    if report['hedges'] or report['timeouts']:
+        print(f"hedges:          {report['hedges']}, timeouts: {report['timeouts']}")
+    print(f"peak RSS:        {report['peak_rss_mb']:.1f} MiB")
+    for stage, seconds in sorted(report['stage_seconds'].items()):
+        print(f"stage {stage + ':':<14}{seconds:.3f} s (summed over sessions)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+import math
+import threading
+import importlib
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from llm_party.model.session_models import ChatSession
+
+RoundMetric = Callable[["ChatSession", Dict[str, Any]], float]
+
+# Two-sided 95% critical values of Student's t distribution by degrees of freedom
+_T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+         2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+         2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+_Z_95 = 1.96
+
+
+def turn_count(chat_session: "ChatSession", metadata: Dict[str, Any]) -> float:
+    """Number of messages in the session."""
+    return float(len(chat_session.chat_history))
+
+
+def finish_reason(chat_session: "ChatSession", metadata: Dict[str, Any]) -> float:
+    """1 if the session completed successfully, 0 otherwise. The mean is the success rate of the combination."""
+    return 1.0 if chat_session.status == 'completed_successfully' else 0.0
+
+
+def mean_message_chars(chat_session: "ChatSession", metadata: Dict[str, Any]) -> float:
+    """Average number of characters per message, 0 for an empty session."""
+    chat_history = chat_session.chat_history
+    return sum(len(message.text) for message in chat_history) / len(chat_history) if chat_history else 0.0
+
+
+_round_metrics: Dict[str, RoundMetric] = {
+    'turn_count': turn_count,
+    'finish_reason': finish_reason,
+    'mean_message_chars': mean_message_chars,
+}
+
+
+def register_round_metric(name: str, metric: RoundMetric):
+    """Make a per-round metric available to the `metric` setting of `adaptive_rounds` under `name`."""
+    _round_metrics[name] = metric
+
+
+def get_round_metric(name: str) -> RoundMetric:
+    """
+    Look up a registered metric, or import a scoring callback given as 'package.module:function'.
+    The callback receives the finished chat session and the round metadata and returns a number.
+
+    Raises:
+        ValueError: If the metric is neither registered nor importable.
+    """
+    if name in _round_metrics:
+        return _round_metrics[name]
+    module_name, _, function_name = name.partition(':')
+    if not function_name:
+        raise ValueError(f"Unknown round metric: {name}. Expected one of: {', '.join(_round_metrics)}, "
+                         f"or a scoring callback given as 'package.module:function'")
+    try:
+        return getattr(importlib.import_module(module_name), function_name)
+    except (ImportError, AttributeError) as e:
+        raise ValueError(f"Cannot import round metric {name}: {e}")
+
+
+def confidence_interval_width(values: List[float]) -> float:
+    """Full width of the 95% confidence interval of the mean of `values`, or infinity for fewer than two values."""
+    n = len(values)
+    if n < 2:
+        return math.inf
+    mean = sum(values) / n
+    variance = sum((value - mean) ** 2 for value in values) / (n - 1)
+    critical_value = _T_95[n - 2] if n - 1 <= len(_T_95) else _Z_95
+    return 2 * critical_value * math.sqrt(variance / n)
+
+
+class AdaptiveRoundsConf:
+    """
+    The `adaptive_rounds` section of the exp conf.
+
+    Keys:
+        - 'min_rounds' (int): Rounds every combination gets. Defaults to 2.
+        - 'max_rounds' (int): Rounds no combination exceeds. Defaults to 10.
+        - 'metric' (str): Per-round metric: 'turn_count', 'finish_reason', 'mean_message_chars', a metric registered with
+          `register_round_metric`, or a scoring callback given as 'package.module:function'. Defaults to 'turn_count'.
+        - 'ci_width' (float): A combination stops once the 95% confidence interval of the mean of its metric is at
+          most this wide. Defaults to 1.0.
+        - 'max_total_rounds' (int): Optional budget of rounds for the whole suite. Once the minimum rounds are done,
+          additional rounds go to the combinations with the widest confidence intervals first.
+
+    Raises:
+        ValueError: If a value is invalid or a key is unknown.
+    """
+
+    KEYS = ('min_rounds', 'max_rounds', 'metric', 'ci_width', 'max_total_rounds')
+
+    def __init__(self, conf: Dict[str, Any]):
+        unknown_keys = set(conf) - set(self.KEYS)
+        if unknown_keys:
+            raise ValueError(f"Unknown keys in adaptive_rounds: {', '.join(sorted(unknown_keys))}")
+        self.min_rounds = conf.get('min_rounds', 2)
+        self.max_rounds = conf.get('max_rounds', 10)
+        self.metric_name = conf.get('metric', 'turn_count')
+        self.ci_width = conf.get('ci_width', 1.0)
+        self.max_total_rounds = conf.get('max_total_rounds')
+        if not 1 <= self.min_rounds <= self.max_rounds:
+            raise ValueError(f"adaptive_rounds requires 1 <= min_rounds <= max_rounds, "
+                             f"got {self.min_rounds} and {self.max_rounds}")
+        if self.ci_width < 0:
+            raise ValueError(f"adaptive_rounds ci_width must not be negative: {self.ci_width}")
+        self.metric = get_round_metric(self.metric_name)
+
+
+class _CombinationState:
+    def __init__(self, max_rounds: int):
+        self.values: List[float] = []
+        self.pending_rounds = list(range(max_rounds))
+        self.attempts = 0
+
+
+class AdaptiveScheduler:
+    """
+    Decides how many rounds each combination of a suite gets.
+
+    Rounds are run in waves. The first wave brings every combination to `min_rounds`. Each following wave gives one
+    more round to every combination that has not converged and has not reached `max_rounds`, widest confidence
+    interval first, within the remaining `max_total_rounds`. Failed rounds count against the limits but contribute
+    no metric value. The scheduler may be shared by threads.
+    """
+
+    def __init__(self, conf: AdaptiveRoundsConf, combination_indices: Iterable[int]):
+        self.conf = conf
+        self._lock = threading.Lock()
+        self.states = {combination_index: _CombinationState(conf.max_rounds) for combination_index in combination_indices}
+        self.spent_rounds = 0
+
+    def measure(self, chat_session: "ChatSession", metadata: Dict[str, Any]) -> float:
+        return float(self.conf.metric(chat_session, metadata))
+
+    def record(self, combination_index: int, value: Optional[float], round_index: Optional[int] = None):
+        """
+        Record a finished round of a combination; `value` is None for a failed round.
+        `round_index` is given for rounds completed by an earlier run, which are not scheduled again.
+        """
+        with self._lock:
+            state = self.states[combination_index]
+            if round_index is not None and round_index in state.pending_rounds:
+                state.pending_rounds.remove(round_index)
+                state.attempts += 1
+                self.spent_rounds += 1
+            if value is not None:
+                state.values.append(value)
+
+    def is_converged(self, combination_index: int) -> bool:
+        state = self.states[combination_index]
+        return (len(state.values) >= self.conf.min_rounds
+                and confidence_interval_width(state.values) <= self.conf.ci_width)
+
+    def next_wave(self) -> List[Tuple[int, int]]:
+        """
+        Returns:
+            List[Tuple[int, int]]: (combination index, round index) of the rounds to run next. Empty when done.
+        """
+        with self._lock:
+            candidates = []
+            for combination_index, state in self.states.items():
+                if not state.pending_rounds or state.attempts >= self.conf.max_rounds:
+                    continue
+                if state.attempts < self.conf.min_rounds:
+                    candidates.append((math.inf, combination_index, self.conf.min_rounds - state.attempts))
+                elif not self.is_converged(combination_index):
+                    candidates.append((confidence_interval_width(state.values), combination_index, 1))
+            candidates.sort(key=lambda candidate: -candidate[0])
+
+            wave = []
+            for _, combination_index, num_rounds in candidates:
+                state = self.states[combination_index]
+                for _ in range(num_rounds):
+                    if self.conf.max_total_rounds is not None and self.spent_rounds >= self.conf.max_total_rounds:
+                        return wave
+                    wave.append((combination_index, state.pending_rounds.pop(0)))
+                    state.attempts += 1
+                    self.spent_rounds += 1
+            return wave
+
+    def summary(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'combinations': len(self.states),
+                'converged': sum(1 for combination_index in self.states if self.is_converged(combination_index)),
+                'rounds': self.spent_rounds,
+                'max_rounds': len(self.states) * self.conf.max_rounds,
+            }
@@ -0,0 +1,108 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Set, Tuple
+from llm_eval.metrics import MetricsRecorder
+from llm_eval.providers import Completion
+
+# One pending turn: the messages, the llm_api_params and the future its session waits on
+_PendingTurn = Tuple[List[Dict[str, str]], Dict[str, Any], asyncio.Future]
+
+
+class BatchingConf:
+    """
+    The `batching` section of the exp conf.
+
+    Keys:
+        - 'max_batch_size' (int): Most turns sent in one batched request. Defaults to 8.
+        - 'max_wait_ms' (float): Longest time the first turn of a batch waits for more turns before the batch is
+          sent anyway. Defaults to 10.
+
+    Raises:
+        ValueError: If a value is invalid or a key is unknown.
+    """
+
+    KEYS = ('max_batch_size', 'max_wait_ms')
+
+    def __init__(self, conf: Dict[str, Any]):
+        unknown_keys = set(conf) - set(self.KEYS)
+        if unknown_keys:
+            raise ValueError(f"Unknown keys in batching: {', '.join(sorted(unknown_keys))}")
+        self.max_batch_size = conf.get('max_batch_size', 8)
+        self.max_wait_ms = conf.get('max_wait_ms', 10)
+        if not isinstance(self.max_batch_size, int) or self.max_batch_size < 1:
+            raise ValueError(f"batching max_batch_size must be a positive integer: {self.max_batch_size}")
+        if self.max_wait_ms < 0:
+            raise ValueError(f"batching max_wait_ms must not be negative: {self.max_wait_ms}")
+
+
+class TurnBatcher:
+    """
+    Collects the pending turns of concurrent sessions and sends them to the provider as batched requests.
+
+    Turns are grouped by (llm_api, model). A group is sent as soon as it has `max_batch_size` turns, or
+    `max_wait_ms` after its first turn arrived, with a single call of the provider's
+    `complete_batch(requests) -> List[Completion or Exception]`, which receives a list of (messages, llm_api_params)
+    and answers them in order. Each response goes back to the session that submitted the turn. An exception in
+    the list fails only its own turn; an exception raised by `complete_batch` fails every turn of the batch.
+
+    Sessions wait for their turns, so sessions conducted at the same time advance in lockstep and their next
+    turns arrive together again. Batches therefore never get larger than the number of sessions in flight.
+    """
+
+    def __init__(self, conf: BatchingConf, metrics: Optional[MetricsRecorder] = None):
+        self.conf = conf
+        self.metrics = metrics
+        self._pending: Dict[Tuple[str, str], List[_PendingTurn]] = {}
+        self._timers: Dict[Tuple[str, str], asyncio.TimerHandle] = {}
+        self._batch_tasks: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.batched_turns = 0
+
+    async def submit(self, llm_api: str, provider: Any, messages: List[Dict[str, str]],
+                     llm_api_params: Dict[str, Any]) -> Completion:
+        """Queue a turn for the next batch of its (llm_api, model) and wait for its response."""
+        key = (llm_api, llm_api_params.get('model') or '')
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(key, [])
+        pending.append((messages, llm_api_params, future))
+        if len(pending) >= self.conf.max_batch_size:
+            self._flush(key, provider)
+        elif len(pending) == 1:
+            self._timers[key] = loop.call_later(self.conf.max_wait_ms / 1000, self._flush, key, provider)
+        return await future
+
+    def _flush(self, key: Tuple[str, str], provider: Any):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        # Turns of cancelled sessions are dropped
+        batch = [turn for turn in self._pending.pop(key, []) if not turn[2].done()]
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._send(key, provider, batch))
+        # Keep a reference so the task is not garbage collected while it runs
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
+
+    async def _send(self, key: Tuple[str, str], provider: Any, batch: List[_PendingTurn]):
+        self.batches += 1
+        self.batched_turns += len(batch)
+        if self.metrics is not None:
+            self.metrics.on_batch(key[0], key[1], len(batch))
+        try:
+            responses = await provider.complete_batch([(messages, llm_api_params) for messages, llm_api_params, _ in batch])
+            if len(responses) != len(batch):
+                raise ValueError(f"complete_batch of {key[0]} returned {len(responses)} responses for {len(batch)} requests")
+        except asyncio.CancelledError:
+            for _, _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            responses = [e] * len(batch)
+        for (_, _, future), response in zip(batch, responses):
+            if future.done():
+                continue
+            if isinstance(response, BaseException):
+                future.set_exception(response)
+            else:
+                future.set_result(response)
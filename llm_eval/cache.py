@@ -0,0 +1,143 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from llm_eval.providers import Completion, TRANSPORT_PARAMS
+
+CACHE_MODES = ('record', 'replay', 'read-through')
+
+
+class CacheMissError(Exception):
+    """Raised in replay mode when a response is not in the cache."""
+
+
+class ResponseCache:
+    """
+    Content-addressed, disk-backed cache of LLM responses.
+
+    A response is stored under the SHA-256 of the attendee's `llm_api`, its `llm_api_params`, the full
+    message history sent to the provider and the sample index of the call (the round of the session), so that
+    repeated rounds are sampled again rather than served the first round's responses. Entries are JSON files in `cache_dir`, spread over subdirectories
+    by the first two hex digits of the key. When `max_bytes` is set, the least recently used entries are
+    evicted once the cache grows beyond it. Recency survives restarts through the file modification time.
+
+    Modes:
+        - 'record': always call the provider and store the response.
+        - 'replay': only serve from the cache; a miss raises `CacheMissError`.
+        - 'read-through': serve from the cache, call the provider and store the response on a miss.
+    """
+
+    def __init__(self, cache_dir: str, mode: str = 'read-through', max_bytes: Optional[int] = None):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode: {mode}. Expected one of: {', '.join(CACHE_MODES)}")
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> size in bytes, least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for sub_dir in os.listdir(self.cache_dir):
+            sub_dir_path = os.path.join(self.cache_dir, sub_dir)
+            if not os.path.isdir(sub_dir_path):
+                continue
+            for file_name in os.listdir(sub_dir_path):
+                if not file_name.endswith('.json'):
+                    continue
+                stat = os.stat(os.path.join(sub_dir_path, file_name))
+                entries.append((stat.st_mtime, file_name[:-len('.json')], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f'{key}.json')
+
+    @staticmethod
+    def make_key(llm_api: str, llm_api_params: Dict[str, Any], messages: List[Dict[str, str]],
+                 sample_index: int = 0) -> str:
+        params = {key: value for key, value in llm_api_params.items() if key not in TRANSPORT_PARAMS}
+        key_fields = {'llm_api': llm_api, 'llm_api_params': params, 'messages': messages}
+        # Sample 0 keeps the keys of entries recorded before samples were told apart
+        if sample_index:
+            key_fields['sample_index'] = sample_index
+        payload = json.dumps(key_fields, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Completion]:
+        """
+        Look up a response. In 'record' mode the cache is never read and None is returned.
+
+        Raises:
+            CacheMissError: In 'replay' mode, if the response is not cached.
+        """
+        if self.mode == 'record':
+            return None
+        with self._lock:
+            cached = key in self._entries
+            if cached:
+                self._entries.move_to_end(key)
+        if cached:
+            try:
+                with open(self._path(key), 'r') as file:
+                    entry = json.load(file)
+                os.utime(self._path(key))
+            except FileNotFoundError:
+                # Evicted by another process sharing the cache directory
+                with self._lock:
+                    self._total_bytes -= self._entries.pop(key, 0)
+                cached = False
+        if not cached:
+            self.misses += 1
+            if self.mode == 'replay':
+                raise CacheMissError(f"Response not in cache (replay mode): {key}")
+            return None
+        self.hits += 1
+        return Completion(entry['text'], entry.get('prompt_tokens'), entry.get('completion_tokens'))
+
+    def put(self, key: str, completion: Completion):
+        """Store a response, then evict least recently used entries beyond `max_bytes`."""
+        if self.mode == 'replay':
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({
+            'text': completion.text,
+            'prompt_tokens': completion.prompt_tokens,
+            'completion_tokens': completion.completion_tokens,
+        }, ensure_ascii=False)
+        # Write to a temporary file first so that readers never see a partial entry
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path), delete=False, suffix='.tmp') as file:
+            file.write(data)
+        os.replace(file.name, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._total_bytes += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            evicted = []
+            while self.max_bytes is not None and self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
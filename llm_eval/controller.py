@@ -1,47 +1,452 @@
+import time
+import asyncio
+import contextlib
 import yaml
-from llm_eval.service import compile_party_config, conduct_chat_session, make_init_instr_lists
-from typing import Dict, Any
+from llm_eval.service import make_init_instr_lists, run_chat_round
+from llm_eval.instructions import InstructionCombinations
+from llm_eval.runner import JobResult, run_jobs
+from llm_eval.engine import SessionEngine, run_jobs_async
+from llm_eval.ratelimit import RateLimiterRegistry
+from llm_eval.cache import ResponseCache
+from llm_eval.manifest import Manifest, unit_key
+from llm_eval.sink import FileSink, ResultSink
+from llm_eval.party_template import PartyTemplate
+from llm_eval.metrics import MetricsRecorder
+from llm_eval.shard import Shard
+from llm_eval.adaptive import AdaptiveRoundsConf, AdaptiveScheduler
+from llm_eval.fork import ForkConf, PrefixForker
+from llm_eval.batching import BatchingConf, TurnBatcher
+from llm_eval.latency import TailLatencyConf
+from llm_eval.scoring import Scorer, ScoringConf, ScoringPipeline, write_scoreboard
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
 
+ENGINES = ('threads', 'asyncio')
 
-def run_exp_suite(exp_suite: Dict[str, Any], verbose: bool, output_dir: str):
+
+class SessionJob:
+    """
+    A single chat session round of an experiment suite: one combination of initial instructions and one round.
+    """
+
+    def __init__(self, suite: str, combination_index: int, num_combinations: int, round_index: int, num_rounds: int,
+                 init_instr_list: Tuple[str, ...], init_instr_digests: Tuple[str, ...]):
+        self.suite = suite
+        self.combination_index = combination_index
+        self.num_combinations = num_combinations
+        self.round_index = round_index
+        self.num_rounds = num_rounds
+        self.init_instr_list = init_instr_list
+        self.init_instr_digests = init_instr_digests
+
+    @property
+    def unit_key(self) -> str:
+        return unit_key(self.suite, self.init_instr_list, self.init_instr_digests, self.round_index)
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        return {
+            'suite': self.suite,
+            'combination_index': self.combination_index,
+            'round_index': self.round_index,
+            'init_instr_list': list(self.init_instr_list),
+            'init_instr_digests': list(self.init_instr_digests),
+        }
+
+    def __str__(self):
+        return (f"{self.suite}: combination {self.combination_index + 1}/{self.num_combinations}, "
+                f"round {self.round_index + 1}/{self.num_rounds}")
+
+
+class SuitePlan:
+    """
+    An experiment suite with its configuration files loaded and validated, ready to be conducted.
+
+    Loading reads the instruction directories, the party configuration and the exp conf, but conducts no session
+    and does not import llm_party, so a suites conf can be checked quickly (see `--dry-run`).
+    """
+
+    def __init__(self, suite_name: str, init_instr_lists: InstructionCombinations, exp_conf_dict: Dict[str, Any],
+                 num_rounds: int, party_template: PartyTemplate, adaptive: Optional[AdaptiveRoundsConf] = None,
+                 fork_conf: Optional[ForkConf] = None, batching: Optional[BatchingConf] = None,
+                 scoring: Optional[ScoringConf] = None):
+        self.suite_name = suite_name
+        self.init_instr_lists = init_instr_lists
+        self.exp_conf_dict = exp_conf_dict
+        self.num_rounds = num_rounds
+        self.party_template = party_template
+        self.adaptive = adaptive
+        self.fork_conf = fork_conf
+        self.batching = batching
+        self.scoring = scoring
+
+    @classmethod
+    def load(cls, exp_suite: Dict[str, Any], engine: str = 'threads') -> "SuitePlan":
+        """
+        Args:
+            exp_suite (Dict[str, Any]): Configuration for the experiment suite.
+            engine (str): Engine the suite will be conducted with.
+
+        Raises:
+            ValueError: If the required keys are missing in the exp_suite configuration, the number of attendees of
+                        the party configuration differs from the number of initial instruction directories, the
+                        engine is unknown, `rate_limits`, `fork`, `batching`, `tail_latency`, `session_deadline` or
+                        a scoring judge are used with the 'threads' engine, or `adaptive_rounds`, `fork`, `batching`,
+                        `tail_latency` or `scoring` is invalid.
+        """
+        # Validate required keys in exp_suite
+        required_keys = ["init instr dirs", "party conf", "exp conf"]
+        if not all(key in exp_suite for key in required_keys):
+            raise ValueError(f"Experiment suite configuration is missing required keys: {', '.join(required_keys)}")
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine}. Expected one of: {', '.join(ENGINES)}")
+
+        init_instr_dirs = exp_suite["init instr dirs"]
+        party_conf = exp_suite["party conf"]
+        exp_conf = exp_suite["exp conf"]
+        suite_name = exp_suite.get("exp suite", party_conf)
+
+        # Generate all combinations of initial instruction files
+        init_instr_lists = make_init_instr_lists(init_instr_dirs)
+
+        # Load the test configuration once for the whole suite
+        with open(exp_conf, 'r') as file:
+            exp_conf_dict = yaml.safe_load(file)
+        num_rounds = exp_conf_dict.get('num_rounds', 3)
+        if engine == 'threads' and exp_conf_dict.get('rate_limits'):
+            raise ValueError("'rate_limits' in the exp conf are only applied by the 'asyncio' engine")
+        adaptive = None
+        if exp_conf_dict.get('adaptive_rounds') is not None:
+            adaptive = AdaptiveRoundsConf(exp_conf_dict['adaptive_rounds'])
+            num_rounds = adaptive.max_rounds
+        fork_conf = None
+        if exp_conf_dict.get('fork') is not None:
+            if engine == 'threads':
+                raise ValueError("'fork' in the exp conf is only applied by the 'asyncio' engine")
+            fork_conf = ForkConf(exp_conf_dict['fork'])
+        batching = None
+        if exp_conf_dict.get('batching') is not None:
+            if engine == 'threads':
+                raise ValueError("'batching' in the exp conf is only applied by the 'asyncio' engine")
+            batching = BatchingConf(exp_conf_dict['batching'])
+        scoring = None
+        if exp_conf_dict.get('scoring') is not None:
+            scoring = ScoringConf(exp_conf_dict['scoring'])
+            if scoring.judge is not None and engine == 'threads':
+                raise ValueError("A scoring 'judge' in the exp conf is only applied by the 'asyncio' engine")
+
+        # Parse the party configuration once; each combination is a cheap patch of the instruction texts
+        party_template = PartyTemplate.from_file(party_conf)
+        party_template.check_num_instructions(len(init_instr_dirs))
+        for attendee in party_template.party_conf_dict['attendees']:
+            if TailLatencyConf.from_attendee_params(attendee.get('attendee_params')) is not None and engine == 'threads':
+                raise ValueError("'tail_latency' in the attendee_params is only applied by the 'asyncio' engine")
+        if (party_template.party_conf_dict.get('settings') or {}).get('session_deadline') and engine == 'threads':
+            raise ValueError("'session_deadline' in the party conf settings is only applied by the 'asyncio' engine")
+        return cls(suite_name, init_instr_lists, exp_conf_dict, num_rounds, party_template, adaptive, fork_conf,
+                   batching, scoring)
+
+    @property
+    def num_sessions(self) -> int:
+        """Number of sessions of the suite; the maximum with adaptive rounds."""
+        return len(self.init_instr_lists) * self.num_rounds
+
+    def describe(self) -> str:
+        rounds = (f"{self.adaptive.min_rounds}-{self.adaptive.max_rounds} adaptive rounds" if self.adaptive is not None
+                  else f"{self.num_rounds} round(s)")
+        return f"{self.suite_name}: {len(self.init_instr_lists)} combination(s) x {rounds}"
+
+
+def run_exp_suite(exp_suite: Dict[str, Any], verbose: bool, output_dir: str, max_concurrency: int = 1,
+                  engine: str = 'threads', cache: Optional[ResponseCache] = None,
+                  manifest: Optional[Manifest] = None, resume: bool = False,
+                  sink: Optional[ResultSink] = None, metrics: Optional[MetricsRecorder] = None,
+                  shard: Optional[Shard] = None) -> List[JobResult]:
     """
     Conduct an experiment suite by running chat sessions for all combinations of initial instructions.
 
+    Every (combination, round) pair is an independent job, and at most `max_concurrency` jobs run at the
+    same time. A failing job is reported and does not stop the others. Each completed job is recorded in
+    `manifest`; with `resume`, jobs already recorded there are skipped. With `shard`, only the jobs of that shard
+    are run, and the manifest records the plan of the suite so that the shards can be merged later.
+
+    By default every combination gets `num_rounds` rounds. With `adaptive_rounds` in the exp conf, rounds run in
+    waves and each combination stops once the confidence interval of its per-round metric is narrow enough (see
+    `AdaptiveRoundsConf`); the metric value of each round is recorded in the manifest. With `fork` in the exp conf,
+    sessions that open with the same turns fork from one shared conversation prefix (see `ForkConf`), and the
+    prefix they forked from is recorded in their metadata. With `scoring` in the exp conf, every round is scored (see
+    `ScoringConf`) before its results are written, the scores are written with the results and recorded in the
+    manifest, and the suite ends with an updated `scoreboard.json` of the scores per combination. With the 'asyncio'
+    engine, sessions are scored on a bounded queue while the next sessions are conducted. Two engines are available:
+        - 'threads': each session is conducted by `llm_party` on a pool of worker threads.
+        - 'asyncio': all sessions are conducted by a `SessionEngine` on one event loop. LLM calls are throttled
+          by the `rate_limits` of the exp conf and answered from `cache` when one is given. With `batching` in the
+          exp conf, the turns of concurrent sessions are sent to the provider in batches (see `TurnBatcher`).
+
     Args:
         exp_suite (Dict[str, Any]): Configuration for the experiment suite, including initial instruction directories,
                                     party configuration file path, and experiment configuration file path.
         verbose (bool): Flag to enable verbose mode for detailed logging.
         output_dir (str): Directory to save the output files of the chat sessions.
+        max_concurrency (int): Maximum number of chat sessions conducted at the same time. Defaults to 1.
+        engine (str): 'threads' or 'asyncio'. Defaults to 'threads'.
+        cache (Optional[ResponseCache]): Response cache used by the 'asyncio' engine.
+        manifest (Optional[Manifest]): Completion manifest of the output directory.
+        resume (bool): Skip the jobs the manifest records as completed. Requires `manifest`.
+        sink (Optional[ResultSink]): Where the result of each round is written. Defaults to a `FileSink` that writes
+                                     one chat history file and one party configuration file per round.
+        metrics (Optional[MetricsRecorder]): Records round timings and the time spent compiling configurations,
+                                             conducting sessions and writing results. With the 'asyncio' engine,
+                                             every LLM call is recorded as well.
+        shard (Optional[Shard]): Run only the jobs that belong to this shard.
+
+    Returns:
+        List[JobResult]: The result of each job that was run, in submission order.
 
     Raises:
-        ValueError: If the required keys are missing in the exp_suite configuration.
+        ValueError: If the required keys are missing in the exp_suite configuration, the number of attendees of the
+                    party configuration differs from the number of initial instruction directories, the engine is
+                    unknown, `rate_limits`, `fork`, `batching`, `tail_latency`, `session_deadline`, a scoring judge or
+                    a cache are used with the 'threads' engine, or `adaptive_rounds`, `fork`, `batching`,
+                    `tail_latency` or `scoring` is invalid.
+        KeyboardInterrupt: If the suite was interrupted. Running sessions finish writing their output first.
     """
-    # Validate required keys in exp_suite
-    required_keys = ["init instr dirs", "party conf", "exp conf"]
-    if not all(key in exp_suite for key in required_keys):
-        raise ValueError(f"Experiment suite configuration is missing required keys: {', '.join(required_keys)}")
+    if resume and manifest is None:
+        raise ValueError("Resuming requires a manifest")
+    if engine == 'threads' and cache is not None:
+        raise ValueError("The response cache is only applied by the 'asyncio' engine")
 
-    init_instr_dirs = exp_suite["init instr dirs"]
-    party_conf = exp_suite["party conf"]
-    exp_conf = exp_suite["exp conf"]
+    plan = SuitePlan.load(exp_suite, engine)
+    suite_name = plan.suite_name
+    init_instr_lists = plan.init_instr_lists
+    exp_conf_dict = plan.exp_conf_dict
+    num_rounds = plan.num_rounds
+    adaptive = plan.adaptive
+    fork_conf = plan.fork_conf
+    batching = plan.batching
+    scoring = plan.scoring
+    party_template = plan.party_template
 
-    # Generate all combinations of initial instruction files
-    init_instr_lists = make_init_instr_lists(init_instr_dirs)
+    def party_conf_for(combination_index: int) -> Dict:
+        return party_template.render(init_instr_lists.texts(init_instr_lists[combination_index]))
 
-    for init_instr_list in init_instr_lists:
-        # Conduct the chat session for each combination of initial instructions
-        run_exp_with_single_party_conf(init_instr_list, party_conf, exp_conf, output_dir, verbose)
+    def make_job(combination_index: int, round_index: int) -> SessionJob:
+        combination = init_instr_lists[combination_index]
+        return SessionJob(suite_name, combination_index, len(init_instr_lists), round_index, num_rounds, combination,
+                          init_instr_lists.digests(combination))
 
-def run_exp_with_single_party_conf(init_instr_list, party_conf, exp_conf, output_dir, verbose):
-    """
-    Party configuration must contain exactly the same number of the attendees as the length of init_instr_list.
-    Typically, the first attendee plays the AI agent role and the second plays the human client role.
-    """
-    party_conf_dict = compile_party_config(party_conf, init_instr_list)
+    if manifest is not None:
+        manifest_plan = {
+            'num_combinations': len(init_instr_lists),
+            'num_rounds': num_rounds,
+            'shard': str(shard) if shard is not None else None,
+        }
+        if adaptive is not None:
+            manifest_plan['min_rounds'] = adaptive.min_rounds
+        manifest.record_plan(suite_name, manifest_plan)
+
+    def is_done(key: str) -> bool:
+        # Rounds written without scores because an earlier run was interrupted are conducted and scored again
+        record = manifest.get(key)
+        return record is not None and not (scoring is not None and record.get('unscored'))
+
+    scheduler = None
+    if adaptive is None:
+        num_sessions = len(init_instr_lists) * num_rounds
+        # Without filters the number of jobs is known before they are streamed
+        num_jobs = num_sessions if shard is None and not resume else None
+
+        def stream_jobs() -> Iterator[SessionJob]:
+            # Jobs are made as they are run, so that the jobs of a large suite are never all held in memory
+            num_in_shard = num_skipped = 0
+            for combination_index in range(len(init_instr_lists)):
+                for round_index in range(num_rounds):
+                    if shard is not None and not shard.includes(suite_name, combination_index, round_index):
+                        continue
+                    num_in_shard += 1
+                    job = make_job(combination_index, round_index)
+                    if resume and is_done(job.unit_key):
+                        num_skipped += 1
+                        continue
+                    yield job
+            if shard is not None:
+                print(f"{suite_name}: shard {shard} has {num_in_shard} of {num_sessions} session(s)")
+            if resume:
+                print(f"{suite_name}: skipped {num_skipped} completed session(s), "
+                      f"{num_in_shard - num_skipped} conducted")
+    else:
+        # The number of rounds of a combination depends on its earlier rounds, so all of them belong to one shard
+        combination_indices = range(len(init_instr_lists))
+        if shard is not None:
+            combination_indices = [ci for ci in combination_indices if shard.includes(suite_name, ci, 0)]
+            print(f"{suite_name}: shard {shard} has {len(combination_indices)} of {len(init_instr_lists)} combination(s)")
+        scheduler = AdaptiveScheduler(adaptive, combination_indices)
+        if resume:
+            # Rounds completed by an earlier run count towards the limits and the confidence intervals
+            num_completed = 0
+            for combination_index in combination_indices:
+                for round_index in range(num_rounds):
+                    key = make_job(combination_index, round_index).unit_key
+                    if is_done(key):
+                        record = manifest.get(key)
+                        scheduler.record(combination_index, record.get('metric_value'), round_index)
+                        num_completed += 1
+            print(f"{suite_name}: resuming after {num_completed} completed session(s)")
+
+    def job_waves() -> Iterator[Tuple[Iterable[SessionJob], Optional[int]]]:
+        """Waves of jobs, each with its number of jobs if known."""
+        if scheduler is None:
+            yield stream_jobs(), num_jobs
+            return
+        wave_number = 0
+        while True:
+            wave = scheduler.next_wave()
+            if not wave:
+                break
+            wave_number += 1
+            print(f"{suite_name}: wave {wave_number}, {len(wave)} session(s)")
+            yield [make_job(combination_index, round_index) for combination_index, round_index in wave], len(wave)
+        summary = scheduler.summary()
+        print(f"{suite_name}: {summary['converged']} of {summary['combinations']} combination(s) converged after "
+              f"{summary['rounds']} of at most {summary['max_rounds']} round(s)")
+
+    if sink is None:
+        sink = FileSink(output_dir)
+
+    def stage(name: str):
+        return metrics.stage(name) if metrics is not None else contextlib.nullcontext()
+
+    def prepare(job: SessionJob) -> Dict:
+        with stage('compile'):
+            return party_conf_for(job.combination_index)
+
+    scored_records = []
+
+    def finish(job: SessionJob, round_seconds: float, chat_session, party_conf_dict: Dict,
+               fork: Optional[Dict[str, Any]] = None, scores: Optional[Dict[str, Optional[float]]] = None,
+               score_errors: Optional[Dict[str, str]] = None):
+        if metrics is not None:
+            ok = chat_session is not None
+            metrics.on_round(job.suite, round_seconds, len(chat_session.chat_history) if ok else 0, ok)
+        if chat_session is None:
+            if scheduler is not None:
+                scheduler.record(job.combination_index, None)
+            return
+        metadata = job.metadata
+        metadata['round_seconds'] = round(round_seconds, 6)
+        if fork is not None:
+            metadata['fork'] = fork
+        if scores is not None:
+            metadata['scores'] = scores
+            if score_errors:
+                metadata['score_errors'] = score_errors
+        record = dict(metadata)
+        if scoring is not None and scores is None:
+            record['unscored'] = True
+        if scheduler is not None:
+            record['metric_value'] = scheduler.measure(chat_session, metadata)
+            scheduler.record(job.combination_index, record['metric_value'])
+        with stage('serialization'):
+            file_names = sink.write_round(metadata, chat_session, party_conf_dict)
+            if manifest is not None:
+                manifest.mark_complete(job.unit_key, dict(record, files=file_names))
+        if scores is not None:
+            scored_records.append(record)
+
+    def write_scores():
+        # The manifest also holds the scores of earlier runs into the same output directory
+        path = write_scoreboard(output_dir, manifest.units.values() if manifest is not None else scored_records)
+        print(f"{suite_name}: scoreboard written to {path}")
+
+    if engine == 'asyncio':
+        batcher = TurnBatcher(batching, metrics) if batching is not None else None
+        session_engine = SessionEngine(RateLimiterRegistry.from_conf(exp_conf_dict.get('rate_limits')), cache, metrics,
+                                       batcher)
+        forker = PrefixForker(session_engine, fork_conf) if fork_conf is not None else None
+
+        # Sessions handed over to the scoring pipeline: job -> (round_seconds, chat_session, party_conf_dict, fork)
+        handed_over: Dict[SessionJob, Tuple[float, Any, Dict, Optional[Dict[str, Any]]]] = {}
+
+        def on_scored(job: SessionJob, scores, score_errors):
+            round_seconds, chat_session, party_conf_dict, fork = handed_over.pop(job)
+            finish(job, round_seconds, chat_session, party_conf_dict, fork, scores, score_errors)
+
+        pipeline = ScoringPipeline(Scorer(scoring, session_engine), on_scored) if scoring is not None else None
+
+        async def run_job_async(job: SessionJob):
+            party_conf_dict = prepare(job)
+            round_start = time.perf_counter()
+            fork = None
+            try:
+                with stage('session'):
+                    if forker is None:
+                        chat_session = await session_engine.run_session(party_conf_dict, verbose,
+                                                                         sample_index=job.round_index)
+                    else:
+                        prefix_id, snapshot = await forker.get_prefix(party_conf_dict, job.round_index, verbose)
+                        fork = {'prefix_id': prefix_id, 'prefix_turns': fork_conf.prefix_turns}
+                        chat_session = await session_engine.run_session(party_conf_dict, verbose,
+                                                                         snapshot['chat_history'], job.round_index)
+            except Exception:
+                finish(job, time.perf_counter() - round_start, None, party_conf_dict)
+                raise
+            round_seconds = time.perf_counter() - round_start
+            if pipeline is not None:
+                # The results are written once the session is scored; the next session starts meanwhile
+                handed_over[job] = (round_seconds, chat_session, party_conf_dict, fork)
+                await pipeline.submit(job, chat_session, job.metadata)
+            else:
+                finish(job, round_seconds, chat_session, party_conf_dict, fork)
+            return chat_session
+
+        # All waves run on one event loop, which the rate limiters are bound to
+        async def run_waves_async() -> List[JobResult]:
+            results = []
+            async with contextlib.AsyncExitStack() as stack:
+                if pipeline is not None:
+                    await stack.enter_async_context(pipeline)
+                for wave, num_wave_jobs in job_waves():
+                    results.extend(await run_jobs_async(wave, run_job_async, max_concurrency, total=num_wave_jobs))
+                    if pipeline is not None:
+                        # The adaptive scheduler plans the next wave from the recorded rounds
+                        await pipeline.join()
+            if pipeline is not None:
+                for result in results:
+                    if result.job in pipeline.errors:
+                        result.value, result.error = None, pipeline.errors[result.job]
+            if batcher is not None and batcher.batches:
+                print(f"{suite_name}: sent {batcher.batched_turns} turn(s) in {batcher.batches} batch(es), "
+                      f"{batcher.batched_turns / batcher.batches:.1f} per batch")
+            if session_engine.hedges or session_engine.timeouts or session_engine.session_timeouts:
+                print(f"{suite_name}: {session_engine.hedges} hedged call(s), {session_engine.timeouts} timed out "
+                      f"call(s), {session_engine.session_timeouts} session(s) past their deadline")
+            if forker is not None:
+                print(f"{suite_name}: forked {forker.forks} session(s) from {forker.prefixes_run} shared prefix(es)")
+            return results
+
+        results = asyncio.run(run_waves_async())
+        if scoring is not None:
+            write_scores()
+        return results
+
+    scorer = Scorer(scoring) if scoring is not None else None
 
-    # Load the test configuration
-    with open(exp_conf, 'r') as file:
-        exp_conf_dict = yaml.safe_load(file)
+    def run_job(job: SessionJob):
+        party_conf_dict = prepare(job)
+        round_start = time.perf_counter()
+        try:
+            with stage('session'):
+                chat_session = run_chat_round(party_conf_dict, verbose)
+        except Exception:
+            finish(job, time.perf_counter() - round_start, None, party_conf_dict)
+            raise
+        round_seconds = time.perf_counter() - round_start
+        scores, score_errors = scorer.score_rules(chat_session, job.metadata) if scorer is not None else (None, None)
+        finish(job, round_seconds, chat_session, party_conf_dict, scores=scores, score_errors=score_errors)
+        return chat_session
 
-    # Conduct the chat session based on the test configuration
-    conduct_chat_session(party_conf_dict, exp_conf_dict, output_dir, verbose)
+    results = []
+    for wave, num_wave_jobs in job_waves():
+        results.extend(run_jobs(wave, run_job, max_concurrency, total=num_wave_jobs))
+    if scoring is not None:
+        write_scores()
+    return results
@@ -0,0 +1,319 @@
+import math
+import time
+import random
+import asyncio
+import datetime
+import traceback
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence
+from llm_eval.batching import TurnBatcher
+from llm_eval.cache import ResponseCache
+from llm_eval.latency import DeadlineExceeded, LatencyTracker, TailLatencyConf, call_hedged
+from llm_eval.metrics import MetricsRecorder
+from llm_eval.providers import TRANSPORT_PARAMS, get_provider
+from llm_eval.ratelimit import RateLimiterRegistry, estimate_prompt_tokens, estimate_tokens
+from llm_eval.runner import JobResult, OrderedProgress, count_jobs
+from llm_eval.service import chat_session_to_dict
+
+if TYPE_CHECKING:
+    from llm_party.model.session_models import ChatSession
+
+# Format of message timestamps in serialized chat sessions
+MESSAGE_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+class SessionEngine:
+    """
+    Conduct chat sessions on an asyncio event loop.
+
+    The engine drives the turns of a session itself, the same way `llm_party` does, so that each LLM call
+    can be throttled by the rate limiter of its (llm_api, model) pair, answered from the response cache, and
+    batched with the turns of other sessions by a `TurnBatcher`. Many sessions can share one engine and one
+    event loop.
+
+    Stragglers are bounded by the `tail_latency` of each attendee's `attendee_params` (see `TailLatencyConf`) and by
+    the `session_deadline` (seconds) of the party conf's `settings`. The engine counts the hedged calls, the timed
+    out calls and the sessions that ran past their deadline in `hedges`, `timeouts` and `session_timeouts`.
+    """
+
+    def __init__(self, rate_limiters: Optional[RateLimiterRegistry] = None, cache: Optional[ResponseCache] = None,
+                 metrics: Optional[MetricsRecorder] = None, batcher: Optional[TurnBatcher] = None):
+        self.rate_limiters = rate_limiters if rate_limiters is not None else RateLimiterRegistry()
+        self.cache = cache
+        self.metrics = metrics
+        self.batcher = batcher
+        self.latencies = LatencyTracker()
+        self.random = random.Random()
+        self.hedges = 0
+        self.timeouts = 0
+        self.session_timeouts = 0
+
+    async def run_session(self, party_conf_dict: Dict, verbose: bool = False,
+                          prefix: Optional[Sequence[Dict]] = None, sample_index: int = 0) -> "ChatSession":
+        """
+        Conduct one chat session.
+
+        Args:
+            party_conf_dict (Dict): Compiled party configuration dictionary.
+            verbose (bool): If True, each message is printed to the console.
+            prefix (Optional[Sequence[Dict]]): Serialized messages of a conversation prefix (see `run_prefix`).
+                                               The session continues after them instead of starting from turn 0.
+            sample_index (int): Which sample of the party configuration the session is, e.g. its round index. Each
+                                sample has its own cached responses (see `ResponseCache.make_key`).
+
+        Returns:
+            ChatSession: The finished chat session.
+        """
+        from llm_party import init_chat_session
+        from llm_party.model.session_models import Message
+        chat_session = init_chat_session(party_conf_dict)
+        chat_session.start()
+        for turn_index, message in enumerate(prefix or []):
+            # The i-th message of a prefix was sent by the attendee whose turn it was, as in `conduct_turns`
+            sender = chat_session.attendees[turn_index % len(chat_session.attendees)]
+            timestamp = datetime.datetime.strptime(message['timestamp'], MESSAGE_TIMESTAMP_FORMAT)
+            chat_session.chat_history.append(Message(sender, message['text'], timestamp))
+        session_deadline = chat_session.settings.get("session_deadline")
+        try:
+            turns = self.conduct_turns(chat_session, chat_session.settings["max_sent_message"], verbose, sample_index)
+            if session_deadline:
+                # Unlike wait_for, wait tells the expiry of the deadline apart from a TimeoutError of a turn
+                task = asyncio.ensure_future(turns)
+                try:
+                    done, _ = await asyncio.wait([task], timeout=session_deadline)
+                finally:
+                    if not task.done():
+                        task.cancel()
+                        await asyncio.gather(task, return_exceptions=True)
+                if not done:
+                    self.session_timeouts += 1
+                    raise DeadlineExceeded(f"Session exceeded its deadline of {session_deadline} s")
+                task.result()
+            else:
+                await turns
+        except Exception as e:
+            reason = "DeadlineExceeded" if isinstance(e, DeadlineExceeded) else "LLMAPIFailure"
+            chat_session.end("completed_with_failure", f"{reason}: {str(e)}")
+            raise
+        chat_session.end("completed_successfully", "MaxSentMessage")
+        return chat_session
+
+    async def run_prefix(self, party_conf_dict: Dict, prefix_turns: int, verbose: bool = False,
+                         sample_index: int = 0) -> Dict:
+        """
+        Conduct the first `prefix_turns` turns of a chat session and snapshot it.
+
+        Returns:
+            Dict: The chat session as a dictionary (`ChatSession.to_dict`). Its 'chat_history' can be passed as
+                  the `prefix` of `run_session`.
+        """
+        from llm_party import init_chat_session
+        chat_session = init_chat_session(party_conf_dict)
+        chat_session.start()
+        await self.conduct_turns(chat_session, min(prefix_turns, chat_session.settings["max_sent_message"]), verbose,
+                                 sample_index)
+        return chat_session_to_dict(chat_session)
+
+    async def conduct_turns(self, chat_session: "ChatSession", max_sent_message: int, verbose: bool = False,
+                            sample_index: int = 0):
+        """Let the attendees speak in turn until the chat history has `max_sent_message` messages."""
+        from llm_party.model.session_models import Message
+        while len(chat_session.chat_history) < max_sent_message:
+            attendee = chat_session.attendees[len(chat_session.chat_history) % len(chat_session.attendees)]
+            text = await self.generate_response(attendee, chat_session, sample_index)
+            chat_session.chat_history.append(Message(attendee, text))
+            if verbose:
+                print("-----------------------------------------")
+                print(f"{attendee.name} ({attendee.role}):")
+                print(text)
+
+    async def generate_response(self, attendee: Any, chat_session: "ChatSession", sample_index: int = 0) -> str:
+        from llm_party.model.session_models import LLMAgent
+        if not isinstance(attendee, LLMAgent):
+            # Custom attendees generate their responses themselves
+            return await asyncio.to_thread(attendee.generate_response, chat_session.chat_history)
+        if attendee.llm_api is None:
+            raise ValueError(f"LLMAgent '{attendee.name}' has no 'llm_api'")
+
+        messages = attendee.convert_chat_history_to_openai_messages(chat_session.chat_history)
+        params = {key: value for key, value in attendee.llm_api_params.items() if key not in TRANSPORT_PARAMS}
+        completion = await self.complete(attendee.llm_api, messages, params,
+                                         retries=attendee.llm_api_params.get('retries', 0),
+                                         sleep_period=attendee.llm_api_params.get('sleep_period', 0),
+                                         tail_latency=TailLatencyConf.from_attendee_params(attendee.attendee_params),
+                                         sample_index=sample_index)
+        return completion.text
+
+    async def complete(self, llm_api: str, messages: List[Dict[str, str]], params: Dict[str, Any],
+                       retries: int = 0, sleep_period: float = 0, tail_latency: Optional[TailLatencyConf] = None,
+                       sample_index: int = 0):
+        """
+        Call the provider of `llm_api`, waiting for the rate limiter before each attempt.
+
+        Responses found in the cache are returned without calling the provider or waiting for the limiter. The
+        cache key includes `sample_index`, so that the rounds of a combination, which send the same messages, each get
+        their own response instead of replaying the first round's.
+        With a rate limiter, failed attempts are retried as soon as the limiter admits them, and a rate limit
+        error (status 429) empties the buckets so that all sessions slow down together. Without one, the
+        engine sleeps `sleep_period` seconds between attempts like `llm_wrap` does. With a batcher, each attempt
+        goes into a batched request if the provider has a `complete_batch` method.
+
+        With `tail_latency`, attempts time out after `attempt_timeout`, the turn fails with `DeadlineExceeded` once
+        `turn_deadline` has passed, retries wait for a jittered exponential backoff, and slow attempts are hedged
+        with a duplicate call that also waits for the rate limiter.
+        """
+        model = params.get('model')
+        turn_start = time.perf_counter()
+        if self.cache is not None:
+            cache_key = self.cache.make_key(llm_api, params, messages, sample_index)
+            completion = self.cache.get(cache_key)
+            if completion is not None:
+                if self.metrics is not None:
+                    self.metrics.on_turn(llm_api, model, time.perf_counter() - turn_start, cached=True)
+                return completion
+
+        provider = get_provider(llm_api)
+        batched = self.batcher is not None and hasattr(provider, 'complete_batch')
+        limiter = self.rate_limiters.get(llm_api, model)
+        estimated_tokens = estimate_prompt_tokens(messages) + (params.get('max_tokens') or 0)
+        deadline = (turn_start + tail_latency.turn_deadline
+                    if tail_latency is not None and tail_latency.turn_deadline else None)
+        rate_limit_wait = 0.0
+        errors = []
+        timeouts = 0
+        hedges = 0
+
+        async def call():
+            if batched:
+                return await self.batcher.submit(llm_api, provider, messages, params)
+            return await provider.complete(messages, params)
+
+        async def hedge():
+            nonlocal hedges
+            hedges += 1
+            self.hedges += 1
+            # A hedge is one more request
+            if limiter is not None:
+                await limiter.acquire(estimated_tokens)
+            return await call()
+
+        for attempt in range(retries + 1):
+            if limiter is not None:
+                wait_start = time.perf_counter()
+                await limiter.acquire(estimated_tokens)
+                rate_limit_wait += time.perf_counter() - wait_start
+            call_start = time.perf_counter()
+            try:
+                if tail_latency is None:
+                    completion = await call()
+                else:
+                    timeout = tail_latency.attempt_timeout
+                    if deadline is not None:
+                        timeout = min(timeout or math.inf, deadline - call_start)
+                    hedge_delay = self.latencies.hedge_delay(llm_api, model, tail_latency)
+                    attempt_call = call_hedged(call, hedge_delay, hedge)
+                    completion = await (asyncio.wait_for(attempt_call, timeout) if timeout is not None else attempt_call)
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    timeouts += 1
+                    self.timeouts += 1
+                status_code = getattr(e, 'status_code', None)
+                errors.append(type(e).__name__ if status_code is None else f'{type(e).__name__}:{status_code}')
+                if limiter is not None and status_code == 429:
+                    limiter.back_off()
+                if tail_latency is not None and tail_latency.backoff_base:
+                    delay = tail_latency.backoff(attempt, self.random)
+                else:
+                    delay = sleep_period if limiter is None else 0
+                past_deadline = deadline is not None and time.perf_counter() + delay >= deadline
+                if attempt >= retries or past_deadline:
+                    if self.metrics is not None:
+                        self.metrics.on_turn(llm_api, model, time.perf_counter() - turn_start,
+                                             retries=attempt, errors=errors, timeouts=timeouts, hedges=hedges, ok=False)
+                    if past_deadline:
+                        raise DeadlineExceeded(f"Turn of {llm_api}/{model} exceeded its deadline of "
+                                               f"{tail_latency.turn_deadline} s after {attempt + 1} attempt(s)") from e
+                    raise
+                if delay:
+                    await asyncio.sleep(delay)
+                continue
+            provider_seconds = time.perf_counter() - call_start
+            self.latencies.add(llm_api, model, provider_seconds)
+            if limiter is not None:
+                actual_tokens = ((completion.prompt_tokens or estimate_prompt_tokens(messages))
+                                 + (completion.completion_tokens or estimate_tokens(completion.text)))
+                limiter.correct(estimated_tokens, actual_tokens)
+            if self.cache is not None:
+                self.cache.put(cache_key, completion)
+            if self.metrics is not None:
+                self.metrics.on_turn(
+                    llm_api, model, time.perf_counter() - turn_start,
+                    provider_seconds=provider_seconds,
+                    rate_limit_wait_seconds=rate_limit_wait,
+                    time_to_first_token=completion.time_to_first_token,
+                    prompt_tokens=completion.prompt_tokens,
+                    completion_tokens=completion.completion_tokens,
+                    retries=attempt,
+                    errors=errors,
+                    timeouts=timeouts,
+                    hedges=hedges,
+                )
+            return completion
+
+
+async def run_jobs_async(
+    jobs: Iterable[Any],
+    func: Callable[[Any], Awaitable[Any]],
+    max_concurrency: int = 1,
+    describe: Callable[[Any], str] = str,
+    output: Optional[Callable[[str], None]] = print,
+    total: Optional[int] = None,
+) -> List[JobResult]:
+    """
+    Asynchronous counterpart of `llm_eval.runner.run_jobs`: run the coroutine function `func` over `jobs`
+    with at most `max_concurrency` of them in flight. Failures are isolated per job and progress is
+    reported in submission order.
+
+    The jobs are pulled one at a time by `max_concurrency` worker tasks, so there is one task per worker
+    rather than per job, and `jobs` may be a generator. When the surrounding task is cancelled (asyncio.run does so on Ctrl-C), the workers
+    stop pulling jobs, the jobs already running are allowed to finish (so they can write their output), and
+    the cancellation is re-raised.
+    """
+    if max_concurrency < 1:
+        raise ValueError(f"max_concurrency must be at least 1: {max_concurrency}")
+
+    progress = OrderedProgress(count_jobs(jobs, total), describe, output)
+    results: List[JobResult] = []
+    job_iter = iter(enumerate(jobs))
+    running = 0
+    stopping = False
+
+    async def worker():
+        nonlocal running
+        while not stopping:
+            index, job = next(job_iter, (None, None))
+            if index is None:
+                return
+            running += 1
+            try:
+                result = JobResult(index, job, value=await func(job))
+            except Exception as e:
+                traceback.print_exc()
+                result = JobResult(index, job, error=e)
+            finally:
+                running -= 1
+            results.append(result)
+            progress.add(result)
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(max_concurrency)]
+    try:
+        # Unlike gather, wait leaves the workers running when this task is cancelled
+        await asyncio.wait(workers)
+    except asyncio.CancelledError:
+        stopping = True
+        if output is not None:
+            output(f"Interrupted: waiting for {running} running job(s) to finish...")
+        await asyncio.wait(workers)
+        progress.flush()
+        raise
+    results.sort(key=lambda result: result.index)
+    return results
@@ -0,0 +1,99 @@
+import json
+import asyncio
+import hashlib
+from typing import Any, Dict, Optional, Tuple
+
+
+class ForkConf:
+    """
+    The `fork` section of the exp conf.
+
+    Keys:
+        - 'prefix_turns' (int): Number of opening turns that are conducted once and shared by every session that
+          would produce the same opening. Required.
+        - 'share_across_rounds' (bool): Also share the opening between the rounds of a combination. The rounds
+          then differ only after the prefix. Defaults to False: each round index has its own prefix.
+
+    Raises:
+        ValueError: If a value is invalid or a key is unknown.
+    """
+
+    KEYS = ('prefix_turns', 'share_across_rounds')
+
+    def __init__(self, conf: Dict[str, Any]):
+        unknown_keys = set(conf) - set(self.KEYS)
+        if unknown_keys:
+            raise ValueError(f"Unknown keys in fork: {', '.join(sorted(unknown_keys))}")
+        self.prefix_turns = conf.get('prefix_turns')
+        self.share_across_rounds = conf.get('share_across_rounds', False)
+        if not isinstance(self.prefix_turns, int) or self.prefix_turns < 1:
+            raise ValueError(f"fork prefix_turns must be a positive integer: {self.prefix_turns}")
+
+
+def prefix_id(party_conf_dict: Dict, prefix_turns: int, round_index: Optional[int] = None) -> str:
+    """
+    Identify a conversation prefix.
+
+    Attendees speak in turn, so the first `prefix_turns` messages depend only on the configurations of the attendees
+    who speak in them: the first `prefix_turns` attendees, or all of them. Sessions whose configurations differ only
+    in the other attendees (typically their instructions) share the prefix.
+
+    Args:
+        party_conf_dict (Dict): Compiled party configuration.
+        prefix_turns (int): Number of turns of the prefix.
+        round_index (Optional[int]): Round of the session, or None if the prefix is shared across rounds.
+
+    Returns:
+        str: Hex digest of the speakers' configurations, the prefix length and the round.
+    """
+    speakers = party_conf_dict['attendees'][:prefix_turns]
+    payload = json.dumps([speakers, prefix_turns, round_index], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class PrefixForker:
+    """
+    Conducts each shared conversation prefix once and hands out its snapshot to every session that forks from it.
+
+    The first session that needs a prefix conducts it with the `SessionEngine`; sessions that need the same prefix
+    meanwhile wait for it instead of conducting it again. If conducting a prefix fails, the sessions waiting for it
+    fail with the same error, and the next session that needs the prefix conducts it again. Snapshots are kept for
+    the lifetime of the forker, one per distinct prefix.
+    """
+
+    def __init__(self, session_engine, conf: ForkConf):
+        self.session_engine = session_engine
+        self.conf = conf
+        self._prefixes: Dict[str, asyncio.Future] = {}
+        self.prefixes_run = 0
+        self.forks = 0
+
+    async def get_prefix(self, party_conf_dict: Dict, round_index: int, verbose: bool = False) -> Tuple[str, Dict]:
+        """
+        Returns:
+            Tuple[str, Dict]: The `prefix_id` and the snapshot of the prefix (`ChatSession.to_dict`).
+        """
+        key = prefix_id(party_conf_dict, self.conf.prefix_turns, None if self.conf.share_across_rounds else round_index)
+        self.forks += 1
+        future = self._prefixes.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._prefixes[key] = future
+            self.prefixes_run += 1
+            try:
+                # A prefix shared across rounds is one sample; otherwise it is a sample of its round
+                sample_index = 0 if self.conf.share_across_rounds else round_index
+                future.set_result(await self.session_engine.run_prefix(party_conf_dict, self.conf.prefix_turns, verbose,
+                                                                       sample_index))
+            except asyncio.CancelledError:
+                future.cancel()
+                del self._prefixes[key]
+                raise
+            except Exception as e:
+                future.set_exception(e)
+                # Mark the exception as retrieved even if no other session waits for this prefix
+                future.exception()
+                # The next session that needs the prefix conducts it again
+                del self._prefixes[key]
+        # shield: a cancelled session must not cancel the prefix other sessions wait for
+        return key, await asyncio.shield(future)
@@ -0,0 +1,122 @@
+import os
+import hashlib
+import itertools
+from typing import Dict, Iterator, List, Sequence, Tuple, Union
+
+
+def list_instruction_files(init_instr_dir: str) -> List[str]:
+    """
+    List the initial instruction files of a directory in alphabetical order, ignoring hidden files like '.DS_Store'.
+
+    Returns:
+        List[str]: File names, without the directory.
+    """
+    return sorted(file for file in os.listdir(init_instr_dir) if not file.startswith('.'))
+
+
+class InstructionStore:
+    """
+    Contents of initial instruction files, keyed by the SHA-256 of the content.
+    Files with identical contents are stored once.
+    """
+
+    def __init__(self):
+        self._contents: Dict[str, str] = {}
+
+    def add(self, text: str) -> str:
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        self._contents.setdefault(digest, text)
+        return digest
+
+    def text(self, digest: str) -> str:
+        return self._contents[digest]
+
+    def __len__(self):
+        return len(self._contents)
+
+
+class InstructionIndex:
+    """
+    Index of the initial instruction files of several directories.
+
+    Each directory is scanned once, and every file is read once into an `InstructionStore`.
+
+    Raises:
+        ValueError: If any directory does not exist or is empty.
+    """
+
+    def __init__(self, init_instr_dirs: List[str]):
+        self.store = InstructionStore()
+        self.paths: List[List[str]] = []
+        self.digests: Dict[str, str] = {}
+
+        for dir_path in init_instr_dirs:
+            # Check if directory exists
+            if not os.path.exists(dir_path) or not os.path.isdir(dir_path):
+                raise ValueError(f"Directory does not exist: {dir_path}")
+
+            file_names = list_instruction_files(dir_path)
+
+            # Check if directory is empty
+            if not file_names:
+                raise ValueError(f"Directory is empty: {dir_path}")
+
+            full_paths = [os.path.join(dir_path, file_name) for file_name in file_names]
+            for file_path in full_paths:
+                try:
+                    with open(file_path, 'r') as file:
+                        self.digests[file_path] = self.store.add(file.read())
+                except:
+                    print(f"Error reading file: {file_path}")
+                    raise
+            self.paths.append(full_paths)
+
+    def text(self, file_path: str) -> str:
+        return self.store.text(self.digests[file_path])
+
+    def combinations(self) -> "InstructionCombinations":
+        return InstructionCombinations(self)
+
+
+class InstructionCombinations(Sequence[Tuple[str, ...]]):
+    """
+    All combinations of initial instruction files across the directories of an `InstructionIndex`, in the order
+    of `itertools.product`: the file of the last directory changes fastest.
+
+    Combinations are computed on demand. `len()` and indexing take time proportional to the number of directories,
+    so a suite can be planned, sampled and split without building the cross product.
+    """
+
+    def __init__(self, index: InstructionIndex):
+        self.index = index
+        self._sizes = [len(paths) for paths in index.paths]
+        self._length = 1
+        for size in self._sizes:
+            self._length *= size
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, position: Union[int, slice]) -> Union[Tuple[str, ...], List[Tuple[str, ...]]]:
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(self._length))]
+        if position < 0:
+            position += self._length
+        if not 0 <= position < self._length:
+            raise IndexError(f"Combination index out of range: {position}")
+        combination = []
+        for paths, size in zip(reversed(self.index.paths), reversed(self._sizes)):
+            position, offset = divmod(position, size)
+            combination.append(paths[offset])
+        return tuple(reversed(combination))
+
+    def __iter__(self) -> Iterator[Tuple[str, ...]]:
+        return itertools.product(*self.index.paths)
+
+    def texts(self, combination: Tuple[str, ...]) -> Tuple[str, ...]:
+        """Contents of the instruction files of a combination."""
+        return tuple(self.index.text(file_path) for file_path in combination)
+
+    def digests(self, combination: Tuple[str, ...]) -> Tuple[str, ...]:
+        """Content hashes of the instruction files of a combination."""
+        return tuple(self.index.digests[file_path] for file_path in combination)
@@ -0,0 +1,129 @@
+import random
+import asyncio
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+from llm_eval.metrics import percentile
+
+# Provider latencies kept per (llm_api, model) to estimate hedging thresholds
+LATENCY_WINDOW = 1000
+
+
+class DeadlineExceeded(TimeoutError):
+    """A turn or a session ran past its deadline."""
+
+
+class TailLatencyConf:
+    """
+    The `tail_latency` entry of an attendee's `attendee_params` in the party conf.
+
+    Keys:
+        - 'attempt_timeout' (float): Seconds after which a provider call is abandoned. The attempt counts as a
+          timeout and is retried like a failed call, up to the `retries` of the `llm_api_params`.
+        - 'turn_deadline' (float): Seconds the whole turn may take, including retries and backoff. The turn then
+          fails with `DeadlineExceeded`.
+        - 'backoff_base' (float): Retry after a random delay between 0 and `backoff_base * 2 ** attempt` seconds
+          (exponential backoff with full jitter) instead of waiting `sleep_period`.
+        - 'backoff_max' (float): Upper bound of the backoff delay. Defaults to 30.
+        - 'hedge_after' (float or str): Send a duplicate call if the first one has not answered after this many
+          seconds, or after the given percentile of the provider latencies observed for the model so far, e.g.
+          'p95'. The first answer wins and the other call is cancelled.
+        - 'hedge_min_samples' (int): Latencies observed before a percentile threshold applies. Defaults to 20.
+
+    Raises:
+        ValueError: If a value is invalid or a key is unknown.
+    """
+
+    KEYS = ('attempt_timeout', 'turn_deadline', 'backoff_base', 'backoff_max', 'hedge_after', 'hedge_min_samples')
+
+    def __init__(self, conf: Dict[str, Any]):
+        unknown_keys = set(conf) - set(self.KEYS)
+        if unknown_keys:
+            raise ValueError(f"Unknown keys in tail_latency: {', '.join(sorted(unknown_keys))}")
+        self.attempt_timeout = conf.get('attempt_timeout')
+        self.turn_deadline = conf.get('turn_deadline')
+        self.backoff_base = conf.get('backoff_base')
+        self.backoff_max = conf.get('backoff_max', 30)
+        self.hedge_min_samples = conf.get('hedge_min_samples', 20)
+        for key in ('attempt_timeout', 'turn_deadline', 'backoff_base', 'backoff_max'):
+            value = getattr(self, key)
+            if value is not None and (not isinstance(value, (int, float)) or value <= 0):
+                raise ValueError(f"tail_latency {key} must be a positive number of seconds: {value}")
+        if not isinstance(self.hedge_min_samples, int) or self.hedge_min_samples < 1:
+            raise ValueError(f"tail_latency hedge_min_samples must be a positive integer: {self.hedge_min_samples}")
+
+        hedge_after = conf.get('hedge_after')
+        self.hedge_seconds: Optional[float] = None
+        self.hedge_quantile: Optional[float] = None
+        if isinstance(hedge_after, str) and hedge_after.startswith('p'):
+            try:
+                self.hedge_quantile = float(hedge_after[1:]) / 100
+            except ValueError:
+                self.hedge_quantile = None
+            if self.hedge_quantile is None or not 0 < self.hedge_quantile < 1:
+                raise ValueError(f"tail_latency hedge_after must be seconds or a percentile like 'p95': {hedge_after}")
+        elif hedge_after is not None:
+            if not isinstance(hedge_after, (int, float)) or hedge_after <= 0:
+                raise ValueError(f"tail_latency hedge_after must be seconds or a percentile like 'p95': {hedge_after}")
+            self.hedge_seconds = float(hedge_after)
+
+    @classmethod
+    def from_attendee_params(cls, attendee_params: Optional[Dict[str, Any]]) -> Optional["TailLatencyConf"]:
+        conf = (attendee_params or {}).get('tail_latency')
+        return cls(conf) if conf is not None else None
+
+    def backoff(self, attempt: int, rng: random.Random) -> float:
+        """Delay before retry number `attempt + 1`."""
+        return rng.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+class LatencyTracker:
+    """Recent provider latencies per (llm_api, model), from which percentile hedging thresholds are taken."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples: Dict[Tuple[str, str], Deque[float]] = defaultdict(lambda: deque(maxlen=window))
+
+    def add(self, llm_api: str, model: Optional[str], seconds: float):
+        self.samples[(llm_api, model or '')].append(seconds)
+
+    def hedge_delay(self, llm_api: str, model: Optional[str], conf: TailLatencyConf) -> Optional[float]:
+        """Seconds to wait before hedging a call, or None if the call is not hedged (yet)."""
+        if conf.hedge_seconds is not None:
+            return conf.hedge_seconds
+        if conf.hedge_quantile is None:
+            return None
+        samples = self.samples.get((llm_api, model or ''))
+        if not samples or len(samples) < conf.hedge_min_samples:
+            return None
+        return percentile(list(samples), conf.hedge_quantile)
+
+
+async def call_hedged(call: Callable[[], Awaitable[Any]], hedge_delay: Optional[float],
+                      hedge: Optional[Callable[[], Awaitable[Any]]] = None) -> Any:
+    """
+    Await `call()`. If it has not finished after `hedge_delay` seconds, start `hedge()` (by default `call()` again)
+    and return the first successful result. If one call fails, the other one is awaited; if both fail, the first
+    error is raised. The call that loses is cancelled.
+    """
+    if hedge_delay is None:
+        return await call()
+    first = asyncio.ensure_future(call())
+    tasks = [first]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+        if done:
+            return first.result()
+        tasks.append(asyncio.ensure_future((hedge or call)()))
+        errors = []
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in tasks:
+                if task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    errors.append(task.exception())
+        raise errors[0]
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
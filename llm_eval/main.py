@@ -1,5 +1,3 @@
-import llm_party
-import md_jinja
 import argparse
 import yaml
 from llm_eval.service import load_instructions, compile_party_config, conduct_chat_session
@@ -1,7 +1,21 @@
 import argparse
+import contextlib
+import csv
+import json
+import os
+import sys
+import time
 import yaml
-from typing import List, Dict
-from llm_eval.controller import run_exp_suite
+from typing import List, Dict, Optional
+from llm_eval.controller import ENGINES, SuitePlan, run_exp_suite
+from llm_eval.runner import JobResult
+from llm_eval.cache import CACHE_MODES, ResponseCache
+from llm_eval.manifest import Manifest
+from llm_eval.sink import COMPRESSIONS, RESULT_FORMATS, make_sink
+from llm_eval.metrics import MetricsRecorder
+from llm_eval.merge import merge_outputs
+from llm_eval.shard import Shard
+from llm_eval.results_db import RESULTS_DB_FILE_NAME, ResultsDatabase
 
 def load_exp_suites_conf(exp_suites_conf_path: str) -> List[Dict]:
     """
@@ -16,6 +30,262 @@ def load_exp_suites_conf(exp_suites_conf_path: str) -> List[Dict]:
     with open(exp_suites_conf_path, 'r') as file:
         return yaml.safe_load(file)
 
+def merge_main(argv: List[str]):
+    """
+    Merge the output directories of several shards: `llm_eval merge -o OUTPUT_DIR SHARD_DIR...`.
+
+    Exits with status 1 if units planned by the shards are missing from the merged output.
+    """
+    parser = argparse.ArgumentParser(prog='llm_eval merge', description='Combine the output directories of several shards into one.')
+    parser.add_argument('shard_dirs', nargs='+', help='Output directories of the shards')
+    parser.add_argument('--output-dir', '-o', type=str, required=True, help='Directory to write the merged output to')
+    args = parser.parse_args(argv)
+
+    try:
+        report = merge_outputs(args.shard_dirs, args.output_dir)
+    except ValueError as e:
+        parser.error(str(e))
+
+    print(f'Merged {report.merged_units} unit(s) from {len(args.shard_dirs)} shard(s) into {args.output_dir}')
+    if report.duplicate_units:
+        print(f'Skipped {report.duplicate_units} unit(s) completed by more than one shard')
+    if report.missing_units:
+        print(f'{len(report.missing_units)} unit(s) are missing:', file=sys.stderr)
+        for suite, combination_index, round_index in report.missing_units:
+            print(f'  {suite}: combination {combination_index + 1}, round {round_index + 1}', file=sys.stderr)
+        sys.exit(1)
+
+QUERY_FORMATS = ('table', 'jsonl', 'csv')
+QUERY_COLUMNS = ['suite', 'combination_index', 'round_index', 'status', 'finish_reason', 'turn_count', 'duration_seconds',
+                 'start_at', 'models']
+
+def query_main(argv: List[str]):
+    """
+    Filter the rounds of a results database and export them: `llm_eval query OUTPUT_DIR [filters]`.
+    """
+    parser = argparse.ArgumentParser(prog='llm_eval query', description='Filter and export the rounds of a results.sqlite database.')
+    parser.add_argument('path', help=f'Output directory with a {RESULTS_DB_FILE_NAME}, or the database file itself')
+    parser.add_argument('--suite', type=str, help='Only rounds of this experiment suite')
+    parser.add_argument('--model', type=str, help='Only rounds in which an attendee uses this model')
+    parser.add_argument('--llm-api', type=str, help='Only rounds in which an attendee uses this LLM API')
+    parser.add_argument('--min-turns', type=int, help='Only rounds with at least this many messages')
+    parser.add_argument('--max-turns', type=int, help='Only rounds with at most this many messages')
+    parser.add_argument('--status', type=str, help='Only rounds with this status, e.g. completed_successfully')
+    parser.add_argument('--round', type=int, dest='round_index', help='Only rounds with this round index (0-based)')
+    parser.add_argument('--instruction-digest', type=str, help='Only rounds with an initial instruction whose SHA-256 starts with this')
+    parser.add_argument('--limit', type=int, help='Return at most this many rounds')
+    parser.add_argument('--format', '-f', choices=QUERY_FORMATS, default='table', help='table: one line per round; jsonl: rounds with chat session and party conf; csv: one row per round')
+    parser.add_argument('--output', '-o', type=str, help='Write to this file instead of the standard output')
+    args = parser.parse_args(argv)
+
+    path = os.path.join(args.path, RESULTS_DB_FILE_NAME) if os.path.isdir(args.path) else args.path
+    if not os.path.exists(path):
+        parser.error(f'No results database: {path}')
+    database = ResultsDatabase(path)
+    try:
+        rounds = database.query_rounds(suite=args.suite, model=args.model, llm_api=args.llm_api, min_turns=args.min_turns,
+                                       max_turns=args.max_turns, status=args.status, round_index=args.round_index,
+                                       instruction_digest=args.instruction_digest, limit=args.limit,
+                                       with_chat_session=args.format == 'jsonl')
+        output = open(args.output, 'w', newline='') if args.output else sys.stdout
+        try:
+            count = write_query_results(rounds, args.format, output)
+        finally:
+            if args.output:
+                output.close()
+    finally:
+        database.close()
+    print(f'{count} round(s)', file=sys.stderr)
+
+def write_query_results(rounds, output_format: str, output) -> int:
+    count = 0
+    if output_format == 'jsonl':
+        for round_record in rounds:
+            output.write(json.dumps(round_record, ensure_ascii=False) + '\n')
+            count += 1
+        return count
+    rows = ([format_query_value(round_record[column]) for column in QUERY_COLUMNS] for round_record in rounds)
+    if output_format == 'csv':
+        writer = csv.writer(output)
+        writer.writerow(QUERY_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+        return count
+    output.write('\t'.join(QUERY_COLUMNS) + '\n')
+    for row in rows:
+        output.write('\t'.join(row) + '\n')
+        count += 1
+    return count
+
+def format_query_value(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return ' '.join(value)
+    return str(value)
+
+def add_run_arguments(parser: argparse.ArgumentParser):
+    """Add the options of how sessions are conducted and written, shared by `llm_eval` and `llm_eval worker`."""
+    parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose mode')
+    parser.add_argument('--max-concurrency', '-j', type=int, default=1, help='Maximum number of chat sessions conducted at the same time')
+    parser.add_argument('--engine', '-e', choices=ENGINES, default='threads', help='Session engine: llm_party on worker threads, or the asyncio engine with rate limiting')
+    parser.add_argument('--cache-dir', type=str, help='Directory of the LLM response cache (asyncio engine only)')
+    parser.add_argument('--cache-mode', choices=CACHE_MODES, default='read-through', help='record: always call the LLM and store; replay: fail on a cache miss; read-through: call the LLM on a miss only')
+    parser.add_argument('--cache-max-mb', type=float, help='Evict least recently used cache entries beyond this size')
+    parser.add_argument('--result-format', choices=RESULT_FORMATS, default='files', help='files: one chat history and one party conf file per round; jsonl: append compact records to results.jsonl; sqlite: indexed rows in results.sqlite, see `llm_eval query`')
+    parser.add_argument('--compression', choices=COMPRESSIONS, help='Compress results.jsonl (jsonl format only)')
+    parser.add_argument('--per-turn', action='store_true', help='Also write one record per turn (jsonl format only)')
+    parser.add_argument('--metrics', action='store_true', help='Write metrics.prom (Prometheus text format) and metrics_summary.json to the output directory')
+
+def check_run_arguments(parser: argparse.ArgumentParser, args: argparse.Namespace) -> Optional[ResponseCache]:
+    """
+    Validate the options added by `add_run_arguments`.
+
+    Returns:
+        Optional[ResponseCache]: The response cache, if one was requested.
+    """
+    if args.max_concurrency < 1:
+        parser.error('--max-concurrency must be at least 1')
+    if args.cache_dir and args.engine != 'asyncio':
+        parser.error('--cache-dir requires --engine asyncio')
+    if args.result_format != 'jsonl' and (args.compression or args.per_turn):
+        parser.error('--compression and --per-turn require --result-format jsonl')
+    if not args.cache_dir:
+        return None
+    max_bytes = int(args.cache_max_mb * 1024 * 1024) if args.cache_max_mb else None
+    return ResponseCache(args.cache_dir, args.cache_mode, max_bytes)
+
+def run_exp_suites(exp_suite_conf_list: List[Dict], output_dir: str, args: argparse.Namespace,
+                   cache: Optional[ResponseCache], resume: bool = False, shard: Optional[Shard] = None) -> List[JobResult]:
+    """
+    Conduct experiment suites into `output_dir` with the options of `add_run_arguments`.
+
+    Returns:
+        List[JobResult]: The results of the sessions that failed.
+    """
+    # Every completed session is recorded in the manifest of the output directory
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = Manifest(output_dir)
+    # The default file sink is created per suite, with the time the suite started in its file names
+    metrics = MetricsRecorder() if args.metrics else None
+    sink = make_sink(output_dir, args.result_format, args.compression, args.per_turn) if args.result_format != 'files' else None
+
+    failures = []
+    try:
+        for exp_suite in exp_suite_conf_list:
+            results = run_exp_suite(exp_suite, args.verbose, output_dir, args.max_concurrency, args.engine, cache,
+                                    manifest, resume, sink, metrics, shard)
+            failures.extend(result for result in results if not result.ok)
+    finally:
+        manifest.close()
+        if sink is not None:
+            sink.close()
+        if metrics is not None:
+            metrics.write(output_dir)
+    return failures
+
+def validate_exp_suites(exp_suite_conf_list: List[Dict], engine: str) -> bool:
+    """
+    Load and validate every suite without conducting sessions, printing one line per suite.
+
+    Returns:
+        bool: True if all suites are valid.
+    """
+    valid = True
+    for exp_suite in exp_suite_conf_list:
+        try:
+            plan = SuitePlan.load(exp_suite, engine)
+        except (ValueError, OSError) as e:
+            print(f'{exp_suite.get("exp suite", exp_suite.get("party conf"))}: invalid: {e}', file=sys.stderr)
+            valid = False
+            continue
+        print(f'{plan.describe()}, {plan.num_sessions} session(s)')
+    return valid
+
+def worker_main(argv: List[str]):
+    """
+    Conduct a stream of jobs in one long-lived process: `llm_eval worker [--jobs FILE] [--results FILE] [options]`.
+
+    Each line of the job stream is a JSON object:
+        - "exp suites conf" (str): Path of an experiment suites configuration file, or
+          "exp suites" (list): the experiment suites inline, in the same format.
+        - "output dir" (str): Directory to save the output files of the job.
+        - "id" (optional): Echoed in the result line. Defaults to the line number.
+        - "resume" (bool, optional), "shard" (str, optional): As `--resume` and `--shard`.
+
+    One JSON line is written per job: its "id", "ok", "sessions_failed", "failures", "error" and "seconds".
+    llm_party and the LLM clients are imported once, and the response cache is shared by all jobs. Progress is
+    printed to the standard error, so that the results can be read from the standard output.
+    """
+    parser = argparse.ArgumentParser(prog='llm_eval worker', description='Conduct a stream of jobs given as JSON lines.')
+    parser.add_argument('--jobs', type=str, default='-', help='JSONL file of jobs, or - for the standard input (default)')
+    parser.add_argument('--results', type=str, default='-', help='File to append one JSON result line per job to, or - for the standard output (default)')
+    add_run_arguments(parser)
+    args = parser.parse_args(argv)
+    cache = check_run_arguments(parser, args)
+
+    # Load llm_party and the LLM clients once, before the first job
+    import llm_party  # noqa: F401
+
+    jobs_file = sys.stdin if args.jobs == '-' else open(args.jobs, 'r')
+    results_file = sys.stdout if args.results == '-' else open(args.results, 'a')
+    any_failed = False
+    try:
+        for line_number, line in enumerate(jobs_file, start=1):
+            if not line.strip():
+                continue
+            result = run_worker_job(line, line_number, args, cache)
+            any_failed = any_failed or not result['ok']
+            results_file.write(json.dumps(result, ensure_ascii=False) + '\n')
+            results_file.flush()
+    except KeyboardInterrupt:
+        print('Interrupted. Output of the finished sessions has been saved.', file=sys.stderr)
+        sys.exit(130)
+    finally:
+        if jobs_file is not sys.stdin:
+            jobs_file.close()
+        if results_file is not sys.stdout:
+            results_file.close()
+    if any_failed:
+        sys.exit(1)
+
+def run_worker_job(line: str, line_number: int, args: argparse.Namespace, cache: Optional[ResponseCache]) -> Dict:
+    """Conduct the job of one line of the job stream and return its result line."""
+    start = time.perf_counter()
+    result = {'id': line_number, 'ok': False, 'sessions_failed': 0, 'failures': [], 'error': None}
+    try:
+        job = json.loads(line)
+        if not isinstance(job, dict):
+            raise ValueError('A job must be a JSON object')
+        result['id'] = job.get('id', line_number)
+        if 'output dir' not in job:
+            raise ValueError("A job must have an 'output dir'")
+        if 'exp suites' in job:
+            exp_suite_conf_list = job['exp suites']
+        elif 'exp suites conf' in job:
+            exp_suite_conf_list = load_exp_suites_conf(job['exp suites conf'])
+        else:
+            raise ValueError("A job must have 'exp suites conf' or 'exp suites'")
+        shard = Shard.parse(job['shard']) if job.get('shard') else None
+        # Keep the standard output for result lines
+        with contextlib.redirect_stdout(sys.stderr):
+            failures = run_exp_suites(exp_suite_conf_list, job['output dir'], args, cache, job.get('resume', False), shard)
+        result['ok'] = not failures
+        result['sessions_failed'] = len(failures)
+        result['failures'] = [f'{failure.job}: {type(failure.error).__name__}: {failure.error}' for failure in failures]
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+        print(f'Job {result["id"]} failed: {result["error"]}', file=sys.stderr)
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+SUBCOMMANDS = {
+    'merge': merge_main,
+    'query': query_main,
+    'worker': worker_main,
+}
+
 def main():
     """
     Main function to run experiment suites for evaluating chat sessions between two AI agents.
@@ -23,20 +293,53 @@ def main():
     This script parses command-line arguments to receive the configuration file for experiment suites,
     a flag to enable verbose mode, and the output directory to save the results. It then loads the
     experiment suites configuration and conducts each experiment suite as specified.
+
+    Subcommands (`llm_eval merge ...`, `llm_eval query ...`, `llm_eval worker ...`) are dispatched to their own
+    functions.
     """
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        return SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+
     parser = argparse.ArgumentParser(description='Run experiment suites for evaluating chat sessions between two AI agents.')
     parser.add_argument('--exp-suites-conf', '-c', type=str, required=True, help='Configuration file for the experiment suites')
-    parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose mode')
-    parser.add_argument('--output-dir', '-o', type=str, required=True, help='Directory to save output files')
+    parser.add_argument('--output-dir', '-o', type=str, help='Directory to save output files (required unless --dry-run)')
+    parser.add_argument('--resume', action='store_true', help='Skip the sessions the manifest of the output directory records as completed')
+    parser.add_argument('--shard', type=str, help='Run only shard i of N (0-based, e.g. 0/4). Combine the output directories with `llm_eval merge`')
+    parser.add_argument('--dry-run', action='store_true', help='Validate the experiment suites and print how many sessions each has, without conducting any')
+    add_run_arguments(parser)
 
     args = parser.parse_args()
+    if not args.dry_run and not args.output_dir:
+        parser.error('the following arguments are required: --output-dir/-o')
+    cache = check_run_arguments(parser, args)
+    shard = None
+    if args.shard:
+        try:
+            shard = Shard.parse(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
 
     # Load the configuration file for the experiment suites
     exp_suite_conf_list = load_exp_suites_conf(args.exp_suites_conf)
 
+    if args.dry_run:
+        sys.exit(0 if validate_exp_suites(exp_suite_conf_list, args.engine) else 1)
+
     # Conduct each experiment suite
-    for exp_suite in exp_suite_conf_list:
-        run_exp_suite(exp_suite, args.verbose, args.output_dir)
+    try:
+        failures = run_exp_suites(exp_suite_conf_list, args.output_dir, args, cache, args.resume, shard)
+    except KeyboardInterrupt:
+        print('Interrupted. Output of the finished sessions has been saved.', file=sys.stderr)
+        sys.exit(130)
+
+    if cache is not None:
+        print(f'Response cache: {cache.hits} hit(s), {cache.misses} miss(es)')
+
+    if failures:
+        print(f'{len(failures)} session(s) failed:', file=sys.stderr)
+        for result in failures:
+            print(f'  {result.job}: {type(result.error).__name__}: {result.error}', file=sys.stderr)
+        sys.exit(1)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
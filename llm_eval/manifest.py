@@ -0,0 +1,134 @@
+import os
+import json
+import hashlib
+import datetime
+import tempfile
+import threading
+from typing import Any, Dict, Optional, Sequence
+from llm_eval.sink import truncate_partial_line
+
+MANIFEST_FILE_NAME = 'manifest.json'
+MANIFEST_LOG_FILE_NAME = 'manifest.log'
+
+
+def unit_key(suite: str, init_instr_list: Sequence[Optional[str]], init_instr_digests: Sequence[str],
+             round_index: int) -> str:
+    """
+    Identify one unit of work: a round of one combination of initial instructions in an experiment suite.
+
+    The combination is identified by the paths of its instruction files together with the digests of their contents
+    (see `InstructionStore`), so a unit whose instruction file was edited gets a new key and is conducted again on
+    resume, while files with the same contents remain distinct units.
+
+    Returns:
+        str: Hex digest that stays the same across runs for the same unit.
+    """
+    payload = json.dumps([suite, list(init_instr_list), list(init_instr_digests), round_index], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class Manifest:
+    """
+    Completion manifest of an output directory.
+
+    Each completed round is recorded under its `unit_key` together with the files it produced. The plan of each
+    suite (number of combinations and rounds, and the shard that was run) is recorded as well, so that missing units
+    can be found when the output directories of several shards are merged.
+
+    A completed unit is appended to `manifest.log` as one JSON line and synced, so recording a unit costs the same
+    however many units the manifest holds. Loading folds the log into `manifest.json`, skipping a line torn by a
+    crash. `close` compacts the log into `manifest.json`, which is rewritten atomically (write to a temporary file,
+    then rename), so a crash leaves either the previous or the new version on disk, never a torn one.
+    """
+
+    def __init__(self, output_dir: str):
+        self.path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+        self.log_path = os.path.join(output_dir, MANIFEST_LOG_FILE_NAME)
+        self._lock = threading.Lock()
+        self._log = None
+        self.units: Dict[str, Dict[str, Any]] = {}
+        self.plans: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+            self.units = data.get('units', {})
+            self.plans = data.get('plans', {})
+        if os.path.exists(self.log_path):
+            with open(self.log_path, 'r') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Only the last line can be torn, by a crash while it was appended
+                        break
+                    self.units[entry['key']] = entry['record']
+
+    def is_complete(self, key: str) -> bool:
+        return key in self.units
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.units.get(key)
+
+    def mark_complete(self, key: str, record: Dict[str, Any]):
+        """
+        Record a completed unit and append it to the log.
+
+        Args:
+            key (str): The `unit_key` of the unit.
+            record (Dict[str, Any]): JSON-serializable details of the unit, e.g. its suite, round and output files.
+        """
+        record = dict(record, completed_at=datetime.datetime.now().isoformat(timespec='seconds'))
+        line = json.dumps({'key': key, 'record': record}, ensure_ascii=False) + '\n'
+        with self._lock:
+            if self._log is None:
+                if os.path.exists(self.log_path):
+                    truncate_partial_line(self.log_path)
+                self._log = open(self.log_path, 'a')
+            self._log.write(line)
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self.units[key] = record
+
+    def record_plan(self, suite: str, plan: Dict[str, Any]):
+        """
+        Record the plan of a suite and persist the manifest.
+
+        Args:
+            suite (str): Name of the suite.
+            plan (Dict[str, Any]): JSON-serializable plan, e.g. its number of combinations and rounds.
+        """
+        with self._lock:
+            if self.plans.get(suite) == plan:
+                return
+            self.plans[suite] = plan
+            self._compact()
+
+    def merge(self, units: Dict[str, Dict[str, Any]], plans: Dict[str, Dict[str, Any]]):
+        """Add the units and plans of other manifests and persist the manifest once."""
+        with self._lock:
+            self.units.update(units)
+            self.plans.update(plans)
+            self._compact()
+
+    def close(self):
+        """Compact the log into `manifest.json`."""
+        with self._lock:
+            if self._log is not None or os.path.exists(self.log_path):
+                self._compact()
+
+    def _compact(self):
+        directory = os.path.dirname(self.path) or '.'
+        with tempfile.NamedTemporaryFile('w', dir=directory, prefix='.manifest_', suffix='.tmp', delete=False) as file:
+            json.dump({'units': self.units, 'plans': self.plans}, file, indent=1, ensure_ascii=False)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(file.name, self.path)
+        # Every logged unit is in manifest.json now. A crash before the log is removed only replays it on load.
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+
+    def __len__(self):
+        return len(self.units)
@@ -0,0 +1,179 @@
+import os
+import json
+import shutil
+from typing import Any, Dict, List, Set, Tuple
+from llm_eval.manifest import MANIFEST_FILE_NAME, MANIFEST_LOG_FILE_NAME, Manifest, unit_key
+from llm_eval.results_db import RESULTS_DB_FILE_NAME, ResultsDatabase
+from llm_eval.scoring import write_scoreboard
+from llm_eval.sink import RESULTS_FILE_NAME, open_results_file
+
+
+class MergeReport:
+    """
+    Outcome of merging the output directories of several shards.
+
+    Attributes:
+        merged_units (int): Number of units in the merged output.
+        duplicate_units (int): Units found in more than one shard. The first shard that has the unit wins.
+        missing_units (List[Tuple[str, int, int]]): (suite, combination index, round index) of the planned units
+                                                    that no shard completed.
+    """
+
+    def __init__(self):
+        self.merged_units = 0
+        self.duplicate_units = 0
+        self.missing_units: List[Tuple[str, int, int]] = []
+
+
+def merge_outputs(shard_dirs: List[str], output_dir: str) -> MergeReport:
+    """
+    Combine the output directories of several shards into one.
+
+    The completed units of every shard's manifest are collected. The files of each unit are copied to
+    `output_dir`, and `results.jsonl` files are combined into one file of the same name, keeping only the records
+    of the merged units and writing every party configuration once. The rounds of the merged units in
+    `results.sqlite` databases are copied into one database. The merged manifest holds all units and
+    the plans of all suites, which are used to report the units no shard completed. If the units have scores, the
+    scoreboard is rebuilt from all of them.
+
+    Args:
+        shard_dirs (List[str]): Output directories of the shards.
+        output_dir (str): Directory to write the merged output to. Must not contain a manifest yet.
+
+    Returns:
+        MergeReport: Counts of the merged and duplicate units, and the missing units.
+
+    Raises:
+        ValueError: If a shard directory has no manifest, the plans of a suite differ between shards, the output
+                    directory already has a manifest, or two shards produced different files with the same name.
+    """
+    if any(os.path.exists(os.path.join(output_dir, name)) for name in (MANIFEST_FILE_NAME, MANIFEST_LOG_FILE_NAME)):
+        raise ValueError(f"Output directory already contains a manifest: {output_dir}")
+
+    report = MergeReport()
+    plans: Dict[str, Dict[str, Any]] = {}
+    units: Dict[str, Dict[str, Any]] = {}
+    unit_sources: Dict[str, str] = {}
+    for shard_dir in shard_dirs:
+        if not any(os.path.exists(os.path.join(shard_dir, name))
+                   for name in (MANIFEST_FILE_NAME, MANIFEST_LOG_FILE_NAME)):
+            raise ValueError(f"Not an output directory, {MANIFEST_FILE_NAME} is missing: {shard_dir}")
+        manifest = Manifest(shard_dir)
+        for suite, plan in manifest.plans.items():
+            merge_plan(plans, suite, plan)
+        for key, record in manifest.units.items():
+            if key in units:
+                report.duplicate_units += 1
+                continue
+            units[key] = record
+            unit_sources[key] = shard_dir
+
+    os.makedirs(output_dir, exist_ok=True)
+    results_files: Set[Tuple[str, str]] = set()
+    database_units: Dict[str, Set[str]] = {}
+    for key, record in units.items():
+        shard_dir = unit_sources[key]
+        for file_name in record.get('files', []):
+            if file_name.startswith(RESULTS_FILE_NAME):
+                results_files.add((shard_dir, file_name))
+            elif file_name == RESULTS_DB_FILE_NAME:
+                database_units.setdefault(shard_dir, set()).add(key)
+            else:
+                copy_file(os.path.join(shard_dir, file_name), os.path.join(output_dir, file_name))
+    merge_results_files(sorted(results_files, key=lambda item: shard_dirs.index(item[0])), unit_sources, output_dir)
+    if database_units:
+        database = ResultsDatabase(os.path.join(output_dir, RESULTS_DB_FILE_NAME))
+        try:
+            for shard_dir in shard_dirs:
+                if shard_dir in database_units:
+                    database.copy_rounds(os.path.join(shard_dir, RESULTS_DB_FILE_NAME), database_units.pop(shard_dir))
+        finally:
+            database.close()
+
+    Manifest(output_dir).merge(units, plans)
+    if any(record.get('scores') for record in units.values()):
+        write_scoreboard(output_dir, units.values())
+    report.merged_units = len(units)
+    report.missing_units = find_missing_units(plans, units.values())
+    return report
+
+
+def merge_plan(plans: Dict[str, Dict[str, Any]], suite: str, plan: Dict[str, Any]):
+    """
+    Add the plan of a suite in one shard to the merged `plans`. The merged plan lists the shards in 'shards'.
+
+    Raises:
+        ValueError: If the number of combinations or rounds differs from another shard of the same suite.
+    """
+    shape = {key: plan.get(key) for key in ('num_combinations', 'num_rounds', 'min_rounds')}
+    merged = plans.setdefault(suite, dict(shape, shards=[]))
+    if {key: merged.get(key) for key in shape} != shape:
+        raise ValueError(f"Shards disagree on the plan of suite {suite}: "
+                         f"{merged['num_combinations']} x {merged['num_rounds']} vs "
+                         f"{shape['num_combinations']} x {shape['num_rounds']} (combinations x rounds)")
+    shards = plan.get('shards') or [plan.get('shard')]
+    for shard in shards:
+        if shard not in merged['shards']:
+            merged['shards'].append(shard)
+
+
+def copy_file(source: str, destination: str):
+    """
+    Raises:
+        ValueError: If `destination` exists with different contents.
+    """
+    if os.path.exists(destination):
+        with open(source, 'rb') as file_a, open(destination, 'rb') as file_b:
+            if file_a.read() == file_b.read():
+                return
+        raise ValueError(f"Two shards produced different files named {os.path.basename(destination)}")
+    shutil.copy2(source, destination)
+
+
+def merge_results_files(results_files: List[Tuple[str, str]], unit_sources: Dict[str, str], output_dir: str):
+    """
+    Append the records of `results.jsonl` files to the file of the same name in `output_dir`.
+
+    Round and turn records are kept only if their unit was taken from the same shard directory, which drops
+    duplicates as well as records of rounds that never made it into the shard's manifest. Party configuration
+    records are written once per file.
+    """
+    outputs = {}
+    written_party_confs: Dict[str, Set[str]] = {}
+    try:
+        for shard_dir, file_name in results_files:
+            if file_name not in outputs:
+                outputs[file_name] = open_results_file(os.path.join(output_dir, file_name), 'wt')
+                written_party_confs[file_name] = set()
+            output = outputs[file_name]
+            with open_results_file(os.path.join(shard_dir, file_name), 'rt') as file:
+                for line in file:
+                    record = json.loads(line)
+                    if record.get('type') == 'party_conf':
+                        if record['party_conf_hash'] in written_party_confs[file_name]:
+                            continue
+                        written_party_confs[file_name].add(record['party_conf_hash'])
+                    else:
+                        key = unit_key(record['suite'], record['init_instr_list'], record['init_instr_digests'],
+                                       record['round_index'])
+                        if unit_sources.get(key) != shard_dir:
+                            continue
+                    output.write(line if line.endswith('\n') else line + '\n')
+    finally:
+        for output in outputs.values():
+            output.close()
+
+
+def find_missing_units(plans: Dict[str, Dict[str, Any]], records) -> List[Tuple[str, int, int]]:
+    """
+    Planned units that are not among `records`. Suites with adaptive rounds are only expected to have their
+    `min_rounds`, since a combination may stop after that.
+    """
+    completed = {(record.get('suite'), record.get('combination_index'), record.get('round_index')) for record in records}
+    missing = []
+    for suite, plan in sorted(plans.items()):
+        for combination_index in range(plan['num_combinations']):
+            for round_index in range(plan.get('min_rounds') or plan['num_rounds']):
+                if (suite, combination_index, round_index) not in completed:
+                    missing.append((suite, combination_index, round_index))
+    return missing
@@ -0,0 +1,257 @@
+import os
+import json
+import math
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+METRICS_FILE_NAME = 'metrics.prom'
+SUMMARY_FILE_NAME = 'metrics_summary.json'
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def percentile(samples: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of `samples`, or None if there are none."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def describe_samples(samples: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        'count': len(samples),
+        'mean': sum(samples) / len(samples) if samples else None,
+        'p50': percentile(samples, 0.5),
+        'p95': percentile(samples, 0.95),
+        'p99': percentile(samples, 0.99),
+        'max': max(samples) if samples else None,
+    }
+
+
+class _ModelStats:
+    def __init__(self):
+        self.turn_seconds: List[float] = []
+        self.provider_seconds: List[float] = []
+        self.rate_limit_wait_seconds: List[float] = []
+        self.time_to_first_token_seconds: List[float] = []
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.batch_sizes: List[int] = []
+        self.timeouts = 0
+        self.hedges = 0
+        self.errors: Dict[str, int] = defaultdict(int)
+
+
+class MetricsRecorder:
+    """
+    Collects timings and counters of a run and writes them out.
+
+    Hooks:
+        - `on_turn`: one LLM call of a session, per (llm_api, model). Recorded by the asyncio engine.
+        - `on_batch`: one batched request of several turns, per (llm_api, model). Recorded by the `TurnBatcher`.
+        - `on_round`: one chat session round, per suite.
+        - `stage`: wall time spent in a stage of the runner ('compile', 'session', 'serialization').
+
+    `write` produces a Prometheus text exposition file (`metrics.prom`) and a JSON summary with p50/p95/p99 per model
+    (`metrics_summary.json`). The recorder may be shared by threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.models: Dict[Tuple[str, str], _ModelStats] = defaultdict(_ModelStats)
+        self.round_seconds: Dict[str, List[float]] = defaultdict(list)
+        self.round_turns: Dict[str, List[int]] = defaultdict(list)
+        self.round_status: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.stage_seconds: Dict[str, float] = defaultdict(float)
+        self.started_at = time.monotonic()
+
+    def on_turn(self, llm_api: str, model: Optional[str], turn_seconds: float, provider_seconds: Optional[float] = None,
+                rate_limit_wait_seconds: float = 0.0, time_to_first_token: Optional[float] = None,
+                prompt_tokens: Optional[int] = None, completion_tokens: Optional[int] = None,
+                retries: int = 0, errors: Optional[List[str]] = None, timeouts: int = 0, hedges: int = 0,
+                cached: bool = False, ok: bool = True):
+        """
+        Record one LLM call.
+
+        Args:
+            turn_seconds (float): Wall time of the turn, including rate limiter waits and retries.
+            provider_seconds (Optional[float]): Time spent in the successful provider call.
+            rate_limit_wait_seconds (float): Time spent waiting for the rate limiter.
+            time_to_first_token (Optional[float]): Time to the first token, if the provider reports it.
+            retries (int): Number of failed attempts before the final one.
+            errors (Optional[List[str]]): One entry per provider error, e.g. 'ProviderError:429'.
+            timeouts (int): Attempts abandoned after their timeout. They are also listed in `errors`.
+            hedges (int): Duplicate calls sent because an attempt was slow.
+            cached (bool): Whether the response came from the response cache. Cached turns count as cache hits only.
+            ok (bool): False if the turn failed after its last attempt. Failed turns count their errors and retries only.
+        """
+        with self._lock:
+            stats = self.models[(llm_api, model or '')]
+            for error in errors or []:
+                stats.errors[error] += 1
+            stats.timeouts += timeouts
+            stats.hedges += hedges
+            if cached:
+                stats.cache_hits += 1
+                return
+            if not ok:
+                stats.retries += retries
+                return
+            stats.turn_seconds.append(turn_seconds)
+            if provider_seconds is not None:
+                stats.provider_seconds.append(provider_seconds)
+            stats.rate_limit_wait_seconds.append(rate_limit_wait_seconds)
+            if time_to_first_token is not None:
+                stats.time_to_first_token_seconds.append(time_to_first_token)
+            stats.prompt_tokens += prompt_tokens or 0
+            stats.completion_tokens += completion_tokens or 0
+            stats.retries += retries
+
+    def on_batch(self, llm_api: str, model: Optional[str], size: int):
+        """Record one batched request of `size` turns. The turns themselves are recorded by `on_turn`."""
+        with self._lock:
+            self.models[(llm_api, model or '')].batch_sizes.append(size)
+
+    def on_round(self, suite: str, seconds: float, turn_count: int, ok: bool = True):
+        """Record one chat session round of `suite`."""
+        with self._lock:
+            self.round_seconds[suite].append(seconds)
+            self.round_turns[suite].append(turn_count)
+            self.round_status[(suite, 'ok' if ok else 'failed')] += 1
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Add the wall time of the enclosed block to the stage `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stage_seconds[name] += elapsed
+
+    def summary(self) -> Dict:
+        with self._lock:
+            models = {}
+            for (llm_api, model), stats in sorted(self.models.items()):
+                models[f'{llm_api}/{model}'] = {
+                    'llm_api': llm_api,
+                    'model': model,
+                    'turns': len(stats.turn_seconds),
+                    'cache_hits': stats.cache_hits,
+                    'retries': stats.retries,
+                    'timeouts': stats.timeouts,
+                    'hedges': stats.hedges,
+                    'errors': dict(stats.errors),
+                    'prompt_tokens': stats.prompt_tokens,
+                    'completion_tokens': stats.completion_tokens,
+                    'turn_seconds': describe_samples(stats.turn_seconds),
+                    'provider_seconds': describe_samples(stats.provider_seconds),
+                    'rate_limit_wait_seconds': describe_samples(stats.rate_limit_wait_seconds),
+                    'time_to_first_token_seconds': describe_samples(stats.time_to_first_token_seconds),
+                    'batch_size': describe_samples([float(size) for size in stats.batch_sizes]),
+                }
+            suites = {}
+            for suite, seconds in sorted(self.round_seconds.items()):
+                suites[suite] = {
+                    'rounds': self.round_status[(suite, 'ok')],
+                    'failed_rounds': self.round_status[(suite, 'failed')],
+                    'round_seconds': describe_samples(seconds),
+                    'turns_per_round': describe_samples([float(turns) for turns in self.round_turns[suite]]),
+                }
+            return {
+                'wall_seconds': time.monotonic() - self.started_at,
+                'models': models,
+                'suites': suites,
+                'stage_seconds': dict(self.stage_seconds),
+            }
+
+    def prometheus_text(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+
+        def header(name, metric_type, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+
+        def labels(**kwargs):
+            pairs = ','.join(f'{key}="{_escape(str(value))}"' for key, value in kwargs.items())
+            return '{' + pairs + '}'
+
+        def summary_metric(name, help_text, series):
+            header(name, 'summary', help_text)
+            for label_dict, samples in series:
+                for q in QUANTILES:
+                    value = percentile(samples, q)
+                    lines.append(f'{name}{labels(**label_dict, quantile=q)} {_number(value)}')
+                lines.append(f'{name}_sum{labels(**label_dict)} {_number(sum(samples))}')
+                lines.append(f'{name}_count{labels(**label_dict)} {len(samples)}')
+
+        def counter_metric(name, help_text, series):
+            header(name, 'counter', help_text)
+            for label_dict, value in series:
+                lines.append(f'{name}{labels(**label_dict)} {_number(value)}')
+
+        with self._lock:
+            models = sorted(self.models.items())
+            model_labels = [(dict(llm_api=llm_api, model=model), stats) for (llm_api, model), stats in models]
+            summary_metric('llm_eval_turn_seconds', 'Wall time of LLM turns, including rate limiter waits and retries.',
+                           [(label_dict, stats.turn_seconds) for label_dict, stats in model_labels])
+            summary_metric('llm_eval_provider_seconds', 'Time spent in successful provider calls.',
+                           [(label_dict, stats.provider_seconds) for label_dict, stats in model_labels])
+            summary_metric('llm_eval_rate_limit_wait_seconds', 'Time LLM turns waited for the rate limiter.',
+                           [(label_dict, stats.rate_limit_wait_seconds) for label_dict, stats in model_labels])
+            summary_metric('llm_eval_time_to_first_token_seconds', 'Time to the first token, where the provider reports it.',
+                           [(label_dict, stats.time_to_first_token_seconds) for label_dict, stats in model_labels])
+            summary_metric('llm_eval_batch_size', 'Turns per batched provider request.',
+                           [(label_dict, stats.batch_sizes) for label_dict, stats in model_labels if stats.batch_sizes])
+            counter_metric('llm_eval_prompt_tokens_total', 'Prompt tokens sent.',
+                           [(label_dict, stats.prompt_tokens) for label_dict, stats in model_labels])
+            counter_metric('llm_eval_completion_tokens_total', 'Completion tokens received.',
+                           [(label_dict, stats.completion_tokens) for label_dict, stats in model_labels])
+            counter_metric('llm_eval_turn_retries_total', 'Failed provider attempts that were retried.',
+                           [(label_dict, stats.retries) for label_dict, stats in model_labels])
+            counter_metric('llm_eval_turn_timeouts_total', 'Provider attempts abandoned after their timeout.',
+                           [(label_dict, stats.timeouts) for label_dict, stats in model_labels])
+            counter_metric('llm_eval_hedged_calls_total', 'Duplicate provider calls sent because an attempt was slow.',
+                           [(label_dict, stats.hedges) for label_dict, stats in model_labels])
+            counter_metric('llm_eval_cache_hits_total', 'LLM turns answered from the response cache.',
+                           [(label_dict, stats.cache_hits) for label_dict, stats in model_labels])
+            counter_metric('llm_eval_provider_errors_total', 'Provider errors by type.',
+                           [(dict(label_dict, error=error), count)
+                            for label_dict, stats in model_labels for error, count in sorted(stats.errors.items())])
+            summary_metric('llm_eval_round_seconds', 'Wall time of chat session rounds.',
+                           [(dict(suite=suite), seconds) for suite, seconds in sorted(self.round_seconds.items())])
+            counter_metric('llm_eval_rounds_total', 'Chat session rounds by status.',
+                           [(dict(suite=suite, status=status), count) for (suite, status), count in sorted(self.round_status.items())])
+            counter_metric('llm_eval_stage_seconds_total', 'Wall time spent in each stage of the runner.',
+                           [(dict(stage=stage), seconds) for stage, seconds in sorted(self.stage_seconds.items())])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, output_dir: str) -> Tuple[str, str]:
+        """
+        Write `metrics.prom` and `metrics_summary.json` to `output_dir`.
+
+        Returns:
+            Tuple[str, str]: Paths of the two files.
+        """
+        metrics_path = os.path.join(output_dir, METRICS_FILE_NAME)
+        summary_path = os.path.join(output_dir, SUMMARY_FILE_NAME)
+        with open(metrics_path, 'w') as file:
+            file.write(self.prometheus_text())
+        with open(summary_path, 'w') as file:
+            json.dump(self.summary(), file, indent=2)
+        return metrics_path, summary_path
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value: Optional[float]) -> str:
+    return 'NaN' if value is None else repr(float(value)) if isinstance(value, float) else str(value)
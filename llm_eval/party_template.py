@@ -0,0 +1,69 @@
+import yaml
+from typing import Any, Dict, List, Sequence
+
+
+class PartyTemplate:
+    """
+    A party configuration parsed once, from which the configuration of each combination of initial instructions
+    is produced.
+
+    `render` copies only the containers on the path to the `attendees[i].instruction.text` slots: the top-level
+    dictionary, the attendee list, each attendee and its instruction. Everything else (llm_api_params, settings, ...)
+    is shared between the rendered configurations and the template, so rendered configurations must be treated
+    as read-only.
+    """
+
+    def __init__(self, party_conf_dict: Dict[str, Any]):
+        attendees = party_conf_dict.get('attendees') if isinstance(party_conf_dict, dict) else None
+        if not isinstance(attendees, list) or not attendees:
+            raise ValueError("Party configuration must contain a non-empty list of 'attendees'")
+        for i, attendee in enumerate(attendees):
+            if not isinstance(attendee.get('instruction'), dict):
+                raise ValueError(f"Attendee {i} of the party configuration has no 'instruction' mapping")
+        self.party_conf_dict = party_conf_dict
+
+    @classmethod
+    def from_file(cls, party_conf: str) -> "PartyTemplate":
+        """
+        Parse a party configuration file.
+
+        Args:
+            party_conf (str): Path to the party configuration file.
+        """
+        with open(party_conf, 'r') as file:
+            return cls(yaml.safe_load(file))
+
+    @property
+    def num_attendees(self) -> int:
+        return len(self.party_conf_dict['attendees'])
+
+    def check_num_instructions(self, num_instructions: int):
+        """
+        Raises:
+            ValueError: If the number of initial instructions differs from the number of attendees.
+        """
+        if num_instructions != self.num_attendees:
+            raise ValueError(f"The party configuration has {self.num_attendees} attendees, "
+                             f"but {num_instructions} initial instructions were given")
+
+    def render(self, init_instr_list: Sequence[str]) -> Dict[str, Any]:
+        """
+        Produce the party configuration with the i-th initial instruction set as the instruction text of the
+        i-th attendee.
+
+        Args:
+            init_instr_list (Sequence[str]): Initial instructions, one per attendee.
+
+        Returns:
+            Dict[str, Any]: The compiled party configuration.
+
+        Raises:
+            ValueError: If the number of initial instructions differs from the number of attendees.
+        """
+        self.check_num_instructions(len(init_instr_list))
+        attendees: List[Dict[str, Any]] = []
+        for attendee, instr in zip(self.party_conf_dict['attendees'], init_instr_list):
+            attendee = dict(attendee)
+            attendee['instruction'] = dict(attendee['instruction'], text=instr)
+            attendees.append(attendee)
+        return dict(self.party_conf_dict, attendees=attendees)
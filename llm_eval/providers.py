@@ -0,0 +1,182 @@
+import math
+import random
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple, Union
+from llm_eval.ratelimit import estimate_prompt_tokens, estimate_tokens
+
+# llm_api_params that control how a call is made, not what it returns. They are not passed to providers.
+TRANSPORT_PARAMS = ('retries', 'sleep_period')
+
+
+class Completion:
+    """
+    A response of an LLM provider.
+
+    Attributes:
+        text (str): The generated message.
+        prompt_tokens (Optional[int]): Prompt tokens reported by the provider, if any.
+        completion_tokens (Optional[int]): Completion tokens reported by the provider, if any.
+        time_to_first_token (Optional[float]): Seconds until the first token arrived, if the provider reports it.
+    """
+
+    def __init__(self, text: str, prompt_tokens: Optional[int] = None, completion_tokens: Optional[int] = None,
+                 time_to_first_token: Optional[float] = None):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.time_to_first_token = time_to_first_token
+
+
+class ProviderError(Exception):
+    """
+    Error returned by a provider. `status_code` follows HTTP semantics, e.g. 429 for rate limit errors.
+    """
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LLMWrapProvider:
+    """
+    Provider backed by `llm_wrap`, the library `llm_party` uses to reach the LLM APIs.
+    The blocking call runs in a worker thread so it does not stall the event loop.
+    """
+
+    def __init__(self, llm_api: str):
+        self.llm_api = llm_api
+
+    async def complete(self, messages: List[Dict[str, str]], llm_api_params: Dict[str, Any]) -> Completion:
+        from llm_wrap.llm_response import get_response
+        text = await asyncio.to_thread(get_response, llm_api=self.llm_api, messages=messages, **llm_api_params)
+        return Completion(text)
+
+
+class OpenAIProvider(LLMWrapProvider):
+    """
+    OpenAI provider. Unlike the generic `llm_wrap` provider it also reports the token usage.
+    """
+
+    def __init__(self):
+        super().__init__('openai')
+
+    async def complete(self, messages: List[Dict[str, str]], llm_api_params: Dict[str, Any]) -> Completion:
+        from llm_wrap.llms.gpt_api import chatCompletion
+        response = await asyncio.to_thread(chatCompletion, messages=messages, **llm_api_params)
+        usage = getattr(response, 'usage', None)
+        return Completion(
+            response.choices[0].message.content,
+            prompt_tokens=getattr(usage, 'prompt_tokens', None),
+            completion_tokens=getattr(usage, 'completion_tokens', None),
+        )
+
+
+class FakeProvider:
+    """
+    Local stand-in for an LLM API, selected with `llm_api: fake` in the party conf.
+
+    It answers without network access. The reply is deterministic and depends on the model and the
+    length of the conversation; only the latency and the injected errors are random. The following
+    `llm_api_params` are understood, all other parameters are ignored:
+        - 'model' (str): Model name used in the reply. Defaults to 'fake'.
+        - 'latency' (float): Mean seconds to wait before answering. Defaults to 0.
+        - 'latency_distribution' (str): 'constant' (default), 'uniform' (between 0 and twice the mean),
+          'exponential' or 'lognormal' (with `latency_sigma`, default 0.5).
+        - 'error_rate' (float): Probability that a call fails with a `ProviderError`. Defaults to 0.
+        - 'error_status' (int): Status code of the injected errors. Defaults to 503.
+        - 'response_chars' (int): Pad the reply to at least this many characters.
+        - 'max_concurrent_calls' (int): Serve at most this many calls at a time, like a local inference server
+          with a fixed number of slots. Further calls queue. Defaults to no limit.
+        - 'batch_item_latency' (float): Seconds a batched call takes per request, on top of the latency of the
+          batch. Defaults to 0.
+
+    `complete_batch` answers several requests with one call, which takes one sampled latency for the whole batch,
+    so the provider can stand in for a batching server when turns are batched (see `TurnBatcher`).
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        self.random = random.Random(seed)
+        self._call_slots: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+
+    def sample_latency(self, llm_api_params: Dict[str, Any]) -> float:
+        mean = llm_api_params.get('latency', 0)
+        if not mean:
+            return 0.0
+        distribution = llm_api_params.get('latency_distribution', 'constant')
+        if distribution == 'constant':
+            return mean
+        if distribution == 'uniform':
+            return self.random.uniform(0, 2 * mean)
+        if distribution == 'exponential':
+            return self.random.expovariate(1 / mean)
+        if distribution == 'lognormal':
+            sigma = llm_api_params.get('latency_sigma', 0.5)
+            # Choose mu so that the distribution has the requested mean
+            return self.random.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+        raise ValueError(f"Unknown latency distribution: {distribution}")
+
+    async def wait(self, latency: float, llm_api_params: Dict[str, Any]):
+        """Sleep `latency` seconds in one of the `max_concurrent_calls` slots."""
+        max_concurrent_calls = llm_api_params.get('max_concurrent_calls')
+        if not max_concurrent_calls:
+            if latency:
+                await asyncio.sleep(latency)
+            return
+        loop = asyncio.get_running_loop()
+        if self._call_slots is None or self._call_slots[0] is not loop:
+            self._call_slots = (loop, asyncio.Semaphore(max_concurrent_calls))
+        async with self._call_slots[1]:
+            await asyncio.sleep(latency)
+
+    def respond(self, messages: List[Dict[str, str]], llm_api_params: Dict[str, Any], latency: float) -> Completion:
+        if self.random.random() < llm_api_params.get('error_rate', 0):
+            raise ProviderError('Injected fake provider error', status_code=llm_api_params.get('error_status', 503))
+        text = f"Response {len(messages)} of {llm_api_params.get('model', 'fake')}"
+        response_chars = llm_api_params.get('response_chars', 0)
+        if len(text) < response_chars:
+            text = (text + ' ' + 'lorem ipsum ' * (response_chars // 12 + 1))[:response_chars]
+        return Completion(text, prompt_tokens=estimate_prompt_tokens(messages), completion_tokens=estimate_tokens(text),
+                          time_to_first_token=latency)
+
+    async def complete(self, messages: List[Dict[str, str]], llm_api_params: Dict[str, Any]) -> Completion:
+        latency = self.sample_latency(llm_api_params)
+        await self.wait(latency, llm_api_params)
+        return self.respond(messages, llm_api_params, latency)
+
+    async def complete_batch(self, requests: List[Tuple[List[Dict[str, str]], Dict[str, Any]]]
+                             ) -> List[Union[Completion, Exception]]:
+        """
+        Answer (messages, llm_api_params) requests with one call. The latency is sampled with the parameters of the
+        first request. Injected errors fail single requests and are returned in their place.
+        """
+        llm_api_params = requests[0][1]
+        latency = self.sample_latency(llm_api_params) + llm_api_params.get('batch_item_latency', 0) * len(requests)
+        await self.wait(latency, llm_api_params)
+        responses: List[Union[Completion, Exception]] = []
+        for messages, request_params in requests:
+            try:
+                responses.append(self.respond(messages, request_params, latency))
+            except ProviderError as e:
+                responses.append(e)
+        return responses
+
+
+_providers: Dict[str, Any] = {
+    'openai': OpenAIProvider(),
+    'fake': FakeProvider(),
+}
+
+
+def register_provider(llm_api: str, provider: Any):
+    """
+    Register the provider used for attendees whose `llm_api` is `llm_api`.
+    A provider is any object with an async `complete(messages, llm_api_params) -> Completion` method.
+    """
+    _providers[llm_api] = provider
+
+
+def get_provider(llm_api: str) -> Any:
+    """Return the provider registered for `llm_api`, falling back to `llm_wrap`."""
+    if llm_api not in _providers:
+        _providers[llm_api] = LLMWrapProvider(llm_api)
+    return _providers[llm_api]
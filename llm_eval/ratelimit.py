@@ -0,0 +1,140 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class TokenBucket:
+    """
+    Asynchronous token bucket.
+
+    The bucket holds at most `capacity` tokens and refills continuously at `rate` tokens per second.
+    Waiters are served in arrival order.
+    """
+
+    def __init__(self, capacity: float, rate: float, clock: Callable[[], float] = time.monotonic):
+        if capacity <= 0 or rate <= 0:
+            raise ValueError(f"capacity and rate must be positive: capacity={capacity}, rate={rate}")
+        self.capacity = capacity
+        self.rate = rate
+        self.clock = clock
+        self.tokens = capacity
+        self.updated_at = clock()
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def per_minute(cls, limit: float, clock: Callable[[], float] = time.monotonic) -> "TokenBucket":
+        return cls(capacity=limit, rate=limit / 60.0, clock=clock)
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount: float = 1):
+        """
+        Wait until `amount` tokens are available and take them.
+
+        A request larger than the capacity is admitted once the bucket is full, so it cannot block forever.
+        """
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+    def debit(self, amount: float):
+        """
+        Take `amount` tokens without waiting, e.g. to correct an estimate after the fact.
+        A negative amount returns tokens. The balance may go below zero, which delays later acquisitions.
+        """
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+    def drain(self):
+        """Empty the bucket, e.g. after the provider answered with a rate limit error."""
+        self._refill()
+        self.tokens = min(self.tokens, 0)
+
+
+class ProviderRateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limits of one (llm_api, model) pair.
+    Either limit may be omitted.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.requests = TokenBucket.per_minute(requests_per_minute, clock) if requests_per_minute else None
+        self.tokens = TokenBucket.per_minute(tokens_per_minute, clock) if tokens_per_minute else None
+
+    async def acquire(self, estimated_tokens: int):
+        if self.requests is not None:
+            await self.requests.acquire(1)
+        if self.tokens is not None:
+            await self.tokens.acquire(estimated_tokens)
+
+    def correct(self, estimated_tokens: int, actual_tokens: int):
+        """Account for the difference between the estimated and the actual token usage of a request."""
+        if self.tokens is not None:
+            self.tokens.debit(actual_tokens - estimated_tokens)
+
+    def back_off(self):
+        """Stop admitting requests until the buckets refill."""
+        for bucket in (self.requests, self.tokens):
+            if bucket is not None:
+                bucket.drain()
+
+
+class RateLimiterRegistry:
+    """
+    Rate limiters keyed by (llm_api, model).
+
+    A limit configured without a model applies to every model of that `llm_api` that has no limit of its own.
+    Those models share one limiter.
+    """
+
+    def __init__(self, limiters: Optional[Dict[Tuple[str, Optional[str]], ProviderRateLimiter]] = None):
+        self.limiters = limiters if limiters is not None else {}
+
+    @classmethod
+    def from_conf(cls, rate_limits: Optional[List[Dict[str, Any]]], clock: Callable[[], float] = time.monotonic) -> "RateLimiterRegistry":
+        """
+        Build the registry from the `rate_limits` list of an exp conf, e.g.:
+
+            rate_limits:
+              - llm_api: openai
+                model: gpt-3.5-turbo-1106
+                requests_per_minute: 3500
+                tokens_per_minute: 90000
+
+        Raises:
+            ValueError: If an entry has no `llm_api`, no limit, or duplicates another entry.
+        """
+        limiters = {}
+        for entry in rate_limits or []:
+            if 'llm_api' not in entry:
+                raise ValueError(f"Rate limit entry is missing 'llm_api': {entry}")
+            rpm = entry.get('requests_per_minute')
+            tpm = entry.get('tokens_per_minute')
+            if not rpm and not tpm:
+                raise ValueError(f"Rate limit entry needs 'requests_per_minute' or 'tokens_per_minute': {entry}")
+            key = (entry['llm_api'], entry.get('model'))
+            if key in limiters:
+                raise ValueError(f"Duplicate rate limit entry for {key}")
+            limiters[key] = ProviderRateLimiter(rpm, tpm, clock)
+        return cls(limiters)
+
+    def get(self, llm_api: str, model: Optional[str]) -> Optional[ProviderRateLimiter]:
+        return self.limiters.get((llm_api, model)) or self.limiters.get((llm_api, None))
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a text (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+def estimate_prompt_tokens(messages: List[Dict[str, str]]) -> int:
+    # Each message carries a few tokens of framing on top of its content
+    return sum(estimate_tokens(message['content']) + 4 for message in messages)
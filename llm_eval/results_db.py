@@ -0,0 +1,282 @@
+import os
+import json
+import sqlite3
+import hashlib
+import datetime
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional
+from llm_eval.manifest import unit_key
+from llm_eval.service import chat_session_to_dict
+from llm_eval.sink import ResultSink, compact_session_record, party_conf_hash
+
+if TYPE_CHECKING:
+    from llm_party.model.session_models import ChatSession
+
+RESULTS_DB_FILE_NAME = 'results.sqlite'
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS party_confs (
+    hash TEXT PRIMARY KEY,
+    party_conf TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rounds (
+    id INTEGER PRIMARY KEY,
+    unit_key TEXT NOT NULL,
+    suite TEXT NOT NULL,
+    combination_index INTEGER NOT NULL,
+    round_index INTEGER NOT NULL,
+    party_conf_hash TEXT NOT NULL REFERENCES party_confs (hash),
+    status TEXT,
+    finish_reason TEXT,
+    turn_count INTEGER NOT NULL,
+    start_at TEXT,
+    end_at TEXT,
+    duration_seconds REAL,
+    metadata TEXT NOT NULL,
+    chat_session TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS round_instructions (
+    round_id INTEGER NOT NULL REFERENCES rounds (id),
+    attendee_index INTEGER NOT NULL,
+    path TEXT,
+    digest TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS round_models (
+    round_id INTEGER NOT NULL REFERENCES rounds (id),
+    attendee_index INTEGER NOT NULL,
+    attendee_name TEXT,
+    llm_api TEXT,
+    model TEXT,
+    temperature REAL,
+    top_p REAL,
+    llm_api_params TEXT
+);
+CREATE INDEX IF NOT EXISTS rounds_unit ON rounds (suite, combination_index, round_index);
+CREATE INDEX IF NOT EXISTS rounds_unit_key ON rounds (unit_key);
+CREATE INDEX IF NOT EXISTS rounds_turn_count ON rounds (turn_count);
+CREATE INDEX IF NOT EXISTS rounds_status ON rounds (status);
+CREATE INDEX IF NOT EXISTS round_instructions_digest ON round_instructions (digest);
+CREATE INDEX IF NOT EXISTS round_instructions_round ON round_instructions (round_id);
+CREATE INDEX IF NOT EXISTS round_models_model ON round_models (model, llm_api);
+CREATE INDEX IF NOT EXISTS round_models_round ON round_models (round_id);
+"""
+
+
+def _duration_seconds(metadata: Dict[str, Any], start_at: Optional[str], end_at: Optional[str]) -> Optional[float]:
+    # The round time measured by the caller; the timestamps of the chat session have a resolution of one second
+    if metadata.get('round_seconds') is not None:
+        return metadata['round_seconds']
+    if not start_at or not end_at:
+        return None
+    start = datetime.datetime.strptime(start_at, TIMESTAMP_FORMAT)
+    end = datetime.datetime.strptime(end_at, TIMESTAMP_FORMAT)
+    return (end - start).total_seconds()
+
+
+class ResultsDatabase:
+    """
+    SQLite results store of an output directory (`results.sqlite`).
+
+    Every round is one row of `rounds`, with its suite, combination and round index, status, turn count and timings
+    as indexed columns, and its metadata and compact chat session (see `compact_session_record`) as JSON. Each
+    round also has one row per attendee in `round_instructions` (path and SHA-256 of the initial instruction) and
+    in `round_models` (llm_api, model and sampling parameters). Compiled party configurations are stored once in
+    `party_confs`. The database may be shared by threads; it is opened in WAL mode so it can be queried while a
+    run is writing to it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.executescript(SCHEMA)
+            self._connection.commit()
+
+    def insert_round(self, metadata: Dict[str, Any], session_record: Dict, party_conf_dict: Dict) -> int:
+        """
+        Insert a round and commit. An earlier row of the same unit is replaced.
+
+        Args:
+            metadata (Dict[str, Any]): Round metadata: suite, combination_index, round_index, init_instr_list, ...
+                                       Its 'round_seconds', if any, is stored as the duration of the round; otherwise
+                                       the duration is taken from the start and end time of the chat session.
+            session_record (Dict): The compact chat session.
+            party_conf_dict (Dict): The party configuration the round was conducted with.
+
+        Returns:
+            int: The id of the round.
+        """
+        conf_hash = party_conf_hash(party_conf_dict)
+        attendees = party_conf_dict.get('attendees') or []
+        init_instr_list = metadata.get('init_instr_list') or [None] * len(attendees)
+        instruction_rows = []
+        model_rows = []
+        for attendee_index, attendee in enumerate(attendees):
+            # The instruction text is the content of the instruction file, so this is the digest of the file, the same
+            # as the one its unit is keyed by in the manifest
+            text = (attendee.get('instruction') or {}).get('text') or ''
+            path = init_instr_list[attendee_index] if attendee_index < len(init_instr_list) else None
+            instruction_rows.append((attendee_index, path, hashlib.sha256(text.encode('utf-8')).hexdigest()))
+            params = attendee.get('llm_api_params') or {}
+            model_rows.append((attendee_index, attendee.get('name'), attendee.get('llm_api'), params.get('model'),
+                               params.get('temperature'), params.get('top_p'), json.dumps(params, sort_keys=True, default=str)))
+        start_at, end_at = session_record.get('start_at'), session_record.get('end_at')
+        round_row = (
+            unit_key(metadata['suite'], [path for _, path, _ in instruction_rows],
+                     [digest for _, _, digest in instruction_rows], metadata['round_index']),
+            metadata['suite'], metadata['combination_index'], metadata['round_index'], conf_hash,
+            session_record.get('status'), session_record.get('finish_reason'), session_record.get('turn_count', 0),
+            start_at, end_at, _duration_seconds(metadata, start_at, end_at),
+            json.dumps(metadata, ensure_ascii=False, default=str),
+            json.dumps(session_record, ensure_ascii=False, default=str),
+        )
+        party_conf_json = json.dumps(party_conf_dict, ensure_ascii=False, default=str)
+
+        with self._lock:
+            with self._connection:
+                self._connection.execute('INSERT OR IGNORE INTO party_confs (hash, party_conf) VALUES (?, ?)',
+                                         (conf_hash, party_conf_json))
+                # A unit that is conducted again, e.g. after a crash before it was recorded in the manifest, replaces
+                # its earlier row
+                for table in ('round_instructions', 'round_models'):
+                    self._connection.execute(f'DELETE FROM {table} WHERE round_id IN '
+                                             f'(SELECT id FROM rounds WHERE unit_key = ?)', (round_row[0],))
+                self._connection.execute('DELETE FROM rounds WHERE unit_key = ?', (round_row[0],))
+                round_id = self._connection.execute(
+                    'INSERT INTO rounds (unit_key, suite, combination_index, round_index, party_conf_hash, status, '
+                    'finish_reason, turn_count, start_at, end_at, duration_seconds, metadata, chat_session) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', round_row).lastrowid
+                self._connection.executemany(
+                    'INSERT INTO round_instructions (round_id, attendee_index, path, digest) VALUES (?, ?, ?, ?)',
+                    [(round_id,) + row for row in instruction_rows])
+                self._connection.executemany(
+                    'INSERT INTO round_models (round_id, attendee_index, attendee_name, llm_api, model, temperature, '
+                    'top_p, llm_api_params) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(round_id,) + row for row in model_rows])
+        return round_id
+
+    def query_rounds(self, suite: Optional[str] = None, model: Optional[str] = None, llm_api: Optional[str] = None,
+                     min_turns: Optional[int] = None, max_turns: Optional[int] = None, status: Optional[str] = None,
+                     round_index: Optional[int] = None, instruction_digest: Optional[str] = None,
+                     limit: Optional[int] = None, with_chat_session: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Find rounds by their indexed columns. All given filters must match.
+
+        Args:
+            model (Optional[str]): Any attendee of the round uses this model.
+            llm_api (Optional[str]): Any attendee of the round uses this LLM API.
+            instruction_digest (Optional[str]): Any attendee's initial instruction has a SHA-256 starting with this.
+            with_chat_session (bool): Include the chat session and the party configuration of each round.
+
+        Yields:
+            Dict[str, Any]: One dictionary per round, ordered by suite, combination and round.
+        """
+        clauses, parameters = [], []
+        for column, value in (('suite', suite), ('status', status), ('round_index', round_index)):
+            if value is not None:
+                clauses.append(f'r.{column} = ?')
+                parameters.append(value)
+        if min_turns is not None:
+            clauses.append('r.turn_count >= ?')
+            parameters.append(min_turns)
+        if max_turns is not None:
+            clauses.append('r.turn_count <= ?')
+            parameters.append(max_turns)
+        # IN (subquery) lets SQLite start from the index of the attendee table instead of scanning the rounds
+        if model is not None or llm_api is not None:
+            model_clauses = []
+            for column, value in (('model', model), ('llm_api', llm_api)):
+                if value is not None:
+                    model_clauses.append(f'{column} = ?')
+                    parameters.append(value)
+            clauses.append(f"r.id IN (SELECT round_id FROM round_models WHERE {' AND '.join(model_clauses)})")
+        if instruction_digest is not None:
+            # Digests are lowercase hex, so a prefix is a range of the index
+            clauses.append('r.id IN (SELECT round_id FROM round_instructions WHERE digest >= ? AND digest < ?)')
+            parameters.extend([instruction_digest.lower(), instruction_digest.lower() + 'g'])
+
+        columns = ('r.id, r.suite, r.combination_index, r.round_index, r.status, r.finish_reason, r.turn_count, '
+                   'r.start_at, r.end_at, r.duration_seconds, r.party_conf_hash, r.metadata')
+        if with_chat_session:
+            columns += ', r.chat_session, p.party_conf'
+        sql = f'SELECT {columns} FROM rounds r'
+        if with_chat_session:
+            sql += ' JOIN party_confs p ON p.hash = r.party_conf_hash'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY r.suite, r.combination_index, r.round_index, r.id'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            parameters.append(limit)
+
+        with self._lock:
+            rows = self._connection.execute(sql, parameters).fetchall()
+            models = self._models([row['id'] for row in rows])
+        for row in rows:
+            result = dict(row)
+            result['metadata'] = json.loads(result['metadata'])
+            result['models'] = models.get(row['id'], [])
+            if with_chat_session:
+                result['chat_session'] = json.loads(result['chat_session'])
+                result['party_conf'] = json.loads(result['party_conf'])
+            yield result
+
+    def _models(self, round_ids: List[int]) -> Dict[int, List[str]]:
+        models: Dict[int, List[str]] = {}
+        # Stay below SQLite's limit on the number of parameters of a statement
+        for start in range(0, len(round_ids), 500):
+            chunk = round_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for round_id, llm_api, model in self._connection.execute(
+                    f'SELECT round_id, llm_api, model FROM round_models WHERE round_id IN ({placeholders}) '
+                    f'ORDER BY round_id, attendee_index', chunk):
+                models.setdefault(round_id, []).append(f'{llm_api}/{model}')
+        return models
+
+    def copy_rounds(self, source_path: str, unit_keys: Optional[set] = None) -> int:
+        """
+        Insert the rounds of another results database, e.g. of a shard.
+
+        Args:
+            source_path (str): Path of the other database.
+            unit_keys (Optional[set]): Copy only the rounds of these units.
+
+        Returns:
+            int: Number of rounds copied.
+        """
+        source = sqlite3.connect(source_path)
+        try:
+            rows = source.execute('SELECT r.unit_key, r.metadata, r.chat_session, p.party_conf FROM rounds r '
+                                  'JOIN party_confs p ON p.hash = r.party_conf_hash ORDER BY r.id').fetchall()
+        finally:
+            source.close()
+        copied = 0
+        for key, metadata, session_record, party_conf in rows:
+            if unit_keys is not None and key not in unit_keys:
+                continue
+            self.insert_round(json.loads(metadata), json.loads(session_record), json.loads(party_conf))
+            copied += 1
+        return copied
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class SqliteSink(ResultSink):
+    """Write each round to the `ResultsDatabase` of the output directory."""
+
+    def __init__(self, output_dir: str):
+        self.database = ResultsDatabase(os.path.join(output_dir, RESULTS_DB_FILE_NAME))
+
+    def write_round(self, metadata: Dict[str, Any], chat_session: "ChatSession", party_conf_dict: Dict) -> List[str]:
+        session_record = compact_session_record(chat_session_to_dict(chat_session))
+        self.database.insert_round(metadata, session_record, party_conf_dict)
+        return [RESULTS_DB_FILE_NAME]
+
+    def close(self):
+        self.database.close()
@@ -0,0 +1,149 @@
+import traceback
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+class JobResult:
+    """
+    Outcome of a single job executed by `run_jobs`.
+
+    Attributes:
+        index (int): Position of the job in the submitted sequence.
+        job (Any): The job object itself.
+        value (Any): Return value of the job function, or None if the job failed.
+        error (Optional[BaseException]): Exception raised by the job function, or None on success.
+    """
+
+    def __init__(self, index: int, job: Any, value: Any = None, error: Optional[BaseException] = None):
+        self.index = index
+        self.job = job
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class OrderedProgress:
+    """
+    Report job completions in submission order, even when jobs finish out of order.
+
+    Results that complete early are buffered until every job before them has been reported. `total` is None when
+    the number of jobs is not known in advance.
+    """
+
+    def __init__(self, total: Optional[int], describe: Callable[[Any], str], output: Optional[Callable[[str], None]] = print):
+        self.total = total
+        self.describe = describe
+        self.output = output
+        self._pending: Dict[int, JobResult] = {}
+        self._next_index = 0
+
+    def add(self, result: JobResult):
+        self._pending[result.index] = result
+        while self._next_index in self._pending:
+            self._report(self._pending.pop(self._next_index))
+            self._next_index += 1
+
+    def flush(self):
+        """Report whatever is still buffered, e.g. after an interrupted run left gaps."""
+        for index in sorted(self._pending):
+            self._report(self._pending.pop(index))
+
+    def _report(self, result: JobResult):
+        if self.output is None:
+            return
+        status = "done" if result.ok else f"FAILED ({type(result.error).__name__}: {result.error})"
+        position = f"{result.index + 1}/{self.total}" if self.total is not None else f"{result.index + 1}"
+        self.output(f"[{position}] {self.describe(result.job)}: {status}")
+
+
+def count_jobs(jobs: Iterable[Any], total: Optional[int]) -> Optional[int]:
+    """The given `total`, else the length of `jobs` if it has one."""
+    if total is None and hasattr(jobs, '__len__'):
+        return len(jobs)
+    return total
+
+
+def _call(index: int, job: Any, func: Callable[[Any], Any]) -> JobResult:
+    try:
+        return JobResult(index, job, value=func(job))
+    except Exception as e:
+        # Isolate the failure to this job; the traceback is kept for the final report
+        traceback.print_exc()
+        return JobResult(index, job, error=e)
+
+
+def run_jobs(
+    jobs: Iterable[Any],
+    func: Callable[[Any], Any],
+    max_concurrency: int = 1,
+    describe: Callable[[Any], str] = str,
+    output: Optional[Callable[[str], None]] = print,
+    total: Optional[int] = None,
+) -> List[JobResult]:
+    """
+    Run `func` over `jobs` on a bounded pool of worker threads.
+
+    An exception raised by one job is recorded in its `JobResult` and does not affect the others.
+    Progress is reported in submission order. Jobs are taken from `jobs` only as workers become free, so it may be
+    a generator. On KeyboardInterrupt, jobs that have not started are
+    cancelled, jobs already running are allowed to finish (so they can write their output), and the
+    interrupt is re-raised.
+
+    Args:
+        jobs (Iterable[Any]): Jobs to execute.
+        func (Callable[[Any], Any]): Function called with each job.
+        max_concurrency (int): Maximum number of jobs running at the same time. 1 runs jobs one at a time, in order.
+        describe (Callable[[Any], str]): Produces the label of a job for progress messages.
+        output (Optional[Callable[[str], None]]): Progress sink. None disables progress reporting.
+        total (Optional[int]): Number of jobs shown in progress messages. Defaults to the length of `jobs`, if any.
+
+    Returns:
+        List[JobResult]: One result per job, in submission order.
+
+    Raises:
+        ValueError: If max_concurrency is smaller than 1.
+        KeyboardInterrupt: If the run was interrupted.
+    """
+    if max_concurrency < 1:
+        raise ValueError(f"max_concurrency must be at least 1: {max_concurrency}")
+
+    progress = OrderedProgress(count_jobs(jobs, total), describe, output)
+    results: List[JobResult] = []
+
+    # Even a single job runs on a worker thread, so that Ctrl-C interrupts the wait instead of the job
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    job_iter = iter(enumerate(jobs))
+    in_flight = set()
+    try:
+        # Keep at most max_concurrency jobs submitted so that an interrupt leaves little to cancel
+        for index, job in job_iter:
+            in_flight.add(executor.submit(_call, index, job, func))
+            if len(in_flight) >= max_concurrency:
+                break
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                results.append(result)
+                progress.add(result)
+            for index, job in job_iter:
+                in_flight.add(executor.submit(_call, index, job, func))
+                if len(in_flight) >= max_concurrency:
+                    break
+    except KeyboardInterrupt:
+        if output is not None:
+            output(f"Interrupted: waiting for {len(in_flight)} running job(s) to finish...")
+        executor.shutdown(wait=True, cancel_futures=True)
+        for future in in_flight:
+            if not future.cancelled():
+                result = future.result()
+                results.append(result)
+                progress.add(result)
+        progress.flush()
+        raise
+    executor.shutdown(wait=True)
+    results.sort(key=lambda result: result.index)
+    return results
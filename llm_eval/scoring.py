@@ -0,0 +1,301 @@
+import os
+import re
+import json
+import math
+import asyncio
+import traceback
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from llm_eval.adaptive import RoundMetric, confidence_interval_width, get_round_metric
+from llm_eval.providers import TRANSPORT_PARAMS
+
+if TYPE_CHECKING:
+    from llm_party.model.session_models import ChatSession
+    from llm_eval.engine import SessionEngine
+
+SCOREBOARD_FILE_NAME = 'scoreboard.json'
+# First number in the reply of the judge, e.g. '8', '7.5' or '-1'
+DEFAULT_SCORE_PATTERN = r'-?\d+(?:\.\d+)?'
+
+
+class JudgeConf:
+    """
+    The `judge` entry of the `scoring` section: an LLM that reads the chat history and replies with a score.
+
+    Keys:
+        - 'instruction' (str): System prompt of the judge, e.g. a rubric that asks for a number. Required.
+        - 'llm_api' (str): LLM API of the judge, as in the party conf. Required.
+        - 'llm_api_params' (dict): Parameters of the judge's LLM API, including `retries` and `sleep_period`.
+        - 'name' (str): Name of the score. Defaults to 'judge'.
+        - 'score_pattern' (str): Regular expression whose first match in the reply is the score. Defaults to the
+          first number.
+
+    Raises:
+        ValueError: If a required key is missing, the pattern is invalid or a key is unknown.
+    """
+
+    KEYS = ('instruction', 'llm_api', 'llm_api_params', 'name', 'score_pattern')
+
+    def __init__(self, conf: Dict[str, Any]):
+        unknown_keys = set(conf) - set(self.KEYS)
+        if unknown_keys:
+            raise ValueError(f"Unknown keys in scoring judge: {', '.join(sorted(unknown_keys))}")
+        for key in ('instruction', 'llm_api'):
+            if not conf.get(key):
+                raise ValueError(f"scoring judge requires '{key}'")
+        self.instruction = conf['instruction']
+        self.llm_api = conf['llm_api']
+        self.llm_api_params = conf.get('llm_api_params') or {}
+        self.name = conf.get('name', 'judge')
+        try:
+            self.score_pattern = re.compile(conf.get('score_pattern', DEFAULT_SCORE_PATTERN))
+        except re.error as e:
+            raise ValueError(f"Invalid scoring judge score_pattern: {e}")
+
+
+class ScoringConf:
+    """
+    The `scoring` section of the exp conf.
+
+    Keys:
+        - 'rules' (list): Rule-based metrics, each scored per round under its name: 'turn_count', 'finish_reason',
+          'mean_message_chars', a metric registered with `register_round_metric`, or a scoring callback given as
+          'package.module:function'.
+        - 'judge' (dict): An LLM judge (see `JudgeConf`). Optional.
+        - 'queue_size' (int): Finished sessions that may wait for scoring. When the queue is full, sessions wait
+          before they hand over their results. Defaults to 16.
+        - 'concurrency' (int): Sessions scored at the same time. Defaults to 4.
+
+    Raises:
+        ValueError: If a value is invalid, a metric is unknown or a key is unknown.
+    """
+
+    KEYS = ('rules', 'judge', 'queue_size', 'concurrency')
+
+    def __init__(self, conf: Dict[str, Any]):
+        unknown_keys = set(conf) - set(self.KEYS)
+        if unknown_keys:
+            raise ValueError(f"Unknown keys in scoring: {', '.join(sorted(unknown_keys))}")
+        self.rules: Dict[str, RoundMetric] = {name: get_round_metric(name) for name in conf.get('rules') or []}
+        self.judge = JudgeConf(conf['judge']) if conf.get('judge') is not None else None
+        self.queue_size = conf.get('queue_size', 16)
+        self.concurrency = conf.get('concurrency', 4)
+        for key in ('queue_size', 'concurrency'):
+            value = getattr(self, key)
+            if not isinstance(value, int) or value < 1:
+                raise ValueError(f"scoring {key} must be a positive integer: {value}")
+        if not self.rules and self.judge is None:
+            raise ValueError("scoring requires 'rules' or a 'judge'")
+        if self.judge is not None and self.judge.name in self.rules:
+            raise ValueError(f"scoring judge name '{self.judge.name}' is also the name of a rule")
+
+
+def format_transcript(chat_session: "ChatSession") -> str:
+    """The chat history as plain text for the judge, one 'name (role): text' paragraph per message."""
+    return '\n\n'.join(f"{message.sender.name} ({message.sender.role}): {message.text}"
+                       for message in chat_session.chat_history)
+
+
+class Scorer:
+    """
+    Scores finished chat sessions with the rules and the judge of a `ScoringConf`.
+
+    Judge calls go through `SessionEngine.complete`, so they are answered from the response cache, batched with other
+    calls of the same model and throttled by the rate limiters like the turns of the sessions.
+    """
+
+    def __init__(self, conf: ScoringConf, session_engine: Optional["SessionEngine"] = None):
+        if conf.judge is not None and session_engine is None:
+            raise ValueError("An LLM judge requires a SessionEngine")
+        self.conf = conf
+        self.session_engine = session_engine
+
+    def score_rules(self, chat_session: "ChatSession",
+                    metadata: Dict[str, Any]) -> Tuple[Dict[str, Optional[float]], Dict[str, str]]:
+        """
+        Returns:
+            Tuple[Dict[str, Optional[float]], Dict[str, str]]: The scores of the rules, and the errors of the rules
+                                                              that failed. Their scores are None.
+        """
+        scores = {}
+        errors = {}
+        for name, metric in self.conf.rules.items():
+            try:
+                scores[name] = float(metric(chat_session, metadata))
+            except Exception as e:
+                scores[name] = None
+                errors[name] = f'{type(e).__name__}: {e}'
+        return scores, errors
+
+    async def score(self, chat_session: "ChatSession",
+                    metadata: Dict[str, Any]) -> Tuple[Dict[str, Optional[float]], Dict[str, str]]:
+        """
+        Returns:
+            Tuple[Dict[str, Optional[float]], Dict[str, str]]: The scores, and the errors of the scores that could
+                                                              not be determined. Such scores are None.
+        """
+        scores, errors = self.score_rules(chat_session, metadata)
+        judge = self.conf.judge
+        if judge is not None:
+            messages = [{'role': 'system', 'content': judge.instruction},
+                        {'role': 'user', 'content': format_transcript(chat_session)}]
+            params = {key: value for key, value in judge.llm_api_params.items() if key not in TRANSPORT_PARAMS}
+            try:
+                completion = await self.session_engine.complete(judge.llm_api, messages, params,
+                                                                retries=judge.llm_api_params.get('retries', 0),
+                                                                sleep_period=judge.llm_api_params.get('sleep_period', 0))
+                match = judge.score_pattern.search(completion.text)
+                if match is None:
+                    raise ValueError(f"No score in the reply of the judge: {completion.text[:200]!r}")
+                scores[judge.name] = float(match.group(0))
+            except Exception as e:
+                scores[judge.name] = None
+                errors[judge.name] = f'{type(e).__name__}: {e}'
+        return scores, errors
+
+
+class ScoringPipeline:
+    """
+    Scores finished sessions while other sessions are still being conducted.
+
+    `submit` puts a finished session on a bounded queue and returns as soon as there is room, so the session's slot
+    is free for the next session. `concurrency` workers take sessions off the queue, score them with the `Scorer` and
+    pass the scores to `on_scored`, which writes the results. If scoring a session fails, it is passed to
+    `on_scored` with None as its scores and errors. An error of scoring or of `on_scored` is printed and kept in
+    `errors` under the item it failed for. If the pipeline exits with an exception, e.g. because the run was interrupted, the
+    sessions still queued or being scored are passed to `on_scored` with None as their scores and errors, so that
+    their results are written all the same. All methods must be called on the event loop that runs the sessions.
+    """
+
+    def __init__(self, scorer: Scorer,
+                 on_scored: Callable[[Any, Optional[Dict[str, Optional[float]]], Optional[Dict[str, str]]], None]):
+        self.scorer = scorer
+        self.on_scored = on_scored
+        self.errors: Dict[Any, BaseException] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        # Sessions taken off the queue whose scores have not been handed to on_scored yet
+        self._scoring: Set[Any] = set()
+
+    async def __aenter__(self) -> "ScoringPipeline":
+        self._queue = asyncio.Queue(self.scorer.conf.queue_size)
+        self._workers = [asyncio.ensure_future(self._work()) for _ in range(self.scorer.conf.concurrency)]
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        unscored = list(self._scoring)
+        self._scoring.clear()
+        while not self._queue.empty():
+            unscored.append(self._queue.get_nowait()[0])
+            self._queue.task_done()
+        for item in unscored:
+            self._hand_over(item, None, None)
+
+    async def submit(self, item: Any, chat_session: "ChatSession", metadata: Dict[str, Any]):
+        """Queue a finished session for scoring, waiting while the queue is full."""
+        await self._queue.put((item, chat_session, metadata))
+
+    async def join(self):
+        """Wait until every submitted session has been scored and handed to `on_scored`."""
+        await self._queue.join()
+
+    async def _work(self):
+        while True:
+            item, chat_session, metadata = await self._queue.get()
+            self._scoring.add(item)
+            try:
+                try:
+                    scores, errors = await self.scorer.score(chat_session, metadata)
+                except Exception as e:
+                    # The session is written without scores all the same
+                    traceback.print_exc()
+                    self.errors[item] = e
+                    scores, errors = None, None
+                self._hand_over(item, scores, errors)
+                self._scoring.discard(item)
+            finally:
+                self._queue.task_done()
+
+    def _hand_over(self, item: Any, scores: Optional[Dict[str, Optional[float]]], errors: Optional[Dict[str, str]]):
+        try:
+            self.on_scored(item, scores, errors)
+        except Exception as e:
+            traceback.print_exc()
+            self.errors[item] = e
+
+
+def build_scoreboard(records: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Aggregate the scores of rounds per suite and instruction combination.
+
+    Args:
+        records (Iterable[Dict[str, Any]]): Round records with 'suite', 'combination_index', 'init_instr_list' and
+                                            'scores', e.g. the units of a manifest. Records without scores are skipped.
+
+    Returns:
+        Dict[str, Any]: For each suite, the names of its scores and one entry per combination with the number of
+                        scored rounds and the count, mean, 95% confidence interval width, minimum and maximum of each
+                        score. Scores that could not be determined are left out.
+    """
+    suites: Dict[str, Dict[int, Dict[str, Any]]] = {}
+    for record in records:
+        if not record.get('scores'):
+            continue
+        combinations = suites.setdefault(record['suite'], {})
+        combination = combinations.setdefault(record['combination_index'], {
+            'combination_index': record['combination_index'],
+            'init_instr_list': record.get('init_instr_list'),
+            'rounds': 0,
+            'values': {},
+        })
+        combination['rounds'] += 1
+        for name, value in record['scores'].items():
+            values = combination['values'].setdefault(name, [])
+            if value is not None:
+                values.append(value)
+
+    scoreboard = {}
+    for suite, combinations in sorted(suites.items()):
+        entries = []
+        score_names = set()
+        for combination_index, combination in sorted(combinations.items()):
+            values_by_name = combination.pop('values')
+            score_names.update(values_by_name)
+            combination['scores'] = {name: describe_scores(values) for name, values in sorted(values_by_name.items())}
+            entries.append(combination)
+        scoreboard[suite] = {'scores': sorted(score_names), 'combinations': entries}
+    return scoreboard
+
+
+def describe_scores(values: List[float]) -> Dict[str, Optional[float]]:
+    ci_width = confidence_interval_width(values)
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values) if values else None,
+        'ci95': None if math.isinf(ci_width) else ci_width,
+        'min': min(values) if values else None,
+        'max': max(values) if values else None,
+    }
+
+
+def write_scoreboard(output_dir: str, records: Iterable[Dict[str, Any]]) -> str:
+    """
+    Write the scoreboard of `records` (see `build_scoreboard`) to `scoreboard.json` in `output_dir`. The entries of
+    suites that have no scored records are kept from an existing file.
+
+    Returns:
+        str: Path of the file.
+    """
+    path = os.path.join(output_dir, SCOREBOARD_FILE_NAME)
+    scoreboard = {}
+    if os.path.exists(path):
+        with open(path, 'r') as file:
+            scoreboard = json.load(file)
+    scoreboard.update(build_scoreboard(records))
+    with open(path, 'w') as file:
+        json.dump(scoreboard, file, indent=2, ensure_ascii=False)
+    return path
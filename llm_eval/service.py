@@ -1,52 +1,120 @@
 import os
 import json
-from typing import List, Dict, Tuple
-from llm_party import initiate_session as start_session
+import time
+from typing import TYPE_CHECKING, Any, List, Dict, Optional
 import yaml
-import datetime
-import itertools
+from llm_eval.party_template import PartyTemplate
+from llm_eval.instructions import InstructionCombinations, InstructionIndex, list_instruction_files
 
+if TYPE_CHECKING:
+    from llm_party.model.session_models import ChatSession
 
-def conduct_chat_session(party_conf_dict: Dict, exp_conf: Dict, output_dir: str, verbose: bool):
+
+def start_session(party_conf_dict: Dict, **kwargs):
+    """
+    Conduct a chat session with `llm_party.initiate_session`.
+
+    llm_party and the LLM clients it loads are imported on the first call, so that importing llm_eval, printing
+    `--help` and validating configurations stay fast.
+    """
+    from llm_party import initiate_session
+    return initiate_session(party_conf_dict, **kwargs)
+
+
+def conduct_chat_session(party_conf_dict: Dict, exp_conf: Dict, output_dir: str, verbose: bool, sink=None,
+                         metadata: Optional[Dict[str, Any]] = None):
     """
-    Conduct a chat session based on the party configuration and test configuration, saving the session and configuration to files.
+    Conduct a chat session based on the party configuration and test configuration, saving each round and the configuration to files.
 
-    This function initiates a chat session using the provided party configuration and test configuration. It generates a unique timestamp to append to the filenames of the saved chat session and party configuration, ensuring each session's output is uniquely identifiable. The chat session is conducted for a number of rounds specified in the test configuration.
+    This function initiates a chat session using the provided party configuration and test configuration. The chat session is conducted for a number of rounds specified in the test configuration, and each round is written as soon as it has finished.
 
     Args:
         party_conf_dict (Dict): Compiled party configuration dictionary. This dictionary should include the configuration for each attendee of the chat session, such as their roles, initial instructions, and any other relevant settings.
         exp_conf (Dict): Test configuration dictionary. This dictionary specifies the parameters for the chat session. Key parameters include:
             - 'num_rounds' (int): The number of chat rounds to be conducted. If not specified, defaults to 3.
             - Other parameters can be included based on the requirements of the `llm_party` library or specific test scenarios.
-        output_dir (str): Directory to save output files. This includes the chat session history and the party configuration, both appended with a timestamp for uniqueness.
+        output_dir (str): Directory to save output files. This includes the chat history of each round and the party configuration.
         verbose (bool): Enable verbose mode. If True, additional details about the chat session will be printed to the console.
+        sink (Optional[ResultSink]): Where to write the result of each round (see `llm_eval.sink`). Defaults to a `FileSink`.
+        metadata (Optional[Dict[str, Any]]): Metadata written with each round, e.g. the 'suite' and the 'init_instr_list' (paths of the initial instruction files). The suite defaults to '', the combination index to 0 and the instruction list to an empty list; the round index is set per round.
 
-    The function saves two files in the specified output directory:
-        - A JSON file containing the chat history, named `chat_history_YYYYMMDD_HHMMSS.json`, where `YYYYMMDD_HHMMSS` is the timestamp at the start of the session.
-        - A YAML file containing the compiled party configuration, named `party_conf_YYYYMMDD_HHMMSS.yaml`, with the same timestamp.
-
-    The timestamp format is YYYYMMDD_HHMMSS, representing the year, month, day, hour, minute, and second at the start of the chat session.
+    By default, each round is saved in the specified output directory as two files:
+        - A JSON file containing the chat history, named `chat_history_YYYYMMDD_HHMMSS_c0000_rNN.json`, where `YYYYMMDD_HHMMSS` is the timestamp at the start of the session and `NN` the round index.
+        - A YAML file containing the compiled party configuration, named `party_conf_YYYYMMDD_HHMMSS_c0000_rNN.yaml`, with the same tag.
     """
-    # Define file paths with timestamp
-    start_time = datetime.datetime.now()
-    timestamp = start_time.strftime("%Y%m%d_%H%M%S")  # Format: YYYYMMDD_HHMMSS
-    filepath_of_chat_session = os.path.join(output_dir, f'chat_history_{timestamp}.json')
-    file_path_of_party_conf_dict = os.path.join(output_dir, f'party_conf_{timestamp}.yaml')
+    if sink is None:
+        # sink builds on this module
+        from llm_eval.sink import FileSink
+        sink = FileSink(output_dir)
 
     # Start the chat session
     num_rounds = exp_conf.get('num_rounds', 3)
-    for _ in range(num_rounds):
-        chat_session, _ = start_session(party_conf_dict, output=print if verbose else None)
+    for round_index in range(num_rounds):
+        round_start = time.perf_counter()
+        chat_session = run_chat_round(party_conf_dict, verbose)
+        round_metadata = dict({'suite': '', 'combination_index': 0, 'init_instr_list': []}, **(metadata or {}))
+        round_metadata['round_index'] = round_index
+        round_metadata['round_seconds'] = round(time.perf_counter() - round_start, 6)
+        sink.write_round(round_metadata, chat_session, party_conf_dict)
+
+def run_chat_round(party_conf_dict: Dict, verbose: bool) -> "ChatSession":
+    """
+    Conduct a single chat session round with `llm_party`, without saving it.
+
+    Args:
+        party_conf_dict (Dict): Compiled party configuration dictionary.
+        verbose (bool): Enable verbose mode. If True, the messages of the chat session are printed to the console.
+
+    Returns:
+        ChatSession: The finished chat session.
+    """
+    chat_session, _ = start_session(party_conf_dict, output=print if verbose else None)
+    return chat_session
+
+def conduct_chat_round(party_conf_dict: Dict, filepath_of_chat_session: str, file_path_of_party_conf_dict: str, verbose: bool):
+    """
+    Conduct a single chat session round and save the chat history and the party configuration.
+
+    Args:
+        party_conf_dict (Dict): Compiled party configuration dictionary.
+        filepath_of_chat_session (str): Path of the JSON file the chat history is written to.
+        file_path_of_party_conf_dict (str): Path of the YAML file the party configuration is written to.
+        verbose (bool): Enable verbose mode. If True, the messages of the chat session are printed to the console.
+
+    Returns:
+        ChatSession: The finished chat session.
+    """
+    chat_session = run_chat_round(party_conf_dict, verbose)
+    save_chat_round(chat_session, party_conf_dict, filepath_of_chat_session, file_path_of_party_conf_dict)
+    return chat_session
 
-        # Save the chat history with timestamp in filename
-        with open(filepath_of_chat_session, 'w') as file:
-            json.dump(chat_session.to_dict(), file, indent=2)
+def chat_session_to_dict(chat_session: "ChatSession") -> Dict:
+    """
+    Convert a chat session to a dictionary.
+
+    Same result as `ChatSession.to_dict`, which parses the serialized JSON with the (much slower) YAML loader.
+    """
+    return json.loads(chat_session.to_json())
+
+def save_chat_round(chat_session: "ChatSession", party_conf_dict: Dict, filepath_of_chat_session: str, file_path_of_party_conf_dict: str):
+    """
+    Save the chat history of a finished chat session round and the party configuration it was conducted with.
 
-        # TODO: Dump chat history as readable text in a separate file
+    Args:
+        chat_session (ChatSession): The finished chat session.
+        party_conf_dict (Dict): Compiled party configuration dictionary.
+        filepath_of_chat_session (str): Path of the JSON file the chat history is written to.
+        file_path_of_party_conf_dict (str): Path of the YAML file the party configuration is written to.
+    """
+    # Save the chat history
+    with open(filepath_of_chat_session, 'w') as file:
+        json.dump(chat_session_to_dict(chat_session), file, indent=2)
+
+    # TODO: Dump chat history as readable text in a separate file
 
-        # Save the compiled configuration for llm_party library with timestamp in filename
-        with open(file_path_of_party_conf_dict, 'w') as file:
-            yaml.dump(party_conf_dict, file)
+    # Save the compiled configuration for llm_party library
+    with open(file_path_of_party_conf_dict, 'w') as file:
+        yaml.dump(party_conf_dict, file)
 
 def load_instructions(init_instr_dir: str) -> List[str]:
     """
@@ -60,9 +128,7 @@ def load_instructions(init_instr_dir: str) -> List[str]:
         List[str]: List of initial instructions sorted alphabetically by file name, excluding hidden files.
     """
     instructions = []
-    # Filter out hidden files starting with '.'
-    file_names = sorted([file for file in os.listdir(init_instr_dir) if not file.startswith('.')])
-    for file_name in file_names:
+    for file_name in list_instruction_files(init_instr_dir):
         file_path = os.path.join(init_instr_dir, file_name)
         try:
             with open(file_path, 'r') as file:
@@ -76,53 +142,37 @@ def compile_party_config(party_conf: str, init_instr_list: List[str]) -> Dict:
     """
     Compile the configuration for the llm_party library by merging initial instructions.
 
+    To compile many combinations against the same party configuration, parse it once with
+    `llm_eval.party_template.PartyTemplate` and call `render` for each combination instead.
+
     Args:
         party_conf (str): Path to the party configuration file.
-        init_instr (List[str]): List of initial instructions for AI agents.
+        init_instr_list (List[str]): List of initial instructions for AI agents, one per attendee.
 
     Returns:
         Dict: Compiled party configuration dictionary.
-    """
-    with open(party_conf, 'r') as file:
-        party_conf_dict = yaml.safe_load(file)
 
-    # TODO: Handle case where the number of attendees does not match the length of init_instr_list
-
-    for i, instr in enumerate(init_instr_list):
-        party_conf_dict['attendees'][i]['instruction']['text'] = instr
-
-    return party_conf_dict
+    Raises:
+        ValueError: If the number of attendees does not match the length of init_instr_list.
+    """
+    return PartyTemplate.from_file(party_conf).render(init_instr_list)
 
-def make_init_instr_lists(init_instr_dirs: List[str]) -> List[Tuple[str, ...]]:
+def make_init_instr_lists(init_instr_dirs: List[str]) -> InstructionCombinations:
     """
     Generate all combinations of initial instruction files from the provided directories,
-    with added error handling for invalid directories, empty directories, and inconsistent file counts.
+    with added error handling for invalid directories and empty directories.
+
+    Each directory is scanned once and every file is read once; use `InstructionCombinations.texts` to get
+    the contents of the files of a combination. Combinations are generated lazily.
 
     Args:
         init_instr_dirs (List[str]): A list of directories, each containing initial instruction files.
 
     Returns:
-        List[Tuple[str, ...]]: A list of tuples, where each tuple contains paths to initial instruction files
-                               forming one combination across the provided directories.
+        InstructionCombinations: A sequence of tuples, where each tuple contains paths to initial instruction files
+                                 forming one combination across the provided directories.
 
     Raises:
-        ValueError: If any directory does not exist, is empty, or if directories contain inconsistent numbers of files.
+        ValueError: If any directory does not exist or is empty.
     """
-    all_instr_paths = []
-
-    for dir_path in init_instr_dirs:
-        # Check if directory exists
-        if not os.path.exists(dir_path) or not os.path.isdir(dir_path):
-            raise ValueError(f"Directory does not exist: {dir_path}")
-
-        instr_files = load_instructions(dir_path)
-
-        # Check if directory is empty
-        if not instr_files:
-            raise ValueError(f"Directory is empty: {dir_path}")
-
-        full_paths = [os.path.join(dir_path, file_name) for file_name in instr_files]
-        all_instr_paths.append(full_paths)
-
-    # Generate all combinations of instruction paths across the directories
-    return list(itertools.product(*all_instr_paths))
\ No newline at end of file
+    return InstructionIndex(init_instr_dirs).combinations()
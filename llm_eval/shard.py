@@ -0,0 +1,47 @@
+import hashlib
+import json
+
+
+class Shard:
+    """
+    One of `count` disjoint slices of the work units of a run.
+
+    A unit (suite, combination index, round index) belongs to the shard given by a SHA-256 of the unit, so every
+    host that runs the same suites with the same instruction files assigns each unit to the same shard, without
+    any coordination. Shards are numbered from 0 to `count - 1`.
+    """
+
+    def __init__(self, index: int, count: int):
+        if count < 1:
+            raise ValueError(f"Number of shards must be at least 1: {count}")
+        if not 0 <= index < count:
+            raise ValueError(f"Shard index must be between 0 and {count - 1}: {index}")
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def parse(cls, spec: str) -> "Shard":
+        """
+        Parse a shard specification of the form 'i/N', e.g. '0/4' for the first of four shards.
+
+        Raises:
+            ValueError: If the specification is malformed or out of range.
+        """
+        try:
+            index, count = (int(part) for part in spec.split('/'))
+        except ValueError:
+            raise ValueError(f"Shard must be given as i/N, e.g. 0/4: {spec}")
+        return cls(index, count)
+
+    def includes(self, suite: str, combination_index: int, round_index: int) -> bool:
+        return shard_of(suite, combination_index, round_index, self.count) == self.index
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
+
+
+def shard_of(suite: str, combination_index: int, round_index: int, num_shards: int) -> int:
+    """Shard of a unit of work among `num_shards` shards. Stable across hosts, runs and Python versions."""
+    payload = json.dumps([suite, combination_index, round_index], ensure_ascii=False)
+    digest = hashlib.sha256(payload.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % num_shards
@@ -0,0 +1,242 @@
+import os
+import re
+import json
+import gzip
+import hashlib
+import datetime
+import threading
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set
+from llm_eval.service import chat_session_to_dict, save_chat_round
+
+if TYPE_CHECKING:
+    from llm_party.model.session_models import ChatSession
+
+RESULT_FORMATS = ('files', 'jsonl', 'sqlite')
+COMPRESSIONS = ('gzip', 'zstd')
+RESULTS_FILE_NAME = 'results.jsonl'
+COMPRESSION_SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+def party_conf_hash(party_conf_dict: Dict) -> str:
+    """Content hash of a compiled party configuration."""
+    payload = json.dumps(party_conf_dict, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultSink:
+    """
+    Destination of the results of chat session rounds.
+
+    `write_round` receives the metadata of the round (suite, combination_index, round_index, init_instr_list,
+    init_instr_digests, ...), the finished chat session and the party configuration it was conducted with. It returns the paths,
+    relative to the output directory, of the files the round was written to.
+    Sinks may be shared by concurrent sessions.
+    """
+
+    def write_round(self, metadata: Dict[str, Any], chat_session: "ChatSession", party_conf_dict: Dict) -> List[str]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def suite_file_tag(suite: str) -> str:
+    """
+    File-name-safe form of a suite name: the name with runs of other characters than letters, digits, '.', '_' and
+    '-' replaced by '-', followed by a short hash of the name that tells apart suites with the same safe form.
+    """
+    slug = re.sub(r'[^A-Za-z0-9._-]+', '-', suite).strip('-.')[:40]
+    digest = hashlib.sha256(suite.encode('utf-8')).hexdigest()[:8]
+    return f'{slug}-{digest}' if slug else digest
+
+
+class FileSink(ResultSink):
+    """
+    Write each round to its own `chat_history_<tag>.json` file and its party configuration to `party_conf_<tag>.yaml`.
+    The tag consists of the time the sink was created, the suite (see `suite_file_tag`), the combination index and the
+    round index, so suites written to the same output directory in the same second do not overwrite each other.
+    Scores of the round in its metadata are written to `scores_<tag>.json`.
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    def write_round(self, metadata: Dict[str, Any], chat_session: "ChatSession", party_conf_dict: Dict) -> List[str]:
+        file_tag = self.timestamp
+        if metadata.get('suite'):
+            file_tag += f"_{suite_file_tag(metadata['suite'])}"
+        file_tag += f"_c{metadata['combination_index']:04d}_r{metadata['round_index']:02d}"
+        file_names = [f'chat_history_{file_tag}.json', f'party_conf_{file_tag}.yaml']
+        save_chat_round(chat_session, party_conf_dict, *(os.path.join(self.output_dir, name) for name in file_names))
+        if 'scores' in metadata:
+            file_names.append(f'scores_{file_tag}.json')
+            with open(os.path.join(self.output_dir, file_names[-1]), 'w') as file:
+                json.dump({key: metadata[key] for key in ('scores', 'score_errors') if key in metadata}, file, indent=2)
+        return file_names
+
+
+def compact_session_record(chat_session_dict: Dict, include_chat_history: bool = True) -> Dict:
+    """
+    Drop what the party configuration already holds from a serialized chat session: the attendees, and the
+    attendee details repeated in every message. Each message keeps the sender's name and role.
+    """
+    record = {key: value for key, value in chat_session_dict.items() if key not in ('attendees', 'chat_history')}
+    chat_history = chat_session_dict.get('chat_history') or []
+    record['turn_count'] = len(chat_history)
+    if include_chat_history:
+        record['chat_history'] = [compact_message(message) for message in chat_history]
+    return record
+
+
+def compact_message(message: Dict) -> Dict:
+    return {
+        'sender': message['sender']['name'],
+        'role': message['sender']['role'],
+        'text': message['text'],
+        'timestamp': message['timestamp'],
+    }
+
+
+def open_results_file(path: str, mode: str = 'rt'):
+    """
+    Open a JSON Lines results file in text mode, compressed according to its suffix ('.gz' or '.zst').
+
+    Raises:
+        ValueError: If the file is zstd-compressed and the 'zstandard' package is not installed.
+    """
+    if path.endswith(COMPRESSION_SUFFIXES['gzip']):
+        return gzip.open(path, mode, encoding='utf-8')
+    if path.endswith(COMPRESSION_SUFFIXES['zstd']):
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd compression requires the 'zstandard' package")
+        return zstandard.open(path, mode, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def read_party_conf_hashes(path: str) -> Set[str]:
+    """
+    Hashes of the party configuration records of an existing results file.
+
+    Raises:
+        ValueError: If a compressed file ends in a truncated stream, e.g. because a run crashed while writing it.
+    """
+    errors = (EOFError, OSError)
+    if path.endswith(COMPRESSION_SUFFIXES['zstd']):
+        import zstandard
+        errors += (zstandard.ZstdError,)
+    hashes = set()
+    try:
+        with open_results_file(path, 'rt') as file:
+            for line in file:
+                # Records are written with 'type' first and without spaces
+                if line.startswith('{"type":"party_conf"') and line.endswith('\n'):
+                    hashes.add(json.loads(line)['party_conf_hash'])
+    except errors as e:
+        raise ValueError(f"{path} is truncated, e.g. by a crash, and cannot be appended to ({e}). Compressed results "
+                         f"cannot be resumed after a crash; move the file away to start a new one.")
+    return hashes
+
+
+def truncate_partial_line(path: str):
+    """Cut off an incomplete last line of an uncompressed results file, i.e. a record whose writing was interrupted."""
+    with open(path, 'rb+') as file:
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        position = size
+        while position > 0:
+            # Search backwards for the last newline, one block at a time
+            start = max(0, position - 65536)
+            file.seek(start)
+            end = file.read(position - start).rfind(b'\n')
+            if end >= 0:
+                position = start + end + 1
+                break
+            position = start
+        if position < size:
+            file.truncate(position)
+
+
+class JsonlSink(ResultSink):
+    """
+    Append one compact JSON record per round, and optionally one per turn, to `results.jsonl` in the output directory.
+
+    Records are distinguished by their "type":
+        - "party_conf": a compiled party configuration, written once per distinct configuration and referenced
+          by the "party_conf_hash" of the other records.
+        - "round": the round metadata and the chat session, without the attendees.
+        - "turn": one message of a round, if `per_turn` is set. The round record then omits the chat history.
+
+    With `compression`, the file is `results.jsonl.gz` (gzip) or `results.jsonl.zst` (zstd, requires the
+    `zstandard` package). Every round is flushed to disk before `write_round` returns.
+
+    An existing file, e.g. of an interrupted run that is resumed, is appended to, and the party configurations it
+    already holds are not written again. An incomplete last record of an uncompressed file is cut off first. A
+    compressed file that a crash left truncated cannot be appended to.
+    """
+
+    def __init__(self, output_dir: str, compression: Optional[str] = None, per_turn: bool = False):
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression: {compression}. Expected one of: {', '.join(COMPRESSIONS)}")
+        self.per_turn = per_turn
+        self.file_name = RESULTS_FILE_NAME + COMPRESSION_SUFFIXES[compression]
+        path = os.path.join(output_dir, self.file_name)
+        self._written_party_confs = set()
+        if os.path.exists(path):
+            if compression is None:
+                truncate_partial_line(path)
+            self._written_party_confs = read_party_conf_hashes(path)
+        self._file = open_results_file(path, 'at')
+        self._lock = threading.Lock()
+
+    def _write(self, record: Dict):
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str) + '\n')
+
+    def write_round(self, metadata: Dict[str, Any], chat_session: "ChatSession", party_conf_dict: Dict) -> List[str]:
+        conf_hash = party_conf_hash(party_conf_dict)
+        chat_session_dict = chat_session_to_dict(chat_session)
+        # Serialize outside the lock; only the writes are serialized
+        round_record = dict(metadata, type='round', party_conf_hash=conf_hash,
+                            chat_session=compact_session_record(chat_session_dict, not self.per_turn))
+        turn_records = []
+        if self.per_turn:
+            for turn_index, message in enumerate(chat_session_dict.get('chat_history') or []):
+                turn_records.append(dict(metadata, type='turn', turn_index=turn_index, **compact_message(message)))
+
+        with self._lock:
+            if conf_hash not in self._written_party_confs:
+                self._write({'type': 'party_conf', 'party_conf_hash': conf_hash, 'party_conf': party_conf_dict})
+                self._written_party_confs.add(conf_hash)
+            for record in turn_records:
+                self._write(record)
+            self._write(round_record)
+            self._file.flush()
+        return [self.file_name]
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def make_sink(output_dir: str, result_format: str = 'files', compression: Optional[str] = None,
+              per_turn: bool = False) -> ResultSink:
+    """
+    Create the result sink for `result_format`.
+
+    Raises:
+        ValueError: If the format is unknown, or compression or per-turn records are requested for a format other
+                    than 'jsonl'.
+    """
+    if result_format != 'jsonl' and (compression is not None or per_turn):
+        raise ValueError("Compression and per-turn records require the 'jsonl' result format")
+    if result_format == 'files':
+        return FileSink(output_dir)
+    if result_format == 'jsonl':
+        return JsonlSink(output_dir, compression, per_turn)
+    if result_format == 'sqlite':
+        # results_db builds on this module
+        from llm_eval.results_db import SqliteSink
+        return SqliteSink(output_dir)
+    raise ValueError(f"Unknown result format: {result_format}. Expected one of: {', '.join(RESULT_FORMATS)}")
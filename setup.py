@@ -11,7 +11,6 @@ setup(
     },
     install_requires=[
         'llm_party',
-        'md_jinja',
         'pyyaml'
     ],
 )
\ No newline at end of file
@@ -0,0 +1,43 @@
+import os
+import shutil
+import tempfile
+import unittest
+import yaml
+
+
+class SuiteTestCase(unittest.TestCase):
+    """
+    Base class of the tests that conduct an experiment suite.
+
+    `setUp` creates a temporary work directory with an 'agents' and a 'clients' instruction directory, holding as
+    many files as `instruction_counts` gives, and an empty 'output' directory. `exp_suite` is a suite named 'Suite'
+    of `party_conf`; its exp conf is written by `write_exp_conf`.
+    """
+
+    instruction_counts = (2, 3)
+    party_conf = 'tests/data/test_fake_party_conf.yaml'
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.output_dir = os.path.join(self.work_dir, 'output')
+        os.makedirs(self.output_dir)
+        self.init_instr_dirs = []
+        for dir_name, count in zip(('agents', 'clients'), self.instruction_counts):
+            dir_path = os.path.join(self.work_dir, dir_name)
+            os.makedirs(dir_path)
+            for i in range(count):
+                with open(os.path.join(dir_path, f'{dir_name}{i}.md'), 'w') as file:
+                    file.write(f'{dir_name} instruction {i}')
+            self.init_instr_dirs.append(dir_path)
+        self.exp_conf = os.path.join(self.work_dir, 'exp_conf.yaml')
+        self.exp_suite = {
+            'exp suite': 'Suite',
+            'init instr dirs': self.init_instr_dirs,
+            'party conf': self.party_conf,
+            'exp conf': self.exp_conf,
+        }
+
+    def write_exp_conf(self, **exp_conf):
+        with open(self.exp_conf, 'w') as file:
+            yaml.dump(exp_conf, file)
@@ -0,0 +1,89 @@
+import math
+import unittest
+from llm_eval.adaptive import (AdaptiveRoundsConf, AdaptiveScheduler, confidence_interval_width, get_round_metric,
+                               register_round_metric)
+from llm_eval.controller import run_exp_suite
+from llm_eval.manifest import Manifest
+from tests.helpers import SuiteTestCase
+
+
+class TestAdaptiveScheduler(unittest.TestCase):
+    def test_confidence_interval_width(self):
+        self.assertEqual(confidence_interval_width([3.0]), math.inf)
+        self.assertEqual(confidence_interval_width([2.0, 2.0, 2.0]), 0.0)
+        # Mean 2, sample standard deviation 1, t(0.975, 2) = 4.303
+        self.assertAlmostEqual(confidence_interval_width([1.0, 2.0, 3.0]), 2 * 4.303 / math.sqrt(3), places=6)
+
+    def test_stable_combination_stops_at_min_rounds(self):
+        scheduler = AdaptiveScheduler(AdaptiveRoundsConf({'min_rounds': 2, 'max_rounds': 5, 'ci_width': 1.0}), [0, 1])
+        self.assertEqual(scheduler.next_wave(), [(0, 0), (0, 1), (1, 0), (1, 1)])
+        for combination_index, value in [(0, 4.0), (0, 4.0), (1, 0.0), (1, 10.0)]:
+            scheduler.record(combination_index, value)
+        # Only the noisy combination gets more rounds
+        self.assertEqual(scheduler.next_wave(), [(1, 2)])
+        scheduler.record(1, 5.0)
+        self.assertEqual(scheduler.next_wave(), [(1, 3)])
+        scheduler.record(1, 5.0)
+        self.assertEqual(scheduler.next_wave(), [(1, 4)])
+        scheduler.record(1, 5.0)
+        self.assertEqual(scheduler.next_wave(), [])
+        self.assertEqual(scheduler.summary(), {'combinations': 2, 'converged': 1, 'rounds': 7, 'max_rounds': 10})
+
+    def test_budget_goes_to_widest_interval_first(self):
+        conf = AdaptiveRoundsConf({'min_rounds': 2, 'max_rounds': 5, 'ci_width': 0.1, 'max_total_rounds': 7})
+        scheduler = AdaptiveScheduler(conf, [0, 1, 2])
+        self.assertEqual(len(scheduler.next_wave()), 6)
+        for combination_index, values in [(0, (1.0, 2.0)), (1, (0.0, 10.0)), (2, (1.0, 1.5))]:
+            for value in values:
+                scheduler.record(combination_index, value)
+        self.assertEqual(scheduler.next_wave(), [(1, 2)])
+        self.assertEqual(scheduler.next_wave(), [])
+
+    def test_resumed_rounds_are_not_scheduled_again(self):
+        scheduler = AdaptiveScheduler(AdaptiveRoundsConf({'min_rounds': 2, 'max_rounds': 3}), [0])
+        scheduler.record(0, 1.0, round_index=0)
+        self.assertEqual(scheduler.next_wave(), [(0, 1)])
+
+    def test_invalid_conf(self):
+        for conf in ({'min_rounds': 3, 'max_rounds': 2}, {'ci_width': -1}, {'rounds': 3}, {'metric': 'no_such_metric'},
+                     {'metric': 'no_such_module:score'}):
+            with self.assertRaises(ValueError):
+                AdaptiveRoundsConf(conf)
+        self.assertIs(get_round_metric('math:fabs'), math.fabs)
+
+
+class TestRunExpSuiteAdaptive(SuiteTestCase):
+    instruction_counts = (2, 2)
+
+    def run_suite(self, adaptive_rounds, resume=False):
+        self.write_exp_conf(num_rounds=3, adaptive_rounds=adaptive_rounds)
+        manifest = Manifest(self.output_dir)
+        results = run_exp_suite(self.exp_suite, False, self.output_dir, max_concurrency=4, engine='asyncio',
+                                manifest=manifest, resume=resume)
+        return results, manifest
+
+    def test_converged_combinations_stop_at_min_rounds(self):
+        # Every session of the fake party has the same number of turns
+        results, manifest = self.run_suite({'min_rounds': 2, 'max_rounds': 6, 'metric': 'turn_count', 'ci_width': 0.5})
+        self.assertEqual(len(results), 4 * 2)
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual({record['metric_value'] for record in manifest.units.values()}, {2.0})
+        self.assertEqual(manifest.plans['Suite']['min_rounds'], 2)
+
+    def test_noisy_combination_runs_to_max_rounds(self):
+        def noisy_for_first_combination(chat_session, metadata):
+            return float(metadata['round_index'] % 2 * 10) if metadata['combination_index'] == 0 else 1.0
+
+        register_round_metric('noisy', noisy_for_first_combination)
+        results, manifest = self.run_suite({'min_rounds': 2, 'max_rounds': 4, 'metric': 'noisy', 'ci_width': 1.0})
+        self.assertEqual(len(results), 4 + 3 * 2)
+
+        # A resumed run with a higher limit continues from the recorded metric values
+        results, manifest = self.run_suite({'min_rounds': 2, 'max_rounds': 5, 'metric': 'noisy', 'ci_width': 1.0},
+                                           resume=True)
+        self.assertEqual([result.job.round_index for result in results], [4])
+        self.assertEqual(len(manifest), 11)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import asyncio
+import unittest
+from llm_eval.batching import BatchingConf, TurnBatcher
+from llm_eval.controller import run_exp_suite
+from llm_eval.metrics import MetricsRecorder
+from llm_eval.providers import FakeProvider, ProviderError
+from tests.helpers import SuiteTestCase
+
+
+class RecordingProvider(FakeProvider):
+    """Fake batching server that records the size of every batched call."""
+
+    def __init__(self):
+        super().__init__(seed=0)
+        self.batch_sizes = []
+
+    async def complete_batch(self, requests):
+        self.batch_sizes.append(len(requests))
+        return await super().complete_batch(requests)
+
+
+class BrokenProvider(FakeProvider):
+    async def complete_batch(self, requests):
+        raise ProviderError('Server down', status_code=503)
+
+
+def submit_all(batcher, provider, turns):
+    async def run():
+        return await asyncio.gather(*(batcher.submit('fake', provider, messages, params) for messages, params in turns),
+                                    return_exceptions=True)
+    return asyncio.run(run())
+
+
+class TestTurnBatcher(unittest.TestCase):
+    def test_invalid_conf(self):
+        for conf in ({'max_batch_size': 0}, {'max_wait_ms': -1}, {'max_batch_size': 2, 'window': 5}):
+            with self.assertRaises(ValueError):
+                BatchingConf(conf)
+
+    def test_turns_are_batched_and_fanned_out(self):
+        provider = RecordingProvider()
+        metrics = MetricsRecorder()
+        batcher = TurnBatcher(BatchingConf({'max_batch_size': 2, 'max_wait_ms': 5}), metrics)
+        turns = [([{'role': 'user', 'content': 'Hello'}] * (i + 1), {'model': 'm'}) for i in range(5)]
+        completions = submit_all(batcher, provider, turns)
+        # The last turn is sent alone once the wait window has passed
+        self.assertEqual(provider.batch_sizes, [2, 2, 1])
+        self.assertEqual([completion.text for completion in completions], [f'Response {i + 1} of m' for i in range(5)])
+        self.assertEqual((batcher.batches, batcher.batched_turns), (3, 5))
+        self.assertEqual(metrics.summary()['models']['fake/m']['batch_size']['max'], 2)
+
+    def test_turns_of_different_models_are_not_mixed(self):
+        provider = RecordingProvider()
+        batcher = TurnBatcher(BatchingConf({'max_batch_size': 4, 'max_wait_ms': 5}))
+        turns = [([{'role': 'user', 'content': 'Hello'}], {'model': model}) for model in ('a', 'b', 'a', 'b')]
+        completions = submit_all(batcher, provider, turns)
+        self.assertEqual(provider.batch_sizes, [2, 2])
+        self.assertEqual([completion.text for completion in completions],
+                         ['Response 1 of a', 'Response 1 of b', 'Response 1 of a', 'Response 1 of b'])
+
+    def test_errors(self):
+        batcher = TurnBatcher(BatchingConf({'max_batch_size': 2}))
+        turns = [([{'role': 'user', 'content': 'Hello'}], {'model': 'm', 'error_rate': rate}) for rate in (1, 0)]
+        failed, completion = submit_all(batcher, RecordingProvider(), turns)
+        # An error of one request fails only its own turn
+        self.assertIsInstance(failed, ProviderError)
+        self.assertEqual(completion.text, 'Response 1 of m')
+        # An error of the batched call fails all of its turns
+        results = submit_all(batcher, BrokenProvider(), turns)
+        self.assertTrue(all(isinstance(result, ProviderError) for result in results))
+
+
+class TestBatchedSuite(SuiteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_exp_conf(num_rounds=2, batching={'max_batch_size': 4, 'max_wait_ms': 20})
+
+    def test_sessions_in_flight_share_batches(self):
+        metrics = MetricsRecorder()
+        results = run_exp_suite(self.exp_suite, False, self.output_dir, max_concurrency=4, engine='asyncio',
+                                metrics=metrics)
+        self.assertEqual(len(results), 12)
+        self.assertTrue(all(result.ok for result in results))
+        model = metrics.summary()['models']['fake/gpt-3.5-turbo-1106']
+        self.assertEqual(model['turn_seconds']['count'], 12 * 2)
+        self.assertEqual(model['batch_size']['max'], 4)
+        self.assertLess(model['batch_size']['count'], 12 * 2)
+
+    def test_threads_engine_is_rejected(self):
+        with self.assertRaises(ValueError):
+            run_exp_suite(self.exp_suite, False, self.output_dir, engine='threads')
+
+
+if __name__ == '__main__':
+    unittest.main()
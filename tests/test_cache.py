@@ -0,0 +1,95 @@
+import os
+import asyncio
+import shutil
+import tempfile
+import unittest
+import yaml
+from llm_eval.cache import CacheMissError, ResponseCache
+from llm_eval.controller import run_exp_suite
+from llm_eval.engine import SessionEngine
+from llm_eval.providers import Completion
+from tests.helpers import SuiteTestCase
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.messages = [{'role': 'system', 'content': 'Be nice'}]
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_key_ignores_transport_params(self):
+        key1 = ResponseCache.make_key('openai', {'model': 'gpt', 'retries': 3}, self.messages)
+        key2 = ResponseCache.make_key('openai', {'model': 'gpt', 'retries': 0}, self.messages)
+        key3 = ResponseCache.make_key('openai', {'model': 'gpt', 'temperature': 0.1}, self.messages)
+        self.assertEqual(key1, key2)
+        self.assertNotEqual(key1, key3)
+
+    def test_key_depends_on_sample_index(self):
+        key0 = ResponseCache.make_key('openai', {'model': 'gpt'}, self.messages)
+        self.assertEqual(ResponseCache.make_key('openai', {'model': 'gpt'}, self.messages, 0), key0)
+        self.assertNotEqual(ResponseCache.make_key('openai', {'model': 'gpt'}, self.messages, 1), key0)
+
+    def test_read_through_persists_across_instances(self):
+        cache = ResponseCache(self.cache_dir)
+        key = cache.make_key('openai', {}, self.messages)
+        self.assertIsNone(cache.get(key))
+        cache.put(key, Completion('hello', 3, 1))
+
+        reopened = ResponseCache(self.cache_dir, mode='replay')
+        completion = reopened.get(key)
+        self.assertEqual(completion.text, 'hello')
+        self.assertEqual(completion.prompt_tokens, 3)
+
+    def test_replay_fails_on_miss(self):
+        cache = ResponseCache(self.cache_dir, mode='replay')
+        with self.assertRaises(CacheMissError):
+            cache.get('0' * 64)
+
+    def test_record_never_reads(self):
+        cache = ResponseCache(self.cache_dir, mode='record')
+        cache.put('ab' * 32, Completion('hello'))
+        self.assertIsNone(cache.get('ab' * 32))
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(self.cache_dir)
+        keys = [f'{i:064x}' for i in range(3)]
+        cache.put(keys[0], Completion('x' * 100))
+        entry_size = cache.total_bytes
+        cache.max_bytes = entry_size * 2
+        cache.put(keys[1], Completion('x' * 100))
+        cache.get(keys[0])  # keys[1] becomes the least recently used entry
+        cache.put(keys[2], Completion('x' * 100))
+        self.assertIsNotNone(cache.get(keys[0]))
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertIsNotNone(cache.get(keys[2]))
+
+    def test_replayed_session_matches_recorded_session(self):
+        with open('tests/data/test_fake_party_conf.yaml', 'r') as file:
+            party_conf_dict = yaml.safe_load(file)
+        recorded = asyncio.run(SessionEngine(cache=ResponseCache(self.cache_dir, 'record')).run_session(party_conf_dict))
+        replay_cache = ResponseCache(self.cache_dir, 'replay')
+        replayed = asyncio.run(SessionEngine(cache=replay_cache).run_session(party_conf_dict))
+        self.assertEqual([m.text for m in replayed.chat_history], [m.text for m in recorded.chat_history])
+        self.assertEqual(replay_cache.hits, 2)
+
+
+class TestCachedSuite(SuiteTestCase):
+    instruction_counts = (1, 1)
+
+    def test_rounds_of_a_combination_miss_the_cache_separately(self):
+        self.write_exp_conf(num_rounds=2)
+        cache_dir = os.path.join(self.work_dir, 'cache')
+        cache = ResponseCache(cache_dir)
+        run_exp_suite(self.exp_suite, False, self.output_dir, engine='asyncio', cache=cache)
+        # 2 rounds of 2 turns, none of them answered with another round's response
+        self.assertEqual((cache.hits, cache.misses), (0, 4))
+
+        cache = ResponseCache(cache_dir)
+        run_exp_suite(self.exp_suite, False, self.output_dir, engine='asyncio', cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (4, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
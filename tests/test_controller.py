@@ -0,0 +1,112 @@
+import os
+import unittest
+from unittest.mock import patch
+from llm_eval.controller import run_exp_suite
+from llm_eval.manifest import Manifest
+from llm_party.model.session_models import ChatSession
+from tests.helpers import SuiteTestCase
+
+
+class TestRunExpSuite(SuiteTestCase):
+    party_conf = 'tests/data/test_party_conf.yaml'
+
+    def setUp(self):
+        super().setUp()
+        self.write_exp_conf(num_rounds=2)
+
+    def test_run_exp_suite_concurrently(self):
+        with patch('llm_eval.service.start_session') as mock_start_session:
+            mock_start_session.return_value = ChatSession(), ""
+            results = run_exp_suite(self.exp_suite, False, self.output_dir, max_concurrency=4)
+
+        # 2 x 3 combinations, 2 rounds each
+        self.assertEqual(mock_start_session.call_count, 12)
+        self.assertTrue(all(result.ok for result in results))
+        file_names = os.listdir(self.output_dir)
+        self.assertEqual(len([name for name in file_names if name.startswith('chat_history_')]), 12)
+        self.assertEqual(len([name for name in file_names if name.startswith('party_conf_')]), 12)
+
+    def test_failing_session_does_not_stop_the_suite(self):
+        with patch('llm_eval.service.start_session') as mock_start_session:
+            mock_start_session.side_effect = [ValueError('LLM API failure')] + [(ChatSession(), "")] * 11
+            results = run_exp_suite(self.exp_suite, False, self.output_dir, max_concurrency=1)
+
+        self.assertEqual(mock_start_session.call_count, 12)
+        self.assertEqual(len([result for result in results if not result.ok]), 1)
+
+    def test_run_exp_suite_with_asyncio_engine(self):
+        self.write_exp_conf(num_rounds=2, rate_limits=[{'llm_api': 'fake', 'requests_per_minute': 60000}])
+        self.exp_suite['party conf'] = 'tests/data/test_fake_party_conf.yaml'
+        results = run_exp_suite(self.exp_suite, False, self.output_dir, max_concurrency=4, engine='asyncio')
+
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual(len(results), 12)
+        self.assertEqual(len(results[0].value.chat_history), 2)
+
+    def test_rate_limits_require_asyncio_engine(self):
+        self.write_exp_conf(rate_limits=[{'llm_api': 'fake', 'requests_per_minute': 60}])
+        with self.assertRaises(ValueError):
+            run_exp_suite(self.exp_suite, False, self.output_dir)
+
+    def test_resume_reruns_only_unfinished_sessions(self):
+        manifest = Manifest(self.output_dir)
+        with patch('llm_eval.service.start_session') as mock_start_session:
+            mock_start_session.side_effect = [(ChatSession(), "")] * 5 + [ValueError('LLM API failure')] + [(ChatSession(), "")] * 6
+            run_exp_suite(self.exp_suite, False, self.output_dir, manifest=manifest)
+        self.assertEqual(len(Manifest(self.output_dir)), 11)
+
+        with patch('llm_eval.service.start_session') as mock_start_session:
+            mock_start_session.return_value = ChatSession(), ""
+            results = run_exp_suite(self.exp_suite, False, self.output_dir, manifest=Manifest(self.output_dir), resume=True)
+
+        self.assertEqual(mock_start_session.call_count, 1)
+        self.assertEqual(results[0].job.combination_index, 2)
+        self.assertEqual(results[0].job.round_index, 1)
+        self.assertEqual(len(Manifest(self.output_dir)), 12)
+
+    def test_resume_reruns_sessions_of_edited_instructions(self):
+        with patch('llm_eval.service.start_session') as mock_start_session:
+            mock_start_session.return_value = ChatSession(), ""
+            run_exp_suite(self.exp_suite, False, self.output_dir, manifest=Manifest(self.output_dir))
+        with open(os.path.join(self.init_instr_dirs[0], 'agents0.md'), 'w') as file:
+            file.write('edited agents instruction 0')
+
+        with patch('llm_eval.service.start_session') as mock_start_session:
+            mock_start_session.return_value = ChatSession(), ""
+            results = run_exp_suite(self.exp_suite, False, self.output_dir, manifest=Manifest(self.output_dir),
+                                    resume=True)
+
+        # agents0.md is in 3 combinations of 2 rounds each
+        self.assertEqual(mock_start_session.call_count, 6)
+        self.assertEqual({result.job.combination_index for result in results}, {0, 1, 2})
+
+    def test_suites_started_in_the_same_second_keep_their_files(self):
+        manifest = Manifest(self.output_dir)
+        with patch('llm_eval.service.start_session') as mock_start_session, \
+                patch('llm_eval.sink.datetime') as mock_datetime:
+            mock_start_session.return_value = ChatSession(), ""
+            mock_datetime.datetime.now.return_value.strftime.return_value = '20240101_000000'
+            for suite_name in ('Suite A', 'Suite/B'):
+                run_exp_suite(dict(self.exp_suite, **{'exp suite': suite_name}), False, self.output_dir,
+                              manifest=manifest)
+
+        file_names = os.listdir(self.output_dir)
+        self.assertEqual(len([name for name in file_names if name.startswith('chat_history_')]), 24)
+        unit_files = [file_name for record in manifest.units.values() for file_name in record['files']]
+        self.assertEqual(len(unit_files), len(set(unit_files)))
+        self.assertTrue(all(file_name in file_names for file_name in unit_files))
+
+    def test_attendee_count_must_match_instruction_dirs(self):
+        self.exp_suite['init instr dirs'] = self.init_instr_dirs[:1]
+        with patch('llm_eval.service.start_session') as mock_start_session:
+            with self.assertRaises(ValueError):
+                run_exp_suite(self.exp_suite, False, self.output_dir)
+        mock_start_session.assert_not_called()
+
+    def test_missing_keys(self):
+        with self.assertRaises(ValueError):
+            run_exp_suite({'exp conf': self.exp_conf}, False, self.output_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
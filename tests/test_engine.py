@@ -0,0 +1,177 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+import yaml
+from llm_eval.engine import SessionEngine, run_jobs_async
+from llm_eval.providers import Completion, FakeProvider, ProviderError, register_provider
+from llm_eval.ratelimit import RateLimiterRegistry, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_acquire_waits_for_refill(self):
+        clock = FakeClock()
+        bucket = TokenBucket(capacity=2, rate=1, clock=clock)
+        sleeps = []
+
+        async def fake_sleep(seconds):
+            sleeps.append(seconds)
+            clock.now += seconds
+
+        async def scenario():
+            original_sleep = asyncio.sleep
+            asyncio.sleep = fake_sleep
+            try:
+                await bucket.acquire(2)
+                await bucket.acquire(1)
+            finally:
+                asyncio.sleep = original_sleep
+
+        asyncio.run(scenario())
+        self.assertEqual(sleeps, [1.0])
+
+    def test_debit_can_go_negative(self):
+        bucket = TokenBucket(capacity=10, rate=1, clock=FakeClock())
+        bucket.debit(15)
+        self.assertEqual(bucket.tokens, -5)
+
+    def test_registry_falls_back_to_llm_api_limit(self):
+        registry = RateLimiterRegistry.from_conf([
+            {'llm_api': 'openai', 'model': 'gpt-4', 'requests_per_minute': 10},
+            {'llm_api': 'openai', 'tokens_per_minute': 1000},
+        ])
+        self.assertIsNotNone(registry.get('openai', 'gpt-4').requests)
+        self.assertIsNotNone(registry.get('openai', 'gpt-3.5-turbo').tokens)
+        self.assertIsNone(registry.get('anthropic', 'claude'))
+
+    def test_registry_rejects_entry_without_limit(self):
+        with self.assertRaises(ValueError):
+            RateLimiterRegistry.from_conf([{'llm_api': 'openai'}])
+
+
+class TestFakeProvider(unittest.TestCase):
+    def test_pads_response_to_response_chars(self):
+        completion = asyncio.run(FakeProvider().complete([{'role': 'system', 'content': 'hi'}], {'response_chars': 300}))
+        self.assertEqual(len(completion.text), 300)
+        self.assertTrue(completion.text.startswith('Response 1 of fake'))
+
+    def test_injects_errors_at_error_rate(self):
+        provider = FakeProvider(seed=1)
+        with self.assertRaises(ProviderError) as context:
+            asyncio.run(provider.complete([], {'error_rate': 1.0, 'error_status': 429}))
+        self.assertEqual(context.exception.status_code, 429)
+        asyncio.run(provider.complete([], {'error_rate': 0.0}))
+
+    def test_latency_distributions_have_requested_mean(self):
+        provider = FakeProvider(seed=1)
+        for distribution in ('constant', 'uniform', 'exponential', 'lognormal'):
+            params = {'latency': 0.1, 'latency_distribution': distribution}
+            samples = [provider.sample_latency(params) for _ in range(5000)]
+            self.assertAlmostEqual(sum(samples) / len(samples), 0.1, delta=0.01, msg=distribution)
+        with self.assertRaises(ValueError):
+            provider.sample_latency({'latency': 0.1, 'latency_distribution': 'pareto'})
+
+
+class FlakyProvider:
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    async def complete(self, messages, llm_api_params):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ProviderError('Too many requests', status_code=429)
+        return Completion('ok')
+
+
+class TestSessionEngine(unittest.TestCase):
+    def setUp(self):
+        with open('tests/data/test_fake_party_conf.yaml', 'r') as file:
+            self.party_conf_dict = yaml.safe_load(file)
+
+    def test_run_session_with_fake_provider(self):
+        chat_session = asyncio.run(SessionEngine().run_session(self.party_conf_dict))
+        self.assertEqual(len(chat_session.chat_history), 2)
+        self.assertEqual(chat_session.status, 'completed_successfully')
+        self.assertEqual(chat_session.chat_history[0].text, 'Response 1 of gpt-3.5-turbo-1106')
+
+    def test_retries_through_rate_limiter(self):
+        provider = FlakyProvider(failures=2)
+        registry = patch.dict('llm_eval.providers._providers')
+        registry.start()
+        self.addCleanup(registry.stop)
+        register_provider('flaky', provider)
+        registry = RateLimiterRegistry.from_conf([{'llm_api': 'flaky', 'requests_per_minute': 6000}])
+        engine = SessionEngine(registry)
+        completion = asyncio.run(engine.complete('flaky', [{'role': 'system', 'content': 'hi'}], {}, retries=2))
+        self.assertEqual(completion.text, 'ok')
+        self.assertEqual(provider.calls, 3)
+
+    def test_run_jobs_async_isolates_failures(self):
+        async def func(job):
+            if job == 1:
+                raise ValueError('boom')
+            return job
+
+        results = asyncio.run(run_jobs_async([0, 1, 2], func, max_concurrency=2, output=None))
+        self.assertEqual([result.ok for result in results], [True, False, True])
+
+    def test_run_jobs_async_runs_one_task_per_worker(self):
+        peak = [0]
+
+        async def func(job):
+            peak[0] = max(peak[0], len(asyncio.all_tasks()))
+            await asyncio.sleep(0)
+            return job
+
+        results = asyncio.run(run_jobs_async(list(range(100)), func, max_concurrency=3, output=None))
+        self.assertEqual([result.value for result in results], list(range(100)))
+        # The main task and the 3 workers
+        self.assertLessEqual(peak[0], 4)
+
+    def test_run_jobs_async_pulls_jobs_from_a_generator(self):
+        pulled = []
+
+        def jobs():
+            for job in range(10):
+                pulled.append(job)
+                yield job
+
+        async def func(job):
+            # Only the running jobs have been taken from the generator
+            self.assertLessEqual(len(pulled), job + 2)
+            await asyncio.sleep(0)
+            return job
+
+        results = asyncio.run(run_jobs_async(jobs(), func, max_concurrency=2, output=None))
+        self.assertEqual([result.value for result in results], list(range(10)))
+
+    def test_cancelled_run_jobs_async_lets_the_running_jobs_finish(self):
+        started, finished = [], []
+
+        async def func(job):
+            started.append(job)
+            await asyncio.sleep(0.05)
+            finished.append(job)
+
+        async def main():
+            task = asyncio.ensure_future(run_jobs_async(list(range(10)), func, max_concurrency=2, output=None))
+            await asyncio.sleep(0.02)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(main())
+        self.assertEqual(started, [0, 1])
+        self.assertEqual(finished, [0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import copy
+import asyncio
+import unittest
+from unittest.mock import patch
+import yaml
+from llm_eval.controller import run_exp_suite
+from llm_eval.engine import SessionEngine
+from llm_eval.fork import ForkConf, PrefixForker, prefix_id
+from llm_eval.manifest import Manifest
+from llm_eval.metrics import MetricsRecorder
+from llm_eval.providers import FakeProvider, ProviderError, register_provider
+from tests.helpers import SuiteTestCase
+
+
+class TestPrefixForking(unittest.TestCase):
+    def setUp(self):
+        with open('tests/data/test_fake_party_conf.yaml', 'r') as file:
+            self.party_conf_dict = yaml.safe_load(file)
+        self.party_conf_dict['settings']['max_sent_message'] = 4
+
+    def with_instruction(self, attendee_index, text):
+        party_conf_dict = copy.deepcopy(self.party_conf_dict)
+        party_conf_dict['attendees'][attendee_index]['instruction']['text'] = text
+        return party_conf_dict
+
+    def test_prefix_id_depends_on_speakers_only(self):
+        key = prefix_id(self.party_conf_dict, 1, 0)
+        self.assertEqual(key, prefix_id(self.with_instruction(1, 'Another client'), 1, 0))
+        self.assertNotEqual(key, prefix_id(self.with_instruction(0, 'Another agent'), 1, 0))
+        self.assertNotEqual(key, prefix_id(self.with_instruction(1, 'Another client'), 2, 0))
+        self.assertNotEqual(key, prefix_id(self.party_conf_dict, 1, 1))
+
+    def test_invalid_conf(self):
+        for conf in ({}, {'prefix_turns': 0}, {'prefix_turns': 1, 'rounds': 2}):
+            with self.assertRaises(ValueError):
+                ForkConf(conf)
+
+    def test_forks_continue_after_the_shared_prefix(self):
+        metrics = MetricsRecorder()
+        engine = SessionEngine(metrics=metrics)
+        forker = PrefixForker(engine, ForkConf({'prefix_turns': 1}))
+
+        async def fork(party_conf_dict):
+            _, snapshot = await forker.get_prefix(party_conf_dict, 0)
+            return await engine.run_session(party_conf_dict, prefix=snapshot['chat_history'])
+
+        async def fork_all():
+            return await asyncio.gather(*(fork(self.with_instruction(1, f'Client {i}')) for i in range(3)))
+
+        chat_sessions = asyncio.run(fork_all())
+        self.assertEqual(forker.prefixes_run, 1)
+        self.assertEqual(forker.forks, 3)
+        # One shared opening turn plus three turns per fork
+        self.assertEqual(metrics.summary()['models']['fake/gpt-3.5-turbo-1106']['turns'], 1 + 3 * 3)
+        for chat_session in chat_sessions:
+            self.assertEqual(chat_session.status, 'completed_successfully')
+            self.assertEqual([message.sender.name for message in chat_session.chat_history],
+                             ['AI Agent 1', 'AI Agent 2', 'AI Agent 1', 'AI Agent 2'])
+        self.assertEqual(len({chat_session.chat_history[0].timestamp for chat_session in chat_sessions}), 1)
+
+    def test_failed_prefix_is_conducted_again(self):
+        class FailingOnceProvider(FakeProvider):
+            def __init__(self):
+                super().__init__(seed=0)
+                self.failed = False
+
+            async def complete(self, messages, llm_api_params):
+                if not self.failed:
+                    self.failed = True
+                    raise ProviderError('Server down', status_code=503)
+                return await super().complete(messages, llm_api_params)
+
+        registry = patch.dict('llm_eval.providers._providers')
+        registry.start()
+        self.addCleanup(registry.stop)
+        register_provider('failing_once', FailingOnceProvider())
+        party_conf_dict = copy.deepcopy(self.party_conf_dict)
+        for attendee in party_conf_dict['attendees']:
+            attendee['llm_api'] = 'failing_once'
+            attendee['llm_api_params'].update(retries=0, sleep_period=0)
+        forker = PrefixForker(SessionEngine(), ForkConf({'prefix_turns': 1}))
+
+        with self.assertRaises(ProviderError):
+            asyncio.run(forker.get_prefix(party_conf_dict, 0))
+        _, snapshot = asyncio.run(forker.get_prefix(party_conf_dict, 0))
+        self.assertEqual(len(snapshot['chat_history']), 1)
+        self.assertEqual(forker.prefixes_run, 2)
+
+
+class TestRunExpSuiteWithForking(SuiteTestCase):
+    def run_suite(self, fork, engine='asyncio'):
+        self.write_exp_conf(num_rounds=2, fork=fork)
+        metrics = MetricsRecorder()
+        manifest = Manifest(self.output_dir)
+        results = run_exp_suite(self.exp_suite, False, self.output_dir, max_concurrency=4, engine=engine,
+                                manifest=manifest, metrics=metrics)
+        return results, manifest, metrics.summary()['models']['fake/gpt-3.5-turbo-1106']['turns']
+
+    def test_prefix_is_shared_by_client_variants(self):
+        results, manifest, turns = self.run_suite({'prefix_turns': 1})
+        self.assertTrue(all(result.ok for result in results))
+        # 2 agents x 2 rounds prefixes, then the second turn of each of the 12 sessions
+        self.assertEqual(turns, 4 + 12)
+        prefix_ids = {(record['init_instr_list'][0], record['round_index']): record['fork']['prefix_id']
+                      for record in manifest.units.values()}
+        self.assertEqual(len(set(prefix_ids.values())), 4)
+        self.assertEqual(len(manifest), 12)
+
+    def test_prefix_shared_across_rounds(self):
+        _, manifest, turns = self.run_suite({'prefix_turns': 1, 'share_across_rounds': True})
+        self.assertEqual(turns, 2 + 12)
+        self.assertEqual(len({record['fork']['prefix_id'] for record in manifest.units.values()}), 2)
+
+    def test_fork_requires_asyncio_engine(self):
+        with self.assertRaises(ValueError):
+            self.run_suite({'prefix_turns': 1}, engine='threads')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import time
+import random
+import asyncio
+import unittest
+from unittest.mock import patch
+import yaml
+from llm_eval.engine import SessionEngine
+from llm_eval.latency import DeadlineExceeded, LatencyTracker, TailLatencyConf, call_hedged
+from llm_eval.metrics import MetricsRecorder
+from llm_eval.providers import Completion, ProviderError, register_provider
+
+MESSAGES = [{'role': 'system', 'content': 'hi'}]
+
+
+class ScriptedProvider:
+    """Answers the i-th call after the i-th of `latencies` seconds; the last latency repeats."""
+
+    def __init__(self, latencies):
+        self.latencies = latencies
+        self.calls = 0
+
+    async def complete(self, messages, llm_api_params):
+        latency = self.latencies[min(self.calls, len(self.latencies) - 1)]
+        self.calls += 1
+        await asyncio.sleep(latency)
+        return Completion(f'answer after {latency}')
+
+
+class TestTailLatencyConf(unittest.TestCase):
+    def test_invalid_conf(self):
+        for conf in ({'attempt_timeout': 0}, {'hedge_after': 'p100'}, {'hedge_after': 'fast'},
+                     {'hedge_min_samples': 0}, {'deadline': 1}):
+            with self.assertRaises(ValueError):
+                TailLatencyConf(conf)
+
+    def test_backoff_is_jittered_and_capped(self):
+        conf = TailLatencyConf({'backoff_base': 0.1, 'backoff_max': 0.5})
+        rng = random.Random(0)
+        delays = [conf.backoff(attempt, rng) for attempt in range(10) for _ in range(20)]
+        self.assertTrue(all(0 <= delay <= 0.5 for delay in delays[:20 * 3]))
+        self.assertTrue(all(delay <= 0.1 for delay in delays[:20]))
+        self.assertGreater(len(set(delays)), 100)
+
+    def test_percentile_hedging_needs_samples(self):
+        conf = TailLatencyConf({'hedge_after': 'p95', 'hedge_min_samples': 10})
+        tracker = LatencyTracker()
+        for i in range(9):
+            tracker.add('api', 'model', i / 100)
+        self.assertIsNone(tracker.hedge_delay('api', 'model', conf))
+        tracker.add('api', 'model', 1.0)
+        self.assertEqual(tracker.hedge_delay('api', 'model', conf), 1.0)
+        self.assertEqual(tracker.hedge_delay('api', 'model', TailLatencyConf({'hedge_after': 0.2})), 0.2)
+        self.assertIsNone(tracker.hedge_delay('api', 'model', TailLatencyConf({})))
+
+
+class TestCallHedged(unittest.TestCase):
+    def test_first_answer_wins(self):
+        provider = ScriptedProvider([1.0, 0.0])
+        start = time.perf_counter()
+        completion = asyncio.run(call_hedged(lambda: provider.complete(MESSAGES, {}), 0.02))
+        self.assertEqual(completion.text, 'answer after 0.0')
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+    def test_failure_of_one_call_waits_for_the_other(self):
+        async def fail():
+            await asyncio.sleep(0.05)
+            raise ProviderError('failed', status_code=500)
+
+        async def answer():
+            await asyncio.sleep(0.1)
+            return 'answer'
+
+        self.assertEqual(asyncio.run(call_hedged(fail, 0.01, answer)), 'answer')
+        with self.assertRaises(ProviderError):
+            asyncio.run(call_hedged(fail, 0.01))
+
+
+class TestEngineTailLatency(unittest.TestCase):
+    def complete(self, engine, llm_api, provider, tail_latency, retries=0):
+        registry = patch.dict('llm_eval.providers._providers')
+        registry.start()
+        self.addCleanup(registry.stop)
+        register_provider(llm_api, provider)
+        return asyncio.run(engine.complete(llm_api, MESSAGES, {'model': 'm'}, retries=retries,
+                                           tail_latency=TailLatencyConf(tail_latency)))
+
+    def test_slow_attempt_is_hedged(self):
+        metrics = MetricsRecorder()
+        engine = SessionEngine(metrics=metrics)
+        completion = self.complete(engine, 'hedged', ScriptedProvider([5.0, 0.0]), {'hedge_after': 0.02})
+        self.assertEqual(completion.text, 'answer after 0.0')
+        self.assertEqual(engine.hedges, 1)
+        self.assertEqual(metrics.summary()['models']['hedged/m']['hedges'], 1)
+
+    def test_timed_out_attempt_is_retried(self):
+        metrics = MetricsRecorder()
+        engine = SessionEngine(metrics=metrics)
+        completion = self.complete(engine, 'timeout', ScriptedProvider([5.0, 0.0]),
+                                   {'attempt_timeout': 0.02, 'backoff_base': 0.01}, retries=1)
+        self.assertEqual(completion.text, 'answer after 0.0')
+        model = metrics.summary()['models']['timeout/m']
+        self.assertEqual((model['timeouts'], model['retries']), (1, 1))
+        self.assertEqual(model['errors'], {'TimeoutError': 1})
+
+    def test_turn_deadline(self):
+        engine = SessionEngine()
+        start = time.perf_counter()
+        with self.assertRaises(DeadlineExceeded):
+            self.complete(engine, 'deadline', ScriptedProvider([5.0]), {'attempt_timeout': 0.03, 'turn_deadline': 0.1},
+                          retries=100)
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertGreaterEqual(engine.timeouts, 2)
+
+    def test_session_deadline(self):
+        with open('tests/data/test_fake_party_conf.yaml', 'r') as file:
+            party_conf_dict = yaml.safe_load(file)
+        party_conf_dict['settings'] = {'max_sent_message': 10, 'session_deadline': 0.1}
+        for attendee in party_conf_dict['attendees']:
+            attendee['llm_api_params']['latency'] = 0.03
+        engine = SessionEngine()
+        with self.assertRaises(DeadlineExceeded):
+            asyncio.run(engine.run_session(party_conf_dict))
+        self.assertEqual(engine.session_timeouts, 1)
+
+    def test_attempt_timeout_is_not_a_session_timeout(self):
+        with open('tests/data/test_fake_party_conf.yaml', 'r') as file:
+            party_conf_dict = yaml.safe_load(file)
+        party_conf_dict['settings'] = {'max_sent_message': 2, 'session_deadline': 30}
+        for attendee in party_conf_dict['attendees']:
+            attendee['llm_api_params'].update(latency=5.0, retries=0)
+            attendee['attendee_params'] = {'tail_latency': {'attempt_timeout': 0.05}}
+        engine = SessionEngine()
+        start = time.perf_counter()
+        with self.assertRaises(TimeoutError) as context:
+            asyncio.run(engine.run_session(party_conf_dict))
+        self.assertNotIsInstance(context.exception, DeadlineExceeded)
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual((engine.timeouts, engine.session_timeouts), (1, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
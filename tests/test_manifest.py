@@ -0,0 +1,65 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from llm_eval.manifest import MANIFEST_FILE_NAME, MANIFEST_LOG_FILE_NAME, Manifest, unit_key
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_unit_key_is_stable_and_distinct(self):
+        key = unit_key('Suite', ('a.md', 'b.md'), ('1', '2'), 0)
+        self.assertEqual(key, unit_key('Suite', ['a.md', 'b.md'], ['1', '2'], 0))
+        self.assertNotEqual(key, unit_key('Suite', ('a.md', 'b.md'), ('1', '2'), 1))
+        self.assertNotEqual(key, unit_key('Other', ('a.md', 'b.md'), ('1', '2'), 0))
+        # An edited instruction file has another digest
+        self.assertNotEqual(key, unit_key('Suite', ('a.md', 'b.md'), ('1', '3'), 0))
+
+    def test_mark_complete_persists(self):
+        manifest = Manifest(self.output_dir)
+        manifest.mark_complete('key1', {'round_index': 0, 'files': ['chat_history_x.json']})
+
+        reloaded = Manifest(self.output_dir)
+        self.assertTrue(reloaded.is_complete('key1'))
+        self.assertFalse(reloaded.is_complete('key2'))
+        self.assertEqual(reloaded.get('key1')['files'], ['chat_history_x.json'])
+        self.assertEqual(os.listdir(self.output_dir), [MANIFEST_LOG_FILE_NAME])
+
+        manifest.close()
+        self.assertTrue(Manifest(self.output_dir).is_complete('key1'))
+        # The log is compacted and no temporary files are left behind
+        self.assertEqual(os.listdir(self.output_dir), [MANIFEST_FILE_NAME])
+
+    def test_torn_log_line_is_skipped(self):
+        manifest = Manifest(self.output_dir)
+        manifest.mark_complete('key1', {'round_index': 0})
+        manifest.mark_complete('key2', {'round_index': 1})
+        manifest._log.close()
+        # A crash while the second unit was appended
+        with open(manifest.log_path, 'r+') as file:
+            file.truncate(os.path.getsize(manifest.log_path) - 10)
+
+        reloaded = Manifest(self.output_dir)
+        self.assertEqual(list(reloaded.units), ['key1'])
+        reloaded.mark_complete('key3', {'round_index': 2})
+        self.assertEqual(list(Manifest(self.output_dir).units), ['key1', 'key3'])
+
+    def test_recording_a_unit_does_not_rewrite_the_manifest(self):
+        manifest = Manifest(self.output_dir)
+        manifest.record_plan('Suite', {'num_combinations': 1000, 'num_rounds': 1})
+        for i in range(1000):
+            manifest.mark_complete(f'key{i}', {'round_index': 0})
+        with open(manifest.path, 'r') as file:
+            self.assertEqual(json.load(file)['units'], {})
+        manifest.close()
+        self.assertEqual(len(Manifest(self.output_dir)), 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
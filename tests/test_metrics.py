@@ -0,0 +1,77 @@
+import json
+import asyncio
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+from llm_eval.engine import SessionEngine
+from llm_eval.metrics import MetricsRecorder, percentile
+from llm_eval.providers import Completion, ProviderError, register_provider
+
+
+class FailingOnceProvider:
+    def __init__(self):
+        self.calls = 0
+
+    async def complete(self, messages, llm_api_params):
+        self.calls += 1
+        if self.calls == 1:
+            raise ProviderError('Service unavailable', status_code=503)
+        return Completion('ok', prompt_tokens=10, completion_tokens=2)
+
+
+class TestMetricsRecorder(unittest.TestCase):
+    def test_percentile(self):
+        samples = [float(i) for i in range(1, 101)]
+        self.assertEqual(percentile(samples, 0.5), 50.0)
+        self.assertEqual(percentile(samples, 0.95), 95.0)
+        self.assertEqual(percentile(samples, 0.99), 99.0)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_engine_records_turns_retries_and_errors(self):
+        # Restore the process-wide provider registry after the test
+        registry = patch.dict('llm_eval.providers._providers')
+        registry.start()
+        self.addCleanup(registry.stop)
+        register_provider('failing_once', FailingOnceProvider())
+        metrics = MetricsRecorder()
+        engine = SessionEngine(metrics=metrics)
+        asyncio.run(engine.complete('failing_once', [{'role': 'system', 'content': 'hi'}], {'model': 'm1'}, retries=1))
+
+        model = metrics.summary()['models']['failing_once/m1']
+        self.assertEqual(model['turns'], 1)
+        self.assertEqual(model['retries'], 1)
+        self.assertEqual(model['errors'], {'ProviderError:503': 1})
+        self.assertEqual(model['prompt_tokens'], 10)
+        self.assertEqual(model['completion_tokens'], 2)
+        self.assertIsNotNone(model['turn_seconds']['p99'])
+
+    def test_write_prometheus_and_summary(self):
+        metrics = MetricsRecorder()
+        for seconds in (0.1, 0.2, 0.3):
+            metrics.on_turn('openai', 'gpt-4', seconds, provider_seconds=seconds, prompt_tokens=5, completion_tokens=1)
+        metrics.on_round('Suite "1"', 0.6, 3)
+        with metrics.stage('compile'):
+            pass
+
+        output_dir = tempfile.mkdtemp()
+        try:
+            metrics_path, summary_path = metrics.write(output_dir)
+            with open(metrics_path, 'r') as file:
+                text = file.read()
+            with open(summary_path, 'r') as file:
+                summary = json.load(file)
+        finally:
+            shutil.rmtree(output_dir)
+
+        self.assertIn('# TYPE llm_eval_turn_seconds summary', text)
+        self.assertIn('llm_eval_turn_seconds{llm_api="openai",model="gpt-4",quantile="0.5"} 0.2', text)
+        self.assertIn('llm_eval_turn_seconds_count{llm_api="openai",model="gpt-4"} 3', text)
+        self.assertIn('llm_eval_prompt_tokens_total{llm_api="openai",model="gpt-4"} 15', text)
+        self.assertIn('llm_eval_rounds_total{suite="Suite \\"1\\"",status="ok"} 1', text)
+        self.assertEqual(summary['models']['openai/gpt-4']['turn_seconds']['p95'], 0.3)
+        self.assertIn('compile', summary['stage_seconds'])
+
+
+if __name__ == '__main__':
+    unittest.main()
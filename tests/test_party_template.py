@@ -0,0 +1,43 @@
+import unittest
+import yaml
+from llm_eval.party_template import PartyTemplate
+
+
+class TestPartyTemplate(unittest.TestCase):
+    def setUp(self):
+        self.template = PartyTemplate.from_file('tests/data/test_party_conf.yaml')
+        with open('tests/data/test_party_conf.yaml', 'r') as file:
+            self.party_conf_dict = yaml.safe_load(file)
+
+    def test_render_patches_only_instruction_texts(self):
+        rendered = self.template.render(['Instruction 1', 'Instruction 2'])
+        self.assertEqual(rendered['attendees'][0]['instruction']['text'], 'Instruction 1')
+        self.assertEqual(rendered['attendees'][1]['instruction']['text'], 'Instruction 2')
+        # Apart from the texts, the rendered configuration equals the parsed file
+        for i, attendee in enumerate(rendered['attendees']):
+            self.party_conf_dict['attendees'][i]['instruction']['text'] = attendee['instruction']['text']
+        self.assertEqual(rendered, self.party_conf_dict)
+
+    def test_render_does_not_modify_the_template(self):
+        first = self.template.render(['A1', 'A2'])
+        second = self.template.render(['B1', 'B2'])
+        self.assertEqual(first['attendees'][0]['instruction']['text'], 'A1')
+        self.assertEqual(second['attendees'][0]['instruction']['text'], 'B1')
+        self.assertEqual(self.template.party_conf_dict['attendees'][0]['instruction']['text'],
+                         'Behave as a product owner to increase user engagement')
+
+    def test_attendee_count_mismatch(self):
+        with self.assertRaises(ValueError):
+            self.template.render(['Only one instruction'])
+        with self.assertRaises(ValueError):
+            self.template.render(['1', '2', '3'])
+
+    def test_invalid_party_conf(self):
+        with self.assertRaises(ValueError):
+            PartyTemplate({'attendees': []})
+        with self.assertRaises(ValueError):
+            PartyTemplate({'attendees': [{'name': 'No instruction'}]})
+
+
+if __name__ == '__main__':
+    unittest.main()
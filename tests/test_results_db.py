@@ -0,0 +1,100 @@
+import os
+import copy
+import asyncio
+import hashlib
+import shutil
+import tempfile
+import unittest
+import yaml
+from unittest.mock import patch
+from llm_eval.engine import SessionEngine
+from llm_eval.manifest import unit_key
+from llm_eval.results_db import RESULTS_DB_FILE_NAME, ResultsDatabase, SqliteSink
+from llm_eval.service import conduct_chat_session
+from llm_eval.sink import make_sink
+
+
+class TestResultsDatabase(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        with open('tests/data/test_fake_party_conf.yaml', 'r') as file:
+            self.party_conf_dict = yaml.safe_load(file)
+        self.chat_session = asyncio.run(SessionEngine().run_session(self.party_conf_dict))
+        self.sink = SqliteSink(self.output_dir)
+
+    def tearDown(self):
+        self.sink.close()
+        shutil.rmtree(self.output_dir)
+
+    def metadata(self, combination_index, round_index):
+        return {'suite': 'Suite', 'combination_index': combination_index, 'round_index': round_index,
+                'init_instr_list': [f'agents/{combination_index}.md', 'clients/0.md']}
+
+    def party_conf_with_model(self, model):
+        party_conf_dict = copy.deepcopy(self.party_conf_dict)
+        for attendee in party_conf_dict['attendees']:
+            attendee['llm_api_params']['model'] = model
+        return party_conf_dict
+
+    def test_query_by_indexed_columns(self):
+        self.assertEqual(self.sink.write_round(self.metadata(0, 0), self.chat_session, self.party_conf_dict),
+                         [RESULTS_DB_FILE_NAME])
+        self.sink.write_round(self.metadata(0, 1), self.chat_session, self.party_conf_with_model('other-model'))
+        self.sink.write_round(self.metadata(1, 0), self.chat_session, self.party_conf_dict)
+        database = self.sink.database
+
+        rounds = list(database.query_rounds(model='gpt-3.5-turbo-1106', min_turns=2))
+        self.assertEqual([(r['combination_index'], r['round_index']) for r in rounds], [(0, 0), (1, 0)])
+        self.assertEqual(rounds[0]['models'], ['fake/gpt-3.5-turbo-1106', 'fake/gpt-3.5-turbo-1106'])
+        self.assertEqual(rounds[0]['status'], 'completed_successfully')
+        self.assertEqual(list(database.query_rounds(min_turns=3)), [])
+        self.assertEqual(len(list(database.query_rounds(llm_api='fake', round_index=0, limit=1))), 1)
+
+        digest = hashlib.sha256(self.party_conf_dict['attendees'][0]['instruction']['text'].encode('utf-8')).hexdigest()
+        self.assertEqual(len(list(database.query_rounds(instruction_digest=digest[:8]))), 3)
+
+        exported = next(database.query_rounds(round_index=1, with_chat_session=True))
+        self.assertEqual(exported['party_conf']['attendees'][0]['llm_api_params']['model'], 'other-model')
+        self.assertEqual(len(exported['chat_session']['chat_history']), 2)
+
+    def test_unit_conducted_again_replaces_its_row(self):
+        self.sink.write_round(self.metadata(0, 0), self.chat_session, self.party_conf_dict)
+        self.sink.write_round(self.metadata(0, 0), self.chat_session, self.party_conf_with_model('other-model'))
+        rounds = list(self.sink.database.query_rounds())
+        self.assertEqual(len(rounds), 1)
+        self.assertEqual(rounds[0]['models'], ['fake/other-model', 'fake/other-model'])
+
+    def test_copy_rounds(self):
+        self.sink.write_round(self.metadata(0, 0), self.chat_session, self.party_conf_dict)
+        self.sink.write_round(self.metadata(1, 0), self.chat_session, self.party_conf_dict)
+        target = ResultsDatabase(os.path.join(self.output_dir, 'merged.sqlite'))
+        digests = [hashlib.sha256(attendee['instruction']['text'].encode('utf-8')).hexdigest()
+                   for attendee in self.party_conf_dict['attendees']]
+        keys = {unit_key('Suite', self.metadata(1, 0)['init_instr_list'], digests, 0)}
+        self.assertEqual(target.copy_rounds(self.sink.database.path, keys), 1)
+        self.assertEqual([r['combination_index'] for r in target.query_rounds()], [1])
+        target.close()
+
+    def test_conduct_chat_session(self):
+        with patch('llm_eval.service.start_session') as mock_start_session:
+            mock_start_session.return_value = self.chat_session, ""
+            conduct_chat_session(self.party_conf_dict, {'num_rounds': 2}, self.output_dir, False, sink=self.sink)
+            conduct_chat_session(self.party_conf_dict, {'num_rounds': 1}, self.output_dir, False, sink=self.sink,
+                                 metadata={'suite': 'Suite', 'init_instr_list': ['agents/0.md', 'clients/0.md']})
+        rounds = list(self.sink.database.query_rounds())
+        self.assertEqual([(r['suite'], r['round_index']) for r in rounds], [('', 0), ('', 1), ('Suite', 0)])
+        self.assertEqual(rounds[2]['metadata']['init_instr_list'], ['agents/0.md', 'clients/0.md'])
+        # The duration is the measured round time, not the difference of the one-second timestamps
+        self.assertTrue(all(r['duration_seconds'] == r['metadata']['round_seconds'] for r in rounds))
+        self.assertLess(rounds[0]['duration_seconds'], 1)
+
+    def test_make_sink(self):
+        sink = make_sink(self.output_dir, 'sqlite')
+        self.assertIsInstance(sink, SqliteSink)
+        sink.close()
+        with self.assertRaises(ValueError):
+            make_sink(self.output_dir, 'sqlite', compression='gzip')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import signal
+import threading
+import time
+import unittest
+from llm_eval.runner import run_jobs
+
+
+class TestRunJobs(unittest.TestCase):
+    def test_results_and_progress_are_in_submission_order(self):
+        messages = []
+        # Later jobs finish first
+        results = run_jobs([0.03, 0.02, 0.01, 0.0], lambda delay: time.sleep(delay) or delay,
+                           max_concurrency=4, output=messages.append)
+        self.assertEqual([result.value for result in results], [0.03, 0.02, 0.01, 0.0])
+        self.assertEqual([message.split(']')[0] for message in messages], ['[1/4', '[2/4', '[3/4', '[4/4'])
+
+    def test_jobs_are_pulled_from_a_generator(self):
+        pulled = []
+
+        def jobs():
+            for job in range(10):
+                pulled.append(job)
+                yield job
+
+        def func(job):
+            # Only the running jobs and the next one have been taken from the generator
+            self.assertLessEqual(len(pulled), job + 3)
+            return job
+
+        messages = []
+        results = run_jobs(jobs(), func, max_concurrency=2, output=messages.append)
+        self.assertEqual([result.value for result in results], list(range(10)))
+        self.assertEqual(messages[0].split(']')[0], '[1')
+        messages = []
+        run_jobs(iter([0, 1]), func, output=messages.append, total=2)
+        self.assertEqual(messages[0].split(']')[0], '[1/2')
+
+    def test_failing_job_is_isolated(self):
+        def func(job):
+            if job == 2:
+                raise RuntimeError('boom')
+            return job * 10
+
+        results = run_jobs([1, 2, 3], func, max_concurrency=2, output=None)
+        self.assertEqual([result.ok for result in results], [True, False, True])
+        self.assertEqual(results[0].value, 10)
+        self.assertEqual(results[2].value, 30)
+        self.assertIsInstance(results[1].error, RuntimeError)
+
+    def test_concurrency_is_bounded(self):
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+
+        def func(job):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+
+        run_jobs(list(range(10)), func, max_concurrency=3, output=None)
+        self.assertLessEqual(peak[0], 3)
+
+    def test_interrupt_lets_the_running_job_finish(self):
+        finished = []
+
+        def func(job):
+            if job == 0:
+                # Ctrl-C while the first job is running and the main thread waits for it
+                time.sleep(0.02)
+                signal.pthread_kill(threading.main_thread().ident, signal.SIGINT)
+                time.sleep(0.05)
+            finished.append(job)
+
+        with self.assertRaises(KeyboardInterrupt):
+            run_jobs([0, 1, 2], func, max_concurrency=1, output=None)
+        self.assertEqual(finished, [0])
+
+    def test_invalid_max_concurrency(self):
+        with self.assertRaises(ValueError):
+            run_jobs([1], lambda job: job, max_concurrency=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+import os
+import json
+import asyncio
+import unittest
+from unittest.mock import patch
+from llm_party.model.session_models import ChatSession
+from llm_eval.cache import ResponseCache
+from llm_eval.controller import run_exp_suite
+from llm_eval.manifest import Manifest
+from llm_eval.metrics import MetricsRecorder
+from llm_eval.scoring import SCOREBOARD_FILE_NAME, Scorer, ScoringConf, ScoringPipeline, build_scoreboard
+from llm_eval.sink import JsonlSink
+from tests.helpers import SuiteTestCase
+
+
+def failing_rule(chat_session, metadata):
+    raise RuntimeError('cannot score')
+
+
+class TestScoringConf(unittest.TestCase):
+    def test_invalid_conf(self):
+        for conf in ({}, {'rules': ['no_such_metric']}, {'rules': ['turn_count'], 'queue_size': 0},
+                     {'judge': {'llm_api': 'fake'}}, {'judge': {'llm_api': 'fake', 'instruction': 'Rate', 'model': 'x'}},
+                     {'rules': ['turn_count'], 'judge': {'llm_api': 'fake', 'instruction': 'Rate', 'name': 'turn_count'}}):
+            with self.assertRaises(ValueError):
+                ScoringConf(conf)
+
+    def test_build_scoreboard(self):
+        records = [
+            {'suite': 'S', 'combination_index': 1, 'init_instr_list': ['a', 'b'], 'scores': {'judge': 6.0}},
+            {'suite': 'S', 'combination_index': 1, 'init_instr_list': ['a', 'b'], 'scores': {'judge': 8.0}},
+            {'suite': 'S', 'combination_index': 0, 'init_instr_list': ['a', 'c'], 'scores': {'judge': None}},
+            {'suite': 'S', 'combination_index': 0, 'init_instr_list': ['a', 'c']},
+        ]
+        scoreboard = build_scoreboard(records)
+        self.assertEqual(scoreboard['S']['scores'], ['judge'])
+        first, second = scoreboard['S']['combinations']
+        self.assertEqual((first['combination_index'], first['rounds'], first['scores']['judge']['count']), (0, 1, 0))
+        self.assertEqual(second['scores']['judge']['mean'], 7.0)
+        self.assertEqual((second['scores']['judge']['min'], second['scores']['judge']['max']), (6.0, 8.0))
+        self.assertGreater(second['scores']['judge']['ci95'], 0)
+
+
+class TestScoringPipeline(unittest.TestCase):
+    def test_queue_is_bounded_and_errors_are_kept(self):
+        scored = []
+
+        class SlowScorer(Scorer):
+            async def score(self, chat_session, metadata):
+                await asyncio.sleep(0.02)
+                return {'value': metadata['value']}, {}
+
+        def on_scored(item, scores, score_errors):
+            if item == 'bad':
+                raise ValueError('cannot write')
+            scored.append(item)
+
+        async def run():
+            conf = ScoringConf({'rules': ['turn_count'], 'queue_size': 1, 'concurrency': 1})
+            async with ScoringPipeline(SlowScorer(conf), on_scored) as pipeline:
+                for item in ('a', 'bad', 'b', 'c'):
+                    await pipeline.submit(item, None, {'value': 1})
+                # At most one session waits in the queue while another is scored
+                self.assertLessEqual(len(scored), 4 - 2)
+            return pipeline
+
+        pipeline = asyncio.run(run())
+        self.assertEqual(scored, ['a', 'b', 'c'])
+        self.assertIsInstance(pipeline.errors['bad'], ValueError)
+
+    def test_session_is_handed_over_when_scoring_fails(self):
+        handed_over = {}
+
+        class BrokenScorer(Scorer):
+            async def score(self, chat_session, metadata):
+                raise RuntimeError('broken scorer')
+
+        async def run():
+            conf = ScoringConf({'rules': ['turn_count']})
+            async with ScoringPipeline(BrokenScorer(conf), lambda item, *scores: handed_over.update({item: scores})) as pipeline:
+                await pipeline.submit('a', None, {})
+            return pipeline
+
+        pipeline = asyncio.run(run())
+        self.assertEqual(handed_over, {'a': (None, None)})
+        self.assertIsInstance(pipeline.errors['a'], RuntimeError)
+
+    def test_interrupted_pipeline_hands_over_unscored_sessions(self):
+        handed_over = {}
+
+        class BlockingScorer(Scorer):
+            async def score(self, chat_session, metadata):
+                await asyncio.sleep(10)
+
+        async def run():
+            conf = ScoringConf({'rules': ['turn_count'], 'queue_size': 2, 'concurrency': 1})
+            pipeline = ScoringPipeline(BlockingScorer(conf), lambda item, *scores: handed_over.update({item: scores}))
+            with self.assertRaises(KeyboardInterrupt):
+                async with pipeline:
+                    for item in ('a', 'b', 'c'):
+                        await pipeline.submit(item, None, {})
+                    await asyncio.sleep(0.01)
+                    raise KeyboardInterrupt
+
+        asyncio.run(run())
+        # 'a' was being scored, 'b' and 'c' were queued
+        self.assertEqual(handed_over, {'a': (None, None), 'b': (None, None), 'c': (None, None)})
+
+
+class TestScoredSuite(SuiteTestCase):
+    def write_scoring_conf(self, scoring):
+        self.write_exp_conf(num_rounds=2, scoring=scoring)
+
+    def test_sessions_are_scored_while_generation_continues(self):
+        self.write_scoring_conf({
+            'rules': ['turn_count', 'mean_message_chars'],
+            # The fake provider replies 'Response 2 of judge' to the judge's two messages
+            'judge': {'llm_api': 'fake', 'llm_api_params': {'model': 'judge'}, 'instruction': 'Rate from 1 to 10.'},
+            'queue_size': 2,
+        })
+        manifest = Manifest(self.output_dir)
+        metrics = MetricsRecorder()
+        sink = JsonlSink(self.output_dir)
+        cache = ResponseCache(os.path.join(self.work_dir, 'cache'))
+        results = run_exp_suite(self.exp_suite, False, self.output_dir, max_concurrency=4, engine='asyncio',
+                                cache=cache, manifest=manifest, sink=sink, metrics=metrics)
+        sink.close()
+        self.assertTrue(all(result.ok for result in results))
+
+        self.assertEqual(len(manifest), 12)
+        for record in manifest.units.values():
+            self.assertEqual(record['scores']['turn_count'], 2.0)
+            self.assertEqual(record['scores']['judge'], 2.0)
+        with open(os.path.join(self.output_dir, 'results.jsonl')) as file:
+            rounds = [record for record in map(json.loads, file) if record['type'] == 'round']
+        self.assertTrue(all(record['scores']['judge'] == 2.0 for record in rounds))
+        # Every session has the same transcript, so the judge answers most of them from the cache
+        judge = metrics.summary()['models']['fake/judge']
+        self.assertEqual(judge['turns'] + judge['cache_hits'], 12)
+        self.assertGreater(judge['cache_hits'], 0)
+
+        with open(os.path.join(self.output_dir, SCOREBOARD_FILE_NAME)) as file:
+            scoreboard = json.load(file)['Suite']
+        self.assertEqual(scoreboard['scores'], ['judge', 'mean_message_chars', 'turn_count'])
+        self.assertEqual(len(scoreboard['combinations']), 6)
+        self.assertEqual(scoreboard['combinations'][0]['scores']['judge'],
+                         {'count': 2, 'mean': 2.0, 'ci95': 0.0, 'min': 2.0, 'max': 2.0})
+
+    def test_resume_scores_unscored_rounds(self):
+        self.write_scoring_conf({'rules': ['turn_count']})
+        run_exp_suite(self.exp_suite, False, self.output_dir, engine='asyncio', manifest=Manifest(self.output_dir))
+        # As written by an interrupted run for a session that was still waiting for scoring
+        manifest = Manifest(self.output_dir)
+        key, record = next(iter(manifest.units.items()))
+        del record['scores']
+        manifest.mark_complete(key, dict(record, unscored=True))
+
+        manifest = Manifest(self.output_dir)
+        results = run_exp_suite(self.exp_suite, False, self.output_dir, engine='asyncio', manifest=manifest,
+                                resume=True)
+        self.assertEqual([result.job.unit_key for result in results], [key])
+        self.assertEqual(manifest.get(key)['scores'], {'turn_count': 2.0})
+        self.assertNotIn('unscored', manifest.get(key))
+
+    def test_failing_rule_does_not_lose_the_session(self):
+        self.write_scoring_conf({'rules': ['turn_count', 'tests.test_scoring:failing_rule']})
+        for engine in ('asyncio', 'threads'):
+            output_dir = os.path.join(self.work_dir, engine)
+            os.makedirs(output_dir)
+            manifest = Manifest(output_dir)
+            with patch('llm_eval.service.start_session') as mock_start_session:
+                mock_start_session.return_value = ChatSession(), ""
+                results = run_exp_suite(self.exp_suite, False, output_dir, engine=engine, manifest=manifest)
+            self.assertTrue(all(result.ok for result in results))
+            self.assertEqual(len(manifest), 12)
+            for record in manifest.units.values():
+                self.assertIsNone(record['scores']['tests.test_scoring:failing_rule'])
+                self.assertEqual(record['score_errors'], {'tests.test_scoring:failing_rule': 'RuntimeError: cannot score'})
+
+    def test_threads_engine_scores_rules(self):
+        self.write_scoring_conf({'rules': ['turn_count']})
+        with patch('llm_eval.service.start_session') as mock_start_session:
+            mock_start_session.return_value = ChatSession(), ""
+            results = run_exp_suite(self.exp_suite, False, self.output_dir, max_concurrency=2)
+        self.assertTrue(all(result.ok for result in results))
+        # Scores are written next to the chat history of each round
+        score_files = sorted(name for name in os.listdir(self.output_dir) if name.startswith('scores_'))
+        self.assertEqual(len(score_files), 12)
+        with open(os.path.join(self.output_dir, score_files[0])) as file:
+            self.assertEqual(json.load(file), {'scores': {'turn_count': 0.0}})
+        with open(os.path.join(self.output_dir, SCOREBOARD_FILE_NAME)) as file:
+            scoreboard = json.load(file)['Suite']
+        self.assertEqual(scoreboard['combinations'][0]['scores']['turn_count']['mean'], 0.0)
+
+    def test_judge_requires_the_asyncio_engine(self):
+        self.write_scoring_conf({'judge': {'llm_api': 'fake', 'instruction': 'Rate from 1 to 10.'}})
+        with self.assertRaises(ValueError):
+            run_exp_suite(self.exp_suite, False, self.output_dir, engine='threads')
+
+
+if __name__ == '__main__':
+    unittest.main()
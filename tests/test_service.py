@@ -1,4 +1,6 @@
 import os
+import shutil
+import tempfile
 import yaml
 import unittest
 import unittest
@@ -55,11 +57,11 @@ class TestChatSession(unittest.TestCase):
         # Check if the correct number of rounds were conducted
         self.assertEqual(mock_start_session.call_count, 2)
 
-        # Check if the chat history and party configuration files were created
+        # Check if the chat history and party configuration files of each round were created
         file_names = os.listdir(output_dir)
-        self.assertEqual(len(file_names), 2)
-        self.assertTrue(any(file_name.startswith('chat_history_') for file_name in file_names))
-        self.assertTrue(any(file_name.startswith('party_conf_') for file_name in file_names))
+        self.assertEqual(len(file_names), 4)
+        self.assertEqual(len([file_name for file_name in file_names if file_name.startswith('chat_history_')]), 2)
+        self.assertTrue(any(file_name.endswith('_r01.json') for file_name in file_names))
 
         # Clean up the test output directory
         for file_name in file_names:
@@ -87,55 +89,72 @@ class TestChatSession(unittest.TestCase):
 
 
 class TestMakeInitInstrLists(unittest.TestCase):
-    @patch('llm_eval.service.os.path.isdir')
-    @patch('llm_eval.service.os.path.exists')
-    @patch('llm_eval.service.load_instructions')
-    def test_make_init_instr_lists_success(self, mock_load_instructions, mock_exists, mock_isdir):
-        # Setup mocks to simulate existing directories
-        mock_exists.return_value = True
-        mock_isdir.return_value = True
-        # Mocking the load_instructions method to return predefined file contents
-        mock_load_instructions.side_effect = [
-            ["file11.md", "file12.md"],  # Mock return value for "path/to/dir1"
-            ["file21.md", "file22.md"]   # Mock return value for "path/to/dir2"
-        ]
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def make_dir(self, dir_name, file_names):
+        dir_path = os.path.join(self.work_dir, dir_name)
+        os.makedirs(dir_path)
+        for file_name in file_names:
+            with open(os.path.join(dir_path, file_name), 'w') as file:
+                file.write(f'Contents of {file_name}')
+        return dir_path
+
+    def test_make_init_instr_lists_success(self):
+        dir1 = self.make_dir('dir1', ["file12.md", "file11.md", ".DS_Store"])
+        dir2 = self.make_dir('dir2', ["file21.md", "file22.md"])
 
-        init_instr_dirs = ["path/to/dir1", "path/to/dir2"]
+        init_instr_dirs = [dir1, dir2]
         expected_output = [
-            ("path/to/dir1/file11.md", "path/to/dir2/file21.md"),
-            ("path/to/dir1/file11.md", "path/to/dir2/file22.md"),
-            ("path/to/dir1/file12.md", "path/to/dir2/file21.md"),
-            ("path/to/dir1/file12.md", "path/to/dir2/file22.md")
+            (f"{dir1}/file11.md", f"{dir2}/file21.md"),
+            (f"{dir1}/file11.md", f"{dir2}/file22.md"),
+            (f"{dir1}/file12.md", f"{dir2}/file21.md"),
+            (f"{dir1}/file12.md", f"{dir2}/file22.md")
         ]
 
         result = make_init_instr_lists(init_instr_dirs)
-        self.assertEqual(result, expected_output)
-
-    @patch('llm_eval.service.os.path.isdir')
-    @patch('llm_eval.service.os.path.exists')
-    @patch('llm_eval.service.load_instructions')
-    def test_make_init_instr_lists_success_with_different_file_numbers(self, mock_load_instructions, mock_exists, mock_isdir):
-        # Setup mocks to simulate existing directories
-        mock_exists.return_value = True
-        mock_isdir.return_value = True
-        # Mocking the load_instructions method to return predefined file contents
-        mock_load_instructions.side_effect = [
-            ["file11.md", "file12.md", "file13.md"],  # Mock return value for "path/to/dir1"
-            ["file21.md", "file22.md"]   # Mock return value for "path/to/dir2"
-        ]
+        self.assertEqual(list(result), expected_output)
+        self.assertEqual(result.texts(result[1]), ('Contents of file11.md', 'Contents of file22.md'))
+
+    def test_make_init_instr_lists_success_with_different_file_numbers(self):
+        dir1 = self.make_dir('dir1', ["file11.md", "file12.md", "file13.md"])
+        dir2 = self.make_dir('dir2', ["file21.md", "file22.md"])
 
-        init_instr_dirs = ["path/to/dir1", "path/to/dir2"]
+        init_instr_dirs = [dir1, dir2]
         expected_output = [
-            ("path/to/dir1/file11.md", "path/to/dir2/file21.md"),
-            ("path/to/dir1/file11.md", "path/to/dir2/file22.md"),
-            ("path/to/dir1/file12.md", "path/to/dir2/file21.md"),
-            ("path/to/dir1/file12.md", "path/to/dir2/file22.md"),
-            ("path/to/dir1/file13.md", "path/to/dir2/file21.md"),
-            ("path/to/dir1/file13.md", "path/to/dir2/file22.md"),
+            (f"{dir1}/file11.md", f"{dir2}/file21.md"),
+            (f"{dir1}/file11.md", f"{dir2}/file22.md"),
+            (f"{dir1}/file12.md", f"{dir2}/file21.md"),
+            (f"{dir1}/file12.md", f"{dir2}/file22.md"),
+            (f"{dir1}/file13.md", f"{dir2}/file21.md"),
+            (f"{dir1}/file13.md", f"{dir2}/file22.md"),
         ]
 
         result = make_init_instr_lists(init_instr_dirs)
-        self.assertEqual(result, expected_output)
+        self.assertEqual(list(result), expected_output)
+
+    def test_random_access_matches_iteration(self):
+        dirs = [self.make_dir(f'dir{i}', [f'file{j}.md' for j in range(i + 2)]) for i in range(3)]
+
+        result = make_init_instr_lists(dirs)
+        self.assertEqual(len(result), 2 * 3 * 4)
+        self.assertEqual([result[i] for i in range(len(result))], list(result))
+        self.assertEqual(result[-1], list(result)[-1])
+        self.assertEqual(result[5:8], list(result)[5:8])
+        with self.assertRaises(IndexError):
+            result[len(result)]
+
+    def test_identical_files_are_stored_once(self):
+        dir1 = self.make_dir('dir1', ["file11.md"])
+        dir2 = self.make_dir('dir2', ["file11.md"])
+
+        result = make_init_instr_lists([dir1, dir2])
+        self.assertEqual(len(result.index.store), 1)
+        digests = result.digests(result[0])
+        self.assertEqual(digests[0], digests[1])
 
     @patch('llm_eval.service.os.path.exists', return_value=False)
     def test_directory_does_not_exist_error(self, mock_exists):
@@ -143,12 +162,10 @@ class TestMakeInitInstrLists(unittest.TestCase):
             make_init_instr_lists(["non/existent/dir"])
         self.assertTrue("Directory does not exist" in str(context.exception))
 
-    @patch('llm_eval.service.os.path.exists', return_value=True)
-    @patch('llm_eval.service.os.path.isdir', return_value=True)
-    @patch('llm_eval.service.load_instructions', return_value=[])
-    def test_empty_directory_error(self, mock_load_instructions, mock_isdir, mock_exists):
+    def test_empty_directory_error(self):
+        empty_dir = self.make_dir('empty', [])
         with self.assertRaises(ValueError) as context:
-            make_init_instr_lists(["empty/dir"])
+            make_init_instr_lists([empty_dir])
         self.assertTrue("Directory is empty" in str(context.exception))
 
     # Additional tests can be added for other error conditions, such as inconsistent file counts.
@@ -0,0 +1,95 @@
+import os
+import json
+import unittest
+from llm_eval.controller import run_exp_suite
+from llm_eval.manifest import Manifest
+from llm_eval.merge import merge_outputs
+from llm_eval.shard import Shard, shard_of
+from llm_eval.results_db import RESULTS_DB_FILE_NAME, ResultsDatabase
+from llm_eval.sink import JsonlSink, make_sink
+from tests.helpers import SuiteTestCase
+
+
+class TestShard(unittest.TestCase):
+    def test_parse(self):
+        shard = Shard.parse('1/4')
+        self.assertEqual((shard.index, shard.count), (1, 4))
+        self.assertEqual(str(shard), '1/4')
+        for spec in ('4/4', '1', 'a/b', '0/0'):
+            with self.assertRaises(ValueError):
+                Shard.parse(spec)
+
+    def test_shards_partition_the_units(self):
+        units = [('Suite', combination_index, round_index) for combination_index in range(50) for round_index in range(3)]
+        shards = [Shard(index, 3) for index in range(3)]
+        for unit in units:
+            self.assertEqual(sum(shard.includes(*unit) for shard in shards), 1)
+        # Every shard gets some of the work
+        self.assertTrue(all(any(shard.includes(*unit) for unit in units) for shard in shards))
+
+    def test_shard_of_is_stable(self):
+        self.assertEqual(shard_of('Suite', 3, 1, 1000), shard_of('Suite', 3, 1, 1000))
+        self.assertEqual(shard_of('Suite', 0, 0, 1), 0)
+
+
+class TestMergeOutputs(SuiteTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_exp_conf(num_rounds=2)
+
+    def run_shard(self, spec, jsonl=False, result_format=None):
+        output_dir = os.path.join(self.work_dir, 'shard' + spec.replace('/', '_'))
+        os.makedirs(output_dir)
+        sink = JsonlSink(output_dir) if jsonl else make_sink(output_dir, result_format) if result_format else None
+        run_exp_suite(self.exp_suite, False, output_dir, engine='asyncio', manifest=Manifest(output_dir), sink=sink,
+                      shard=Shard.parse(spec))
+        if sink is not None:
+            sink.close()
+        return output_dir
+
+    def test_merge_files_of_all_shards(self):
+        shard_dirs = [self.run_shard('0/2'), self.run_shard('1/2')]
+        merged_dir = os.path.join(self.work_dir, 'merged')
+        report = merge_outputs(shard_dirs, merged_dir)
+
+        # 2 x 3 combinations, 2 rounds each
+        self.assertEqual(report.merged_units, 12)
+        self.assertEqual(report.missing_units, [])
+        self.assertEqual(len(Manifest(merged_dir)), 12)
+        self.assertEqual(len([name for name in os.listdir(merged_dir) if name.startswith('chat_history_')]), 12)
+        self.assertEqual(sorted(Manifest(merged_dir).plans['Suite']['shards']), ['0/2', '1/2'])
+
+    def test_merge_reports_missing_units(self):
+        shard_dir = self.run_shard('0/3', jsonl=True)
+        merged_dir = os.path.join(self.work_dir, 'merged')
+        report = merge_outputs([shard_dir, shard_dir], merged_dir)
+
+        self.assertEqual(report.duplicate_units, report.merged_units)
+        self.assertEqual(report.merged_units + len(report.missing_units), 12)
+        self.assertTrue(all(not Shard(0, 3).includes(*unit) for unit in report.missing_units))
+        with open(os.path.join(merged_dir, 'results.jsonl')) as file:
+            records = [json.loads(line) for line in file]
+        self.assertEqual(len([record for record in records if record['type'] == 'round']), report.merged_units)
+        # Each party configuration is written once, although both shard directories contain it
+        party_conf_hashes = [record['party_conf_hash'] for record in records if record['type'] == 'party_conf']
+        self.assertEqual(sorted(party_conf_hashes),
+                         sorted({record['party_conf_hash'] for record in records if record['type'] == 'round'}))
+
+    def test_merge_results_databases(self):
+        shard_dirs = [self.run_shard('0/2', result_format='sqlite'), self.run_shard('1/2', result_format='sqlite')]
+        merged_dir = os.path.join(self.work_dir, 'merged')
+        report = merge_outputs(shard_dirs, merged_dir)
+
+        self.assertEqual(report.missing_units, [])
+        database = ResultsDatabase(os.path.join(merged_dir, RESULTS_DB_FILE_NAME))
+        self.assertEqual(len(list(database.query_rounds(suite='Suite'))), 12)
+        database.close()
+
+    def test_merge_into_existing_output_dir_is_rejected(self):
+        shard_dir = self.run_shard('0/1')
+        with self.assertRaises(ValueError):
+            merge_outputs([shard_dir], shard_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import gzip
+import json
+import asyncio
+import shutil
+import tempfile
+import unittest
+import yaml
+from llm_eval.engine import SessionEngine
+from llm_eval.service import chat_session_to_dict
+from llm_eval.sink import FileSink, JsonlSink, make_sink, party_conf_hash
+
+
+class TestResultSinks(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        with open('tests/data/test_fake_party_conf.yaml', 'r') as file:
+            self.party_conf_dict = yaml.safe_load(file)
+        self.chat_session = asyncio.run(SessionEngine().run_session(self.party_conf_dict))
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def metadata(self, round_index):
+        return {'suite': 'Suite', 'combination_index': 0, 'round_index': round_index, 'init_instr_list': ['a', 'b']}
+
+    def read_records(self, path, opener=open):
+        with opener(path, 'rt') as file:
+            return [json.loads(line) for line in file]
+
+    def test_chat_session_to_dict_matches_llm_party(self):
+        self.assertEqual(chat_session_to_dict(self.chat_session), self.chat_session.to_dict())
+
+    def test_jsonl_sink_writes_party_conf_once(self):
+        sink = JsonlSink(self.output_dir)
+        for round_index in range(3):
+            self.assertEqual(sink.write_round(self.metadata(round_index), self.chat_session, self.party_conf_dict), ['results.jsonl'])
+        sink.close()
+
+        records = self.read_records(os.path.join(self.output_dir, 'results.jsonl'))
+        self.assertEqual([record['type'] for record in records], ['party_conf', 'round', 'round', 'round'])
+        self.assertEqual(records[0]['party_conf_hash'], party_conf_hash(self.party_conf_dict))
+        self.assertEqual(records[3]['party_conf_hash'], records[0]['party_conf_hash'])
+        self.assertEqual(records[3]['round_index'], 2)
+        chat_session = records[1]['chat_session']
+        self.assertNotIn('attendees', chat_session)
+        self.assertEqual(chat_session['turn_count'], 2)
+        self.assertEqual(chat_session['chat_history'][0]['sender'], 'AI Agent 1')
+
+    def test_gzip_per_turn_records(self):
+        sink = make_sink(self.output_dir, 'jsonl', compression='gzip', per_turn=True)
+        sink.write_round(self.metadata(0), self.chat_session, self.party_conf_dict)
+        sink.close()
+
+        records = self.read_records(os.path.join(self.output_dir, 'results.jsonl.gz'), gzip.open)
+        self.assertEqual([record['type'] for record in records], ['party_conf', 'turn', 'turn', 'round'])
+        self.assertEqual(records[2]['turn_index'], 1)
+        self.assertEqual(records[2]['text'], 'Response 2 of gpt-3.5-turbo-1106')
+        self.assertNotIn('chat_history', records[3]['chat_session'])
+
+    def test_jsonl_sink_appends_after_an_interrupted_run(self):
+        sink = JsonlSink(self.output_dir)
+        sink.write_round(self.metadata(0), self.chat_session, self.party_conf_dict)
+        sink.close()
+        path = os.path.join(self.output_dir, 'results.jsonl')
+        # A crash in the middle of a record
+        with open(path, 'a') as file:
+            file.write('{"type":"round","suite":')
+
+        sink = JsonlSink(self.output_dir)
+        sink.write_round(self.metadata(1), self.chat_session, self.party_conf_dict)
+        sink.close()
+        records = self.read_records(path)
+        self.assertEqual([record['type'] for record in records], ['party_conf', 'round', 'round'])
+        self.assertEqual(records[2]['round_index'], 1)
+
+    def test_truncated_compressed_file_is_not_appended_to(self):
+        sink = JsonlSink(self.output_dir, compression='gzip')
+        sink.write_round(self.metadata(0), self.chat_session, self.party_conf_dict)
+        sink.close()
+        path = os.path.join(self.output_dir, 'results.jsonl.gz')
+        with open(path, 'rb+') as file:
+            file.truncate(os.path.getsize(path) - 10)
+        with self.assertRaises(ValueError):
+            JsonlSink(self.output_dir, compression='gzip')
+
+    def test_file_sink_writes_one_file_pair_per_round(self):
+        sink = FileSink(self.output_dir)
+        for round_index in range(2):
+            sink.write_round(self.metadata(round_index), self.chat_session, self.party_conf_dict)
+        self.assertEqual(len(os.listdir(self.output_dir)), 4)
+
+    def test_files_format_rejects_compression(self):
+        with self.assertRaises(ValueError):
+            make_sink(self.output_dir, 'files', compression='gzip')
+
+
+if __name__ == '__main__':
+    unittest.main()
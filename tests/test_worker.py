@@ -0,0 +1,69 @@
+import io
+import os
+import json
+import unittest
+import contextlib
+import yaml
+from llm_eval.main2 import validate_exp_suites, worker_main
+from tests.helpers import SuiteTestCase
+
+
+class TestWorker(SuiteTestCase):
+    instruction_counts = (2, 2)
+
+    def setUp(self):
+        super().setUp()
+        self.write_exp_conf(num_rounds=1)
+
+    def run_worker(self, jobs, *options):
+        jobs_path = os.path.join(self.work_dir, 'jobs.jsonl')
+        with open(jobs_path, 'w') as file:
+            for job in jobs:
+                file.write((job if isinstance(job, str) else json.dumps(job)) + '\n')
+        results_path = os.path.join(self.work_dir, 'results.jsonl')
+        exit_code = 0
+        with contextlib.redirect_stderr(io.StringIO()):
+            try:
+                worker_main(['--jobs', jobs_path, '--results', results_path, '--engine', 'asyncio', *options])
+            except SystemExit as e:
+                exit_code = e.code
+        with open(results_path) as file:
+            return exit_code, [json.loads(line) for line in file]
+
+    def test_one_result_line_per_job(self):
+        suites_conf = os.path.join(self.work_dir, 'suites.yaml')
+        with open(suites_conf, 'w') as file:
+            yaml.dump([self.exp_suite], file)
+        jobs = [
+            {'id': 'inline', 'exp suites': [self.exp_suite], 'output dir': os.path.join(self.work_dir, 'out1')},
+            {'exp suites conf': suites_conf, 'output dir': os.path.join(self.work_dir, 'out2'), 'shard': '0/2'},
+        ]
+        exit_code, results = self.run_worker(jobs, '--result-format', 'jsonl')
+        self.assertEqual(exit_code, 0)
+        self.assertEqual([result['id'] for result in results], ['inline', 2])
+        self.assertTrue(all(result['ok'] and result['error'] is None for result in results))
+        with open(os.path.join(self.work_dir, 'out1', 'results.jsonl')) as file:
+            self.assertEqual(sum(json.loads(line)['type'] == 'round' for line in file), 4)
+
+    def test_invalid_job_does_not_stop_the_worker(self):
+        jobs = [
+            'not json',
+            {'exp suites': [dict(self.exp_suite, **{'exp conf': 'missing.yaml'})], 'output dir': os.path.join(self.work_dir, 'bad')},
+            {'exp suites': [self.exp_suite], 'output dir': os.path.join(self.work_dir, 'good')},
+        ]
+        exit_code, results = self.run_worker(jobs)
+        self.assertEqual(exit_code, 1)
+        self.assertEqual([result['ok'] for result in results], [False, False, True])
+        self.assertIn('JSONDecodeError', results[0]['error'])
+        self.assertIsNotNone(results[1]['error'])
+
+
+    def test_dry_run_validates_without_conducting_sessions(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(io.StringIO()):
+            self.assertTrue(validate_exp_suites([self.exp_suite], 'asyncio'))
+            self.assertFalse(validate_exp_suites([dict(self.exp_suite, **{'party conf': 'missing.yaml'})], 'asyncio'))
+        self.assertEqual(output.getvalue(), 'Suite: 4 combination(s) x 1 round(s), 4 session(s)\n')
+
+if __name__ == '__main__':
+    unittest.main()